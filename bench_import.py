@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""Import time benchmark.
+
+Imports each module in a fresh interpreter, a number of times (after a
+warm-up import, which also writes the bytecode caches), and reports the
+median time of the import (without the interpreter startup), and the
+slowest modules it imports (self time, from python -X importtime). Also
+checks that importing doesn't capture any components.
+
+  ./bench_import.py                        # All edag modules.
+  ./bench_import.py edag parts.edag_linear --repeat 20 --budget 100
+
+With --budget (in ms), exits with an error if any median is over it.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+_MODULES = ["edag", "edag_utils", "edag_components", "edag_dcdc", "edag_eseries", "edag_catalog",
+            "edag_explore", "parts", "parts.edag_linear"]
+
+_CODE = """\
+import time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+import edag
+print(elapsed, len(edag._current_schematic.registered_components), len(edag._current_schematic.scopes))
+"""
+
+
+def _run(args, **kwargs):
+  env = dict(os.environ)
+  env.pop("PYTHONDONTWRITEBYTECODE", None)
+  return subprocess.run([sys.executable] + args, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                        capture_output=True, text=True, check=True, **kwargs)
+
+
+def measure(module:str, repeat:int):
+  """Returns median import time in seconds, numbers of captured components and scopes."""
+  times = []
+  for _ in range(repeat + 1):
+    elapsed, components, scopes = _run(["-c", _CODE.format(module=module)]).stdout.split()
+    times.append(float(elapsed))
+  return statistics.median(times[1:]), int(components), int(scopes)
+
+
+def slowest(module:str, count:int = 5):
+  """Returns list of (self time in seconds, module name) of the slowest imports."""
+  err = _run(["-X", "importtime", "-c", f"import {module}"]).stderr
+  imports = []
+  for line in err.splitlines():
+    if line.startswith("import time:") and "|" in line and "self [us]" not in line:
+      self_us, _, name = line[len("import time:"):].split("|")
+      imports.append((int(self_us) * 1.0e-6, name.strip()))
+  return sorted(imports, reverse=True)[:count]
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Measure import time of edag modules.")
+  parser.add_argument("modules", nargs="*", default=_MODULES)
+  parser.add_argument("--repeat", type=int, default=10)
+  parser.add_argument("--budget", type=float, default=None, help="Maximum median import time, in ms.")
+  args = parser.parse_args(argv)
+  ok = True
+  for module in args.modules:
+    median, components, scopes = measure(module, args.repeat)
+    top = ", ".join(f"{name} {t * 1.0e3:.1f}" for t, name in slowest(module))
+    print(f"{module:24} {median * 1.0e3:7.1f} ms   slowest: {top}")
+    if components or scopes != 1:
+      print(f"  ERROR: importing {module} captured {components} components in {scopes - 1} scopes")
+      ok = False
+    if args.budget is not None and median * 1.0e3 > args.budget:
+      print(f"  ERROR: over the budget of {args.budget} ms")
+      ok = False
+  return 0 if ok else 1
+
+
+if __name__ == '__main__':
+  sys.exit(main())
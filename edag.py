@@ -8,157 +8,695 @@
 # are private and should not be used by users.
 
 
-from collections import namedtuple, defaultdict, Counter
-import traceback
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, defaultdict
+from collections.abc import Mapping
+import contextlib
+import functools
+import io
+import json
+from operator import attrgetter
+import os
+import sys
+import zlib
 
 import edag_utils
 
-Net = namedtuple("net", ["name"])
-
+# Process wide net table. A net is an integer id into it. Nets are interned
+# by (scope path prefix id, local name), where local name is a string, or an
+# integer n for anonymous nets "anon_<n>". Full names are only materialized
+# when needed (i.e. on export).
+_net_parts = []  # net id -> (prefix id or -1 for global nets, local)
+_net_names = []  # net id -> full name, or None if not materialized yet.
+_net_objects = []  # net id -> the Net object. One per id, so equality is mostly an identity check.
+_net_ids = {}    # (prefix id, local) -> net id
+# Scope path prefixes are interned too, one path element at a time, so
+# entering a scope doesn't need to build its full path string.
+_net_prefixes = []         # prefix id -> (parent prefix id or -1, name)
+_net_prefix_strings = []   # prefix id -> full path string, or None if not materialized yet.
+_net_prefix_ids = {}       # (parent prefix id, name) -> prefix id
+
+
+def _intern_net_subprefix(parent_id:int, name:str):
+  key = (parent_id, name)
+  prefix_id = _net_prefix_ids.get(key)
+  if prefix_id is None:
+    prefix_id = _net_prefix_ids[key] = len(_net_prefixes)
+    _net_prefixes.append(key)
+    _net_prefix_strings.append(None)
+  return prefix_id
+
+
+def _intern_net_prefix(path:str):
+  prefix_id = -1
+  for name in path.split("/"):
+    prefix_id = _intern_net_subprefix(prefix_id, name)
+  return prefix_id
+
+
+def _net_prefix_string(prefix_id:int):
+  path = _net_prefix_strings[prefix_id]
+  if path is None:
+    parent_id, name = _net_prefixes[prefix_id]
+    path = name if parent_id < 0 else f"{_net_prefix_string(parent_id)}/{name}"
+    _net_prefix_strings[prefix_id] = path
+  return path
+
+
+class Net(int):
+  """A reference to a net. Nets with the same name are equal.
+
+  Internally an integer id in a process wide net table, so hashing and
+  comparisons are integer operations. Still, a net is always true (even the
+  one with id 0), and never equal to a plain int.
+  """
+  __slots__ = ()
+
+  def __new__(cls, name:str):
+    path, _, local = name.rpartition("/")
+    return cls._from_parts(_intern_net_prefix(path) if path else -1, local)
+
+  @classmethod
+  def _from_parts(cls, prefix_id:int, local:'str_or_int'):
+    if type(local) is str and local.startswith("anon_") and local[5:].isdigit():
+      local = int(local[5:])
+    key = (prefix_id, local)
+    net_id = _net_ids.get(key)
+    if net_id is None:
+      net_id = _net_ids[key] = len(_net_parts)
+      _net_parts.append(key)
+      _net_names.append(None)
+      _net_objects.append(int.__new__(cls, net_id))
+    return _net_objects[net_id]
+
+  def __bool__(self):
+    return True
+
+  def __eq__(self, other):
+    return self is other or (type(other) is Net and int.__eq__(self, other))
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  __hash__ = int.__hash__
+
+  @property
+  def name(self):
+    net_id = int(self)
+    name = _net_names[net_id]
+    if name is None:
+      prefix_id, local = _net_parts[net_id]
+      if type(local) is int:
+        local = f"anon_{local}"
+      name = _net_names[net_id] = local if prefix_id < 0 else f"{_net_prefix_string(prefix_id)}/{local}"
+    return name
+
+  def __repr__(self):
+    return f"net(name={self.name!r})"
+
+  def __reduce__(self):
+    # Net ids are only valid within a process. Re-intern by name.
+    return (Net, (self.name,))
 
-class Schematic(object):
-  def __init__(self):
-    self.anonymous_nets = []
+# Aka node
+Pin = namedtuple("Pin", ["id", "component_global_id", "pin"])
 
-    # This is a stack of scopes. The current scope is at the end.
-    self.scopes = []
-    # This is a tree of scopes. Each scope is persistently stored here, even
-    # after exiting the scope. Tree only is extended on right sides of each
-    # level.
-    self.scopes_tree = []
-    # This is a path in the tree to the current scope.
-    self.scopes_path = [0]
 
-    # This really is a tree, not a stack, because we want to remember all used nets.
-    self.scoped_nets_stack = []
+def _net_name_rank(net:Net):
+  """Higher is better name for a merged net. Named global nets beat scoped
+  named nets, which beat anonymous nets."""
+  prefix_id, local = _net_parts[net]
+  if type(local) is int:
+    return 0
+  if prefix_id >= 0:
+    return 1
+  return 2
 
-    # This is a list of strings, designating a scope path.
-    # NewScope object will store a snapshot of it, as well
-    # pre-computed string for the full path.
-    self.scoped_nets_stack_path = []
 
-    # Initialize the bottom (and current top) of the stack.
-    self.scoped_nets_stack_path.append("root")
+class _NetUnion(object):
+  """Disjoint-set forest of nets (union-find), with path compression and union by rank.
 
-    # Components within a current scope, possibly with scoped nets.
-    # Used by SubschematicCapture
-    self.current_scope = None  # To properly set 'parent'.
-    self.current_scope = self.new_scope(node_i=0)
-    print(self.current_scope)
+  Only nets that were ever merged are stored. Every other net is its own root.
+  """
+  def __init__(self):
+    self.parent = {}
+    self.rank = {}
+    # root -> best named net in the set, used as a name of merged net.
+    self.representative = {}
+    # root -> list of all nets in the set. Merged smaller into larger.
+    self.members = {}
+
+  def find(self, net:Net):
+    parent = self.parent
+    root = net
+    while root in parent:
+      root = parent[root]
+    # Path compression.
+    while net is not root:
+      next_net = parent[net]
+      parent[net] = root
+      net = next_net
+    return root
+
+  def union(self, a:Net, b:Net):
+    parent = self.parent
+    if a in parent:
+      a = self.find(a)
+    if b in parent:
+      b = self.find(b)
+    if a == b:
+      return a
+    rank = self.rank
+    rank_a, rank_b = rank.get(a, 0), rank.get(b, 0)
+    if rank_a < rank_b:
+      a, b, rank_b = b, a, rank_a
+    elif rank_a == rank_b:
+      rank[a] = rank_a + 1
+    parent[b] = a
+    if rank_b:
+      del rank[b]
+
+    representative = self.representative
+    rep_a, rep_b = representative.pop(a, a), representative.pop(b, b)
+    if rep_a != rep_b and _net_name_rank(rep_b) > _net_name_rank(rep_a):
+      rep_a = rep_b
+    if rep_a != a:
+      representative[a] = rep_a
+
+    members = self.members
+    members_a, members_b = members.pop(a, None), members.pop(b, None)
+    if members_a is None:
+      members_a = [a]
+    if members_b is None:
+      members_b = [b]
+    if len(members_a) < len(members_b):
+      members_a, members_b = members_b, members_a
+    members_a.extend(members_b)
+    members[a] = members_a
+    return a
+
+  def resolve(self, net:Net):
+    """Returns a representative net of the set."""
+    root = self.find(net)
+    return self.representative.get(root, root)
+
+  def set_of(self, net:Net):
+    root = self.find(net)
+    return self.members.get(root) or [root]
+
+
+def _int_defaultdict():
+  return defaultdict(int)
 
-    self.scopes.append(self.current_scope)
-    assert self.scopes[0] is self.current_scope
 
-    self.scoped_nets_stack.append([])  # Empty root.
+class Schematic(object):
+  def __init__(self, *, columnar:bool = False, hierarchical:bool = False):
+    self.anonymous_nets = []
 
-    # Insert as a root scope.
-    self.scopes_tree.append(self.current_scope)
+    # This is a tree of scopes, with a single root. Each scope is
+    # persistently stored here (in sub_scopes of its parent), even after
+    # exiting the scope.
+    root = self._NewScope("root", None, 0)
+    self.scopes_tree = [root]
+    # This is a stack of entered scopes. The current scope is at the end.
+    self.scopes = [root]
+    # Components within a current scope, possibly with scoped nets.
+    self.current_scope = root
 
     # All components in a schematic, from all scopes.
-    self.registered_components = []
+    self.columnar = columnar
+    if columnar:
+      import edag_columnar
+      self.registered_components = edag_columnar.ColumnarComponentStore(Component, Pin)
+      self.components_by_global_id = self.registered_components.by_global_id
+    else:
+      self.registered_components = []
+      self.components_by_global_id = {}
+
+    # Connectivity index, updated by register_component.
+    # Net -> list of Pin, in order of registration. With columnar, ColumnarPins
+    # (global_id, pin) integer pairs instead.
+    self.net_pins = {}
+    # Component global_id -> list of nets, one per pin (so might repeat).
+    if columnar:
+      self.component_nets = self.registered_components.nets_by_global_id
+    else:
+      self.component_nets = {}
+
+    # Nets merged with merge() or connect().
+    self.net_union = _NetUnion()
+    # tie components: global_id -> (net a, net b). Optionally collapsed on export.
+    self.ties = {}
+    # global_id of simonly components. Only exported for simulation.
+    self.simonly = set()
+
+    # Subschematic templates recorded by cached_sub, by cache key. These are
+    # the subcircuit definitions.
+    self.templates = {}
+    # _TemplateLog of the template being recorded, or None.
+    self.template_log = None
+    # With hierarchical, repeated cached_sub instances are not expanded at
+    # capture time, but kept here as _Instance, until flatten() is called.
+    # They get global ids, designators and anonymous nets right away, like
+    # expanded ones. Connectivity queries are answered from their templates,
+    # with the help of indexes below.
+    self.hierarchical = hierarchical
+    self.instances = []
+    # Start of global ids range of each pending instance.
+    self.instance_starts = []
+    # External net -> list of (pending instance, template net index).
+    self.instance_nets = {}
+    # Net prefix id of a pending instance scope -> instance.
+    self.instance_prefixes = {}
+    # Pending instances with anonymous nets, and start of their ranges.
+    self.instance_anonymous = []
+    self.instance_anonymous_starts = []
+    # id(template) -> (template, _TemplateIndex).
+    self.template_indexes = {}
+    # All top level (not nested in other templates) cached_sub uses, as
+    # _Instance, in order of creation. Used by hierarchical exporters.
+    self.template_uses = []
 
     # Various ids used within a schematic for designators and referencing.
     self.global_id = 0
+    # Last used designator number, per designator prefix.
     self.component_id = defaultdict(int)
-    self.stable_component_ids = defaultdict(lambda: defaultdict(int))
+    # All designators assigned in this run, or reserved by the loaded
+    # stable ids database.
+    self.used_designators = set()
+    self.stable_component_ids = defaultdict(_int_defaultdict)
     self.stable_net_ids = {}
+    # Call-site signature id (see _callsite_signature) of each component,
+    # indexed by component global_id.
+    self.component_callsites = {}
+    # Scope of each component, indexed by component global_id.
+    self.component_scopes = {}
+
+    # Stable designators database from the previous run. Maps
+    # (scope path, type, name, call-site info) to a list of _StableIdRecord,
+    # in reverse order of creation, so matching can pop() them in original
+    # order. See _assign_designator.
+    self.stable_ids_callsite_index = {}
+    # Same records, by call-site without line numbers (see _callsite_frames)
+    # instead, for call-sites that moved.
+    self.stable_ids_index = {}
+    # Designators of the database reused in this run.
+    self.stable_ids_reused = set()
+    # Call-site infos of components created in this run.
+    self.stable_ids_callsites = set()
+    # Records of designators assigned in this run, saved by save_stable_ids.
+    self.stable_ids_records = []
+    # Scope table (see edag_eco) of the previous run, from the stable ids
+    # database, or None.
+    self.previous_scopes = None
 
   class _NewScope(object):
-    def __init__(self, path:str, parent:'_NewScope_or_None', node_i:int):
-      self.path = list(path)   # Make a copy!
-      self.path_string = "/".join(path)
+    def __init__(self, name:str, parent:'_NewScope_or_None', node_i:int):
+      self.name = name
+      self.parent = parent  # Could be None for the top of scopes
+      # Index with-in nodes (sub_scopes) of the parent of this scope.
+      self.node_i = node_i
+      self.depth = parent.depth + 1 if parent else 0
+      self.net_prefix_id = _intern_net_subprefix(parent.net_prefix_id if parent else -1, name)
       # self.registered_components = []
       self.own_nets = {}
+      # Anonymous scoped nets, numbered per scope.
+      self.anonymous_nets = []
       self.sub_scopes = []
-      # Index with-in nodes (sub_scopes) of the parent of this scope.
-      self.node_i = 0
-      self.parent = parent  # Could be None for the top of scopes
-      # if parent:
-      #   assert self.parent.sub_scopes[self.node_i] is self
-
-  def new_scope(self, node_i):
-    s = self._NewScope(self.scoped_nets_stack_path, self.current_scope, node_i)
-    # assert s.parent.sub_scopes[s.node_i] is s
-    # assert self.current_scope is s.parent
-    return s
+      # Function decorated with Scope, that created this scope, if any.
+      self.function = None
+
+    @property
+    def path_string(self):
+      return _net_prefix_string(self.net_prefix_id)
+
+    @property
+    def path(self):
+      return self.path_string.split("/")
+
+    def __repr__(self):
+      return f"<scope {self.path_string}>"
+
+    def __getstate__(self):
+      # Prefix ids are only valid in this process.
+      state = self.__dict__.copy()
+      state["net_prefix_id"] = self.path_string
+      return state
+
+    def __setstate__(self, state):
+      state["net_prefix_id"] = _intern_net_prefix(state["net_prefix_id"])
+      self.__dict__.update(state)
+
+  def _enter_scope(self, kind:str = "scope", function = None):
+    parent = self.current_scope
+    node_i = len(parent.sub_scopes)
+    scope = self._NewScope(f"{kind}_{node_i}", parent, node_i)
+    scope.function = function
+    parent.sub_scopes.append(scope)
+    self.scopes.append(scope)
+    self.current_scope = scope
+    if _scope_trace is not None:
+      _scope_trace("enter", scope)
+    return scope
+
+  def _exit_scope(self, scope:_NewScope):
+    popped = self.scopes.pop()
+    assert popped is scope, f"Unbalanced scopes: exiting {scope}, but current is {popped}"
+    self.current_scope = scope.parent
+    if _scope_trace is not None:
+      _scope_trace("exit", scope)
 
   def net(self, name:str = None):
     if name:
       assert "/" not in name
-      return Net(name)
+      return Net._from_parts(-1, name)
     l = len(self.anonymous_nets)
-    new_net = Net(f"anon_{l}")
+    new_net = Net._from_parts(-1, l)
     self.anonymous_nets.append(new_net)
     return new_net
 
+  def __enter__(self):
+    assert _current_schematic is self, "Only the current global scope can be used as a context manager"
+    return self
+
+  def __exit__(self, type, value, traceback):
+    global _current_schematic
+    assert _schematic_stack[-1] is self
+    _schematic_stack.pop()
+    _current_schematic = _schematic_stack[-1] if _schematic_stack else None
+
+  def __getstate__(self):
+    # Call-site ids are only valid in this process, so pass call-site infos,
+    # and intern them again on unpickling. Templates are just a cache.
+    state = self.__dict__.copy()
+    state["component_callsites"] = {global_id: _callsite_info(callsite)
+                                    for global_id, callsite in self.component_callsites.items()}
+    state["stable_ids_records"] = [record._replace(callsite=_callsite_info(record.callsite))
+                                   for record in self.stable_ids_records]
+    state["templates"] = {}
+    state["template_log"] = None
+    # Keyed by id.
+    state["template_indexes"] = {}
+    return state
+
+  def __setstate__(self, state):
+    state["component_callsites"] = {global_id: _intern_callsite_info(info)
+                                    for global_id, info in state["component_callsites"].items()}
+    state["stable_ids_records"] = [record._replace(callsite=_intern_callsite_info(record.callsite))
+                                   for record in state["stable_ids_records"]]
+    self.__dict__.update(state)
+
   def register_component(self, component):
     self.registered_components.append(component)
+    if self.columnar:
+      self._index_pins(component)
+      return
+    self.components_by_global_id[component.global_id] = component
+    self.component_nets[component.global_id] = self._index_pins(component)
+
+  def _index_pins(self, component):
+    if type(component.pin_nets) is list:
+      items = enumerate(component.pin_nets)
+    else:
+      items = component.pin_nets.items()
+    net_pins = self.net_pins
+    if self.columnar:
+      new_pins, global_id = self.registered_components.new_pins, component.global_id
+      for pin_key, net in items:
+        if net is not None:
+          pins = net_pins.get(net)
+          if pins is None:
+            pins = net_pins[net] = new_pins()
+          pins.add(global_id, pin_key)
+      return None
+    nets = []
+    for pin_key, net in items:
+      if net is None:
+        continue
+      pins = net_pins.get(net)
+      if pins is None:
+        pins = net_pins[net] = []
+      pins.append(Pin(component.id, component.global_id, pin_key))
+      nets.append(net)
+    return nets
+
+  def _template_index(self, template):
+    entry = self.template_indexes.get(id(template))
+    if entry is None:
+      entry = self.template_indexes[id(template)] = (template, _TemplateIndex(template))
+    return entry[1]
+
+  def _add_instance(self, template, scope):
+    """Add a pending (not expanded) instance of a template in scope. See flatten."""
+    index = self._template_index(template)
+    instance = _Instance(template, scope, self.global_id)
+    instance.anonymous_start = len(self.anonymous_nets)
+    for _ in range(index.anonymous_count):
+      self.net()
+    # Same designators, as if the instance was expanded right now.
+    path = scope.path_string
+    designators = []
+    for c, names, _, callsite in template.components:
+      self.global_id += 1
+      prefix = c.id.rstrip("0123456789")
+      scope_path = "/".join((path,) + names) if names else path
+      designator = self._assign_designator(scope_path, c.type, c.name, prefix, c.own_properties, callsite)
+      self.stable_component_ids[c.type][c.name] = designator
+      designators.append(designator)
+    instance.designators = designators
+    instance.end = self.global_id
+    self.instances.append(instance)
+    self.instance_starts.append(instance.start)
+    for i in index.external:
+      self.instance_nets.setdefault(template.nets[i][1], []).append((instance, i))
+    self.instance_prefixes[scope.net_prefix_id] = instance
+    if index.anonymous_count:
+      self.instance_anonymous.append(instance)
+      self.instance_anonymous_starts.append(instance.anonymous_start)
+    for a, b in template.merges:
+      self.merge(_instance_net(instance, index, a), _instance_net(instance, index, b))
+    return instance
+
+  def flatten(self):
+    """Expand all pending subschematic instances into components and nets.
+
+    Done automatically by exporters, and when a pin of a pending instance is
+    connected. Afterwards components and nets are in the same order, as if
+    instances were expanded when created.
+    """
+    if not self.instances:
+      return
+    instances, self.instances = self.instances, []
+    self.instance_starts, self.instance_nets, self.instance_prefixes = [], {}, {}
+    self.instance_anonymous, self.instance_anonymous_starts = [], []
+    components = self.registered_components
+    last = components[-1].global_id if len(components) else 0
+    # Not part of any template being recorded right now.
+    template_log, self.template_log = self.template_log, None
+    try:
+      for instance in instances:
+        _stamp_template(self, instance.template, instance.scope, instance)
+    finally:
+      self.template_log = template_log
+    if last > instances[0].start:
+      # Some components were created after pending instances.
+      if self.columnar:
+        components.sort()
+      else:
+        components.sort(key=attrgetter("global_id"))
+      first_pin = attrgetter("component_global_id")
+      for pins in self.net_pins.values():
+        if self.columnar:
+          pins.sort()
+        else:
+          pins.sort(key=first_pin)
+      self.net_pins = dict(sorted(self.net_pins.items(), key=lambda item: item[1][0].component_global_id))
+
+  def _pending_nets(self, net:Net):
+    """(pending instance, template index, template net index) of pending
+    instances using a net (not including merged nets)."""
+    found = [(instance, self._template_index(instance.template), i) for instance, i in self.instance_nets.get(net, ())]
+    prefix_id, local = _net_parts[net]
+    if prefix_id < 0:
+      if type(local) is int and self.instance_anonymous:
+        k = bisect_right(self.instance_anonymous_starts, local) - 1
+        if k >= 0:
+          instance = self.instance_anonymous[k]
+          index = self._template_index(instance.template)
+          ordinal = local - instance.anonymous_start
+          if ordinal < index.anonymous_count:
+            found.append((instance, index, index.anonymous[ordinal]))
+      return found
+    names = []
+    instance_prefixes = self.instance_prefixes
+    while prefix_id >= 0:
+      instance = instance_prefixes.get(prefix_id)
+      if instance is not None:
+        index = self._template_index(instance.template)
+        i = index.scoped.get((tuple(reversed(names)), local))
+        if i is not None:
+          found.append((instance, index, i))
+        break
+      prefix_id, name = _net_prefixes[prefix_id]
+      names.append(name)
+    return found
+
+  def _pending_pins(self, net:Net):
+    """Pins of pending instances on a net (not including merged nets)."""
+    pins = []
+    for instance, index, i in self._pending_nets(net):
+      pins.extend(_instance_pins(instance, index, i))
+    return pins
+
+  def _pending_degree(self, net:Net):
+    return sum(len(index.net_pins[i]) for _, index, i in self._pending_nets(net))
+
+  def pins_on_net(self, net:Net):
+    """List of Pin connected to a net (including merged nets). Do not modify it."""
+    net_pins = self.net_pins
+    if net not in self.net_union.parent and net not in self.net_union.members:
+      pins = net_pins.get(net, ())
+      if self.columnar:
+        pins = list(pins)
+      if self.instances:
+        pending = self._pending_pins(net)
+        if pending:
+          pins = sorted(list(pins) + pending, key=attrgetter("component_global_id"))
+      return pins
+    pins = []
+    for member in self.net_union.set_of(net):
+      pins.extend(net_pins.get(member, ()))
+      if self.instances:
+        pins.extend(self._pending_pins(member))
+    return pins
+
+  def net_degree(self, net:Net):
+    if net not in self.net_union.parent and net not in self.net_union.members:
+      degree = len(self.net_pins.get(net, ()))
+      return degree + self._pending_degree(net) if self.instances else degree
+    return sum(len(self.net_pins.get(member, ())) + (self._pending_degree(member) if self.instances else 0)
+               for member in self.net_union.set_of(net))
+
+  def nets_of_component(self, component:'Component_or_global_id'):
+    global_id = component if type(component) is int else component.global_id
+    resolve = self.net_union.resolve
+    if self.instances and global_id not in self.component_nets:
+      k = bisect_left(self.instance_starts, global_id) - 1
+      instance = self.instances[k]
+      assert k >= 0 and global_id <= instance.end, f"No component with global id {global_id}"
+      index = self._template_index(instance.template)
+      pins = instance.template.components[global_id - instance.start - 1][2]
+      pins = pins if type(pins) is list else pins.values()
+      nets = [_instance_net(instance, index, i) for i in pins if i is not None]
+    else:
+      nets = self.component_nets[global_id]
+    return list(dict.fromkeys(resolve(net) for net in nets))
+
+  def find_net(self, net:Net):
+    """Representative net of all nets merged with the net."""
+    return self.net_union.resolve(net)
+
+  def merge(self, net_a:Net, net_b:Net):
+    if self.template_log is not None:
+      self.template_log.merges.append((net_a, net_b))
+    self.net_union.union(net_a, net_b)
+    return self.net_union.resolve(net_a)
+
+  def connect(self, pin:'Pin_or_tuple', net:Net):
+    if isinstance(pin, Pin):
+      if self.instances and pin.component_global_id not in self.components_by_global_id:
+        # Pin of a pending instance.
+        self.flatten()
+      component, pin_key = self.components_by_global_id[pin.component_global_id], pin.pin
+    else:
+      component, pin_key = pin
+    pin_nets = component.pin_nets
+    if type(pin_nets) is list:
+      old_net = pin_nets[pin_key] if pin_key < len(pin_nets) else None
+    else:
+      old_net = pin_nets.get(pin_key)
+    if old_net is not None:
+      return self.merge(old_net, net)
+    # Unconnected pin. Connect it directly.
+    if type(pin_nets) is list:
+      pin_nets.extend([None] * (pin_key + 1 - len(pin_nets)))
+    pin_nets[pin_key] = net
+    if self.columnar:
+      self.registered_components.set_pin_net(component.global_id, pin_key, net)
+    else:
+      self.component_nets[component.global_id].append(net)
+    pins = self.net_pins.get(net)
+    if pins is None:
+      pins = self.net_pins[net] = self.registered_components.new_pins() if self.columnar else []
+    pins.append(Pin(component.id, component.global_id, pin_key))
+    return self.net_union.resolve(net)
+
+  def _add_component(self, scope, name:str, type:str, prefix:str, pin_nets, common_properties,
+                     own_properties, notes, callsite:int, reserved:tuple = None):
+    """Create and register a component. reserved is (global_id, designator) assigned already."""
+    if reserved is None:
+      self.global_id += 1
+      global_id = self.global_id
+      id = self._assign_designator(scope.path_string, type, name, prefix, own_properties, callsite)
+      self.stable_component_ids[type][name] = id
+    else:
+      global_id, id = reserved
+    self.component_callsites[global_id] = callsite
+    self.component_scopes[global_id] = scope
+    c = Component(name, type, id, global_id, pin_nets, common_properties, own_properties, notes)
+    self.register_component(c)
+    if self.template_log is not None:
+      self.template_log.components.append((scope, global_id))
+    return c
+
+  def register_tie(self, component):
+    a, b = component.pin_nets
+    self.ties[component.global_id] = (a, b)
+
+  def _resolver(self, collapse_ties:bool = False):
+    """Function returning the representative net of a net. See net_groups."""
+    resolve = self.net_union.resolve
+    if collapse_ties and self.ties:
+      ties = _NetUnion()
+      for a, b in self.ties.values():
+        ties.union(resolve(a), resolve(b))
+      merged_resolve = resolve
+      resolve = lambda net: ties.resolve(merged_resolve(net))  # noqa: E731
+    return resolve
+
+  def net_groups(self, *, collapse_ties:bool = False):
+    """Returns dict of representative net -> list of Pin, for all connected nets.
+
+    Ordered by first use of each net. With collapse_ties, nets connected by
+    tie components are merged, and the tie components pins are omitted.
+    """
+    resolve = self._resolver(collapse_ties)
+    groups = {}
+    for net, pins in self.net_pins.items():
+      net = resolve(net)
+      group = groups.get(net)
+      if group is None:
+        group = groups[net] = []
+      group.extend(pins)
+    if collapse_ties and self.ties:
+      ties = self.ties
+      for net, pins in groups.items():
+        groups[net] = [pin for pin in pins if pin.component_global_id not in ties]
+    return groups
 
   def Scope(self, scope_args = None):
     def decer(func):
-      def dec(*args, **kwargs):
-        print("BEFORE current scopes stack:", self.scopes)
-        print("BEFORE current scopes tree:", self.scopes_tree)
-        print("BEFORE current scopes path:", self.scopes_path)
-
-        depth = 0
-        node_i = self.scopes_path[depth]
-        node = self.scopes_tree[node_i]
-        # print(f"node_i = {node_i}")
-        print(f"{self.scopes_path}")
-        # This is not super, efficient, but entering new scope shouldn't be too
-        # frequent, and the scopes_tree depth is small, so should be ok.
-        while depth < len(self.scopes_path) - 1:
-          node_i = self.scopes_path[depth]
-          node = node.sub_scopes[node_i]
-          depth += 1
-
-        self.scopes_path.append(len(node.sub_scopes))
-        self.scoped_nets_stack_path.append(f"scope_{node_i}")
-
-        prev_scope = self.current_scope
-        new_scope_ = self.new_scope(node_i)  # NewScope(self.scoped_nets_stack_path)
-        self.current_scope = new_scope_
-
-        self.scopes.append(new_scope_)
-
-        print("DURING current scopes stack:", self.scopes)
-        print("DURING current scopes tree:", self.scopes_tree)
-        print("DURING current scopes path:", self.scopes_path)
-
-        print("running scoped function")
-        r = func(*args, **kwargs)
-        print("finishing scoped function")
-
-        popped_scope = self.scopes.pop()
-        node.sub_scopes.append(popped_scope)
-        self.scopes_path.pop()
-        self.scoped_nets_stack_path.pop()
-
-        self.current_scope = prev_scope
-        print(prev_scope)
-        if __debug__:
-          assert self.current_scope.path_string == "/".join(self.scoped_nets_stack_path)
-          assert len(self.current_scope.path) == len(self.scoped_nets_stack_path)
-          assert self.current_scope.path == self.scoped_nets_stack_path
-          # assert self.current_scope.path is self.scoped_nets_stack_path
-
-        print("AFTER  current scopes stack:", self.scopes)
-        print("AFTER  current scopes tree:", self.scopes_tree)
-        print("AFTER  current scopes path:", self.scopes_path)
-        return r
-      return dec
+      return _scope_decorator(func, self)
     decer.__doc__ = Scope.__doc__  # Self reference
     return decer
 
   def scoped_net(self, name:str = None):
-    path = self.current_scope.path_string
+    scope = self.current_scope
     if name:
       assert "/" not in name
-      return Net(f"{path}/{name}")
-    l = len(self.scoped_nets_stack[-1])
-    new_net = Net(f"{path}/anon_{l}")
-    self.scoped_nets_stack[-1].append(new_net)
+      return Net._from_parts(scope.net_prefix_id, name)
+    new_net = Net._from_parts(scope.net_prefix_id, len(scope.anonymous_nets))
+    scope.anonymous_nets.append(new_net)
     return new_net
 
   # TODO: We might want a functionality to lookup nets up the scopes.
@@ -168,11 +706,145 @@ class Schematic(object):
   def lookup_net(self, name:str):
     pass
 
-  def load_stable_ids(self):
-    pass
-
-  def save_stable_ids(self):
-    print(dict(self.stable_component_ids))
+  def _allocate_designator(self, prefix:str):
+    while True:
+      self.component_id[prefix] += 1
+      designator = prefix + str(self.component_id[prefix])
+      if designator not in self.used_designators:
+        self.used_designators.add(designator)
+        return designator
+
+  def _assign_designator(self, scope_path:str, type:str, name:str, prefix:str, value, callsite:int):
+    """Reuse a designator from the stable ids database, or allocate a new one.
+
+    Records with the same scope path, type and name are matched in order.
+    Components of a call-site known from the database only get records of
+    that call-site (more components than before are new). Components of a new
+    call-site (i.e. lines moved) get records of the same functions (see
+    _callsite_frames), except records of call-sites used in this run, as those
+    belong to components of these call-sites.
+    """
+    designator = None
+    if self.stable_ids_index:
+      key = (scope_path, type, name)
+      info = _callsite_info(callsite)
+      self.stable_ids_callsites.add(info)
+      candidates = self.stable_ids_callsite_index.get(key + (info,))
+      live = ()
+      if candidates is None:
+        candidates = self.stable_ids_index.get(key + (_callsite_frames(info),))
+        live = self.stable_ids_callsites
+      reused = self.stable_ids_reused
+      while candidates:
+        record = candidates.pop()
+        if record.designator in reused or record.callsite in live:
+          continue
+        # Only reuse if the prefix didn't change in the meantime.
+        if record.designator.startswith(prefix) and record.designator[len(prefix):].isdigit():
+          designator = record.designator
+          reused.add(designator)
+          break
+    if designator is None:
+      designator = self._allocate_designator(prefix)
+    self.stable_ids_records.append(_StableIdRecord(designator, type, name, scope_path, repr(value), callsite))
+    return designator
+
+  def load_stable_ids(self, filename:str = None):
+    """Load stable designators database written by a previous run.
+
+    Missing file is not an error, it just means there was no previous run.
+    """
+    filename = filename if filename else _default_stable_ids_filename()
+    try:
+      with open(filename, "r", encoding="utf-8") as f:
+        db = json.load(f)
+    except FileNotFoundError:
+      return
+    assert db.get("version") == _STABLE_IDS_VERSION, \
+           f"Unsupported stable ids database version {db.get('version')} in {filename}"
+    index, callsite_index = self.stable_ids_index, self.stable_ids_callsite_index
+    # JSON lists back to (filename, lineno, function name) tuples.
+    callsites = [tuple(tuple(frame) for frame in info) for info in db["callsites"]]
+    for designator, type, name, scope_path, value, callsite in db["components"]:
+      if designator in self.used_designators:
+        # Already assigned in this run, before the database was loaded.
+        continue
+      record = _StableIdRecord(designator, type, name, scope_path, value, callsites[callsite])
+      index.setdefault((scope_path, type, name, _callsite_frames(record.callsite)), []).append(record)
+      callsite_index.setdefault((scope_path, type, name, record.callsite), []).append(record)
+      # Reserve, so new components never take a designator of an old one.
+      self.used_designators.add(designator)
+    for records in index.values():
+      records.reverse()
+    for records in callsite_index.values():
+      records.reverse()
+    self.previous_scopes = db.get("scopes", [])
+
+  def save_stable_ids(self, filename:str = None):
+    """Atomically write stable designators database of all components created in this run.
+
+    It also contains the scope table (see edag_eco), for diffs with the next run.
+    """
+    import edag_eco
+    filename = filename if filename else _default_stable_ids_filename()
+    callsites = []
+    callsite_index = {}
+    components = []
+    for record in self.stable_ids_records:
+      i = callsite_index.get(record.callsite)
+      if i is None:
+        i = callsite_index[record.callsite] = len(callsites)
+        callsites.append(_callsite_info(record.callsite))
+      components.append([record.designator, record.type, record.name, record.scope_path, record.value, i])
+    db = {"version": _STABLE_IDS_VERSION, "callsites": callsites, "components": components,
+          "scopes": edag_eco.scope_table(self)}
+    _atomic_write(filename, json.dumps(db, separators=(",", ":")).encode("utf-8"))
+
+
+_STABLE_IDS_VERSION = 1
+
+# callsite is an id from _callsite_signature in a current run, or a call-site
+# info (see _callsite_info) for records loaded from a file.
+_StableIdRecord = namedtuple("_StableIdRecord", ["designator", "type", "name", "scope_path", "value", "callsite"])
+
+# Public: File name of the stable ids database. If None, it is derived from the
+# name of the main script, i.e. "myboard.py" => "myboard.edag_ids.json".
+stable_ids_filename = None
+
+
+def _default_stable_ids_filename():
+  if stable_ids_filename:
+    return stable_ids_filename
+  main = sys.argv[0] if sys.argv and sys.argv[0] not in ("", "-c", "-m") else "edag"
+  return os.path.splitext(main)[0] + ".edag_ids.json"
+
+
+def _atomic_write(filename:str, data:bytes):
+  """Write data to a file, so readers either see the old or the new content.
+
+  Keeps the permissions of an existing file. New files get the usual ones
+  (0666 without umask), not 0600 of the temporary file.
+  """
+  import stat
+  import tempfile
+  directory = os.path.dirname(os.path.abspath(filename))
+  try:
+    mode = stat.S_IMODE(os.stat(filename).st_mode)
+  except FileNotFoundError:
+    umask = os.umask(0)
+    os.umask(umask)
+    mode = 0o666 & ~umask
+  fd, tmp_filename = tempfile.mkstemp(prefix=".tmp_", dir=directory)
+  try:
+    with os.fdopen(fd, "wb") as f:
+      f.write(data)
+      f.flush()
+      os.fchmod(f.fileno(), mode)
+      os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+  except BaseException:
+    os.unlink(tmp_filename)
+    raise
 
 
 # The top of the stack is the schematic we are working with now.
@@ -184,8 +856,26 @@ _schematic_stack = []
 # Alias to the top of the stack, to speed up operations.
 _current_schematic = None
 
+# Hook called on scope entry and exit. See trace_scopes.
+_scope_trace = None
+
 
-def NewGlobalScope():
+def trace_scopes(hook):
+  """Install a scope tracing hook, for debugging.
+
+  hook(event, scope) is called with event "enter" or "exit" every time a scope
+  is entered or exited. Use None to disable tracing. Returns previous hook.
+
+  Example:
+    trace_scopes(print)
+  """
+  global _scope_trace
+  previous = _scope_trace
+  _scope_trace = hook
+  return previous
+
+
+def NewGlobalScope(*, columnar:bool = False, hierarchical:bool = False):
   """This create a completly new global schematic scope.
 
   This can be created inside currently captured schematic,
@@ -203,9 +893,24 @@ def NewGlobalScope():
 
   To pass some common circuits, they need to be recreated at the moment,
   which can be done easily via a factory function.
+
+  The returned schematic can be used as a context manager, which ends the
+  global scope (restoring the previous one) on exit:
+
+    with NewGlobalScope() as schematic:
+      mycircuit()
+
+  With columnar=True, components are stored in a compact column oriented
+  store (see edag_columnar), which uses much less memory for very large
+  designs. Components are then handed out as views, that are recreated on
+  each access.
+
+  With hierarchical=True, repeated cached_sub instances are kept as
+  references to a shared subcircuit definition, and are only expanded into
+  components when needed (see Schematic.flatten).
   """
   global _schematic_stack, _current_schematic
-  new_schematic = Schematic()
+  new_schematic = Schematic(columnar=columnar, hierarchical=hierarchical)
   _schematic_stack.append(new_schematic)
   _current_schematic = _schematic_stack[-1]
   return new_schematic
@@ -229,7 +934,7 @@ def net(name:str = None):
 
 
 """Global ground"""
-GND = lambda: Net("GND")
+GND = lambda: Net._from_parts(-1, "GND")
 
 
 def Scope(scope_args = None):
@@ -267,36 +972,67 @@ def Scope(scope_args = None):
   ensuring designator stability, but they are less reliable than explicit scopes
   and names.
   """
-  global _current_schematic
-  return _current_schematic.Scope(scope_args)
-
-
-"""
-BEFORE current scopes stack: []
-BEFORE current scopes tree: []
-BEFORE current scopes path: [0]
-DURING current scopes stack: [{}]
-DURING current scopes tree: []
-DURING current scopes path: [0, 0]
-running scoped function
-finishing scoped function
-AFTER  current scopes stack: []
-AFTER  current scopes tree: [{}]
-AFTER  current scopes path: [0]
-BEFORE current scopes stack: []
-BEFORE current scopes tree: [{}]
-BEFORE current scopes path: [0]
-DURING current scopes stack: [{}]
-DURING current scopes tree: [{}]
-DURING current scopes path: [0, 1]
-running scoped function
-finishing scoped function
-AFTER  current scopes stack: []
-AFTER  current scopes tree: [{}, {}]
-AFTER  current scopes path: [0]
-"""
-
-# TODO(baryluk): Add tests for this.
+  def decer(func):
+    return _scope_decorator(func)
+  return decer
+
+
+def _scope_decorator(func, schematic:Schematic = None):
+  """Wraps func so each call runs in a new scope, of the given or the current schematic."""
+  @functools.wraps(func)
+  def dec(*args, **kwargs):
+    s = schematic if schematic is not None else _current_schematic
+    # The wrapper (not func), so it can be pickled by name.
+    scope = s._enter_scope("scope", dec)
+    try:
+      return func(*args, **kwargs)
+    finally:
+      s._exit_scope(scope)
+  return dec
+
+
+def pins_on_net(net:Net):
+  """Return a list of all pins (as Pin tuples) connected to the net so far.
+
+  The connectivity index is maintained as components are created, so this
+  is a constant time operation, and can be used during capture, i.e. in
+  parametric subcircuits. The returned list must not be modified.
+  """
+  return _current_schematic.pins_on_net(net)
+
+
+def net_degree(net:Net):
+  """Return number of pins connected to the net so far."""
+  return _current_schematic.net_degree(net)
+
+
+def component_nets(component):
+  """Return a list of distinct nets connected to any pin of a component.
+
+  component is a Component returned by make_component, or its global_id.
+  """
+  return _current_schematic.nets_of_component(component)
+
+
+def merge(net_a:Net, net_b:Net):
+  """Merge two nets into one physical net. Returns the merged net.
+
+  Merging is transitive, and can be done at any time, also after components
+  were connected to these nets. The merged net is named after the best named
+  net in the set (named global nets are preferred over scoped and anonymous
+  ones).
+  """
+  return _current_schematic.merge(net_a, net_b)
+
+
+def connect(pin, net:Net):
+  """Connect a component pin to a net, after the component was created.
+
+  pin is a Pin (i.e. from pins_on_net) or a tuple (component, pin key). If the
+  pin is already connected to some net, that net is merged with the net.
+  Returns the (possibly merged) net.
+  """
+  return _current_schematic.connect(pin, net)
 
 
 def scoped_net(name=None):
@@ -338,6 +1074,190 @@ import edag_notes
 # Public: Default number of digits in the numeric part of a designator. i.e. 3 => "C001"
 designator_digits = 1
 
+# Public: Number of user frames (skipping edag internals) recorded in the
+# call-site signature of each component. Used for designator stability.
+callsite_depth = 3
+
+
+# Files that are never part of a call-site signature. Frames from these files
+# are skipped when walking the stack.
+_callsite_skip_filenames = {__file__, edag_notes.__file__, contextlib.__file__}
+
+# code object -> bool, if frames of this code should be skipped.
+_callsite_skip_codes = {}
+
+# (code, offset, code, offset, ...) -> small integer.
+_callsite_ids = {}
+
+# small integer -> tuple of (filename, lineno, function name), from innermost
+# frame outward.
+_callsite_infos = []
+
+
+def _callsite_signature(depth=None):
+  """Return a small integer identifying the current call-site.
+
+  Walks raw frames of the caller (no source lines are read), skipping
+  contextlib and edag internals, up to `depth` (default `callsite_depth`)
+  frames. Signatures are interned by (code object, instruction offset) of each
+  frame, so the same call-site always maps to the same integer within a
+  process.
+  """
+  depth = callsite_depth if depth is None else depth
+  key = []
+  frames = []
+  frame = sys._getframe(1)
+  while frame is not None and len(frames) < depth:
+    code = frame.f_code
+    skip = _callsite_skip_codes.get(code)
+    if skip is None:
+      skip = _callsite_skip_codes[code] = code.co_filename in _callsite_skip_filenames
+    if not skip:
+      key.append(code)
+      key.append(frame.f_lasti)
+      frames.append(frame)
+    frame = frame.f_back
+  key = tuple(key)
+  callsite = _callsite_ids.get(key)
+  if callsite is None:
+    callsite = _callsite_ids[key] = len(_callsite_infos)
+    _callsite_infos.append(tuple((f.f_code.co_filename, f.f_lineno, f.f_code.co_name) for f in frames))
+  return callsite
+
+
+def _callsite_info(callsite):
+  """Return tuple of (filename, lineno, function name) for a call-site id."""
+  return _callsite_infos[callsite]
+
+
+# tuple of (filename, lineno, function name) -> small integer, for call-sites
+# received from other processes.
+_callsite_info_ids = {}
+
+
+def _callsite_frames(info):
+  """Call-site info without line numbers, so it stays the same when lines move."""
+  return tuple((filename, function) for filename, _, function in info)
+
+
+def _intern_callsite_info(info):
+  """Return a call-site id for a call-site info, i.e. from _callsite_info in other process."""
+  callsite = _callsite_info_ids.get(info)
+  if callsite is None:
+    callsite = _callsite_info_ids[info] = len(_callsite_infos)
+    _callsite_infos.append(info)
+  return callsite
+
+
+class PinMap(Mapping):
+  """Immutable map of pin keys to pads (an int, or a tuple of ints).
+
+  Validated once, when created: key and pad types, duplicate pads, and if
+  package is given, pads against the pin count of the package (see
+  edag_packages.pin_count). Define pin maps of a part once (i.e. at module
+  level), and pass them as common_properties['pin_map']. Then make_component
+  only compares pin_nets keys with keys of the pin map. Plain dict pin maps
+  are converted to PinMap (and cached) by make_component.
+  """
+  __slots__ = ("_pads", "package", "pin_keys", "list_size")
+
+  def __init__(self, pin_map, package:str = None):
+    assert isinstance(pin_map, (dict, Mapping)), f"pin_map must be a dict, but found: {pin_map}"
+    pads = {}
+    numbers = {}
+    for pin_key, pin_list in pin_map.items():
+      assert isinstance(pin_key, str) or isinstance(pin_key, int), f"pin_map keys must be str or int, but found: {pin_key}: {pin_list}"
+
+      assert isinstance(pin_list, (list, tuple)) or isinstance(pin_list, int), f"pin_map values must be int or list of ints, but found: {pin_key}: {pin_list}"
+      pads[pin_key] = pin_list if isinstance(pin_list, int) else tuple(pin_list)
+      if isinstance(pin_list, int):
+        pin_list = [pin_list]
+      assert len(pin_list) > 0, f"pin_map value should be not an empty list, but found: {pin_key}: {pin_list}"  # TODO(baryluk): Maybe there is a use for empty lists?
+      for pin in pin_list:
+        assert pin not in numbers, f"Duplicate pin {pin} found in {pin_key} and {numbers.get(pin)}"
+        numbers[pin] = pin_key
+    if package is not None:
+      import edag_packages
+      count = edag_packages.pin_count(package)
+      if count is not None:
+        assert len(numbers) <= count, f"pin_map has {len(numbers)} pins, but {package} package has only {count}"
+        for pin, pin_key in numbers.items():
+          assert 1 <= pin <= count, f"Pin {pin} of {pin_key} doesn't exist in {package} package with {count} pins"
+    self._pads = pads
+    self.package = package
+    self.pin_keys = frozenset(pads)
+    # For pin_nets lists, pin keys must be 0, 1, ..., list_size - 1.
+    self.list_size = len(pads) if self.pin_keys == frozenset(range(len(pads))) else None
+
+  def __getitem__(self, pin_key):
+    return self._pads[pin_key]
+
+  def __iter__(self):
+    return iter(self._pads)
+
+  def __len__(self):
+    return len(self._pads)
+
+  def __contains__(self, pin_key):
+    return pin_key in self._pads
+
+  def __hash__(self):
+    return hash(self.pin_keys)
+
+  def __repr__(self):
+    return f"PinMap({self._pads!r})" if self.package is None else f"PinMap({self._pads!r}, {self.package!r})"
+
+  def __reduce__(self):
+    return (PinMap, (self._pads, self.package))
+
+  def check(self, pin_nets:'DICT_OR_LIST'):
+    """Assert that pin_nets has exactly the pins of this pin map."""
+    if isinstance(pin_nets, dict):
+      if pin_nets.keys() == self.pin_keys:
+        return
+      # Assert that every used pin is in the pin_map.
+      for pin_key in pin_nets.keys():
+        assert pin_key in self._pads, f"A pin key {pin_key} from pin_net dict, not found in pin_map"
+      # Check the reverse. That every pin in pin_map is used in the pin_nets.
+      # TODO(baryluk): Possibly using metadata in the pin_map to tell which ones
+      # are OK to be unconnected.
+      for pin_key in self._pads:
+        assert pin_key in pin_nets, f"A pin_key {pin_key} from pin_map key, not found in pin_nets dict"
+    elif isinstance(pin_nets, list):
+      if len(pin_nets) == self.list_size and all(net is not None for net in pin_nets):
+        return
+      for pin_key, _ in enumerate(pin_nets):
+        assert pin_key in self._pads, f"A pin key {pin_key} from pin_net list, not found in pin_map"
+      for pin_key in self._pads:
+        assert isinstance(pin_key, int)
+        assert pin_nets[pin_key] is not None, f"A pin_key {pin_key} from pin_map key, not found in pin_nets list"  # What? This looks like  a typo maybe?
+    else:
+      assert False, f"Impossible condition. Internal error or incorrect type for pin_nets parameter (can be dict or list), found: {type(pin_nets)}"
+
+
+# Plain dict pin maps (as hashable tuples) -> PinMap.
+_pin_maps = {}
+
+
+def _as_pin_map(pin_map, package:str = None):
+  """PinMap of a pin_map from common_properties, validated only the first time it is seen.
+
+  package is the package from common_properties, used to validate plain dict
+  pin maps (PinMap has own).
+  """
+  if type(pin_map) is PinMap:
+    return pin_map
+  assert isinstance(pin_map, dict), f"pin_map must be a dict or PinMap, but found: {pin_map}"
+  try:
+    key = (package,) + tuple((pin_key, tuple(pins) if type(pins) is list else pins)
+                             for pin_key, pins in pin_map.items())
+    result = _pin_maps.get(key)
+  except TypeError:  # Unhashable, so certainly invalid.
+    return PinMap(pin_map, package)
+  if result is None:
+    result = _pin_maps[key] = PinMap(pin_map, package)
+  return result
+
 
 def make_component(name:str,
                    type:str,
@@ -410,69 +1330,22 @@ def make_component(name:str,
   """
   global _current_schematic
 
-  _current_schematic.global_id += 1
-
-  tb = traceback.extract_stack()
-  for tf in tb[:-1]:
-    if 'contextlib.py' in tf.filename:
-      continue
-    # print(f"    {tf.filename}:{tf.lineno} function {tf.name} : {tf.line} # Locals: {tf.locals}")
+  callsite = _callsite_signature()
 
   # designator prefix
   prefix = prefix if prefix else type
 
-  if _current_schematic.stable_component_ids[type][name] and False:
-    id = _current_schematic.stable_component_ids[type][name]
-  else:
-    _current_schematic.component_id[type] += 1
-    id = prefix + str(_current_schematic.component_id[type])
-    _current_schematic.stable_component_ids[type][name] = id
   full_notes = notes + edag_notes.shared_notes_stack
 
   assert isinstance(pin_nets, dict) or isinstance(pin_nets, list)
 
   if common_properties and 'pin_map' in common_properties:
-    pin_map = common_properties['pin_map']
-    assert isinstance(pin_map, dict)
-
-    _all_pins_numbers = {}
-    for pin_key, pin_list in pin_map.items():
-      assert isinstance(pin_key, str) or isinstance(pin_key, int), f"pin_map keys must be str or int, but found: {pin_key}: {pin_list}"
-
-      assert isinstance(pin_list, list) or isinstance(pin_list, int), f"pin_map values must be int or list of ints, but found: {pin_key}: {pin_list}"
-      if isinstance(pin_list, int):
-        pin_list = [pin_list]
-      assert len(pin_list) > 0, f"pin_map value should be not an empty list, but found: {pin_key}: {pin_list}"  # TODO(baryluk): Maybe there is a use for empty lists?
-      for pin in pin_list:
-        if pin in _all_pins_numbers:
-          assert False, f"Duplicate pin {pin} found in {pin_key} and {_all_pins_numbers[pin]}"
-      for pin in pin_list:
-        _all_pins_numbers[pin] = pin_key
-
-    # Assert that every used pin is in the pin_map.
-    if isinstance(pin_nets, dict):
-      for pin_key in pin_nets.keys():
-        assert pin_key in pin_map, f"A pin key {pin_key} from pin_net dict, not found in pin_map"
-    elif isinstance(pin_nets, list):
-      for pin_key, _ in enumerate(pin_nets):
-        assert pin_key in pin_map, f"A pin key {pin_key} from pin_net list, not found in pin_map"
-    else:
-      assert False, f"Impossible condition. Internal error or incorrect type for pin_nets parameter (can be dict or list), found: {type(pin_nets)}"
-
-    # Check the reverse. That every pin in pin_map is used in the pin_nets.
-    # TODO(baryluk): Possibly using metadata in the pin_map to tell which ones
-    # are OK to be unconnected.
-    for pin_key, pin_list in pin_map.items():
-      if isinstance(pin_nets, dict):
-        assert pin_key in pin_nets, f"A pin_key {pin_key} from pin_map key, not found in pin_nets dict"
-      elif isinstance(pin_nets, list):
-        assert isinstance(pin_key, int)
-        assert pin_nets[pin_key] is not None, f"A pin_key {pin_key} from pin_map key, not found in pin_nets list"  # What? This looks like  a typo maybe?
-      else:
-        assert False
+    _as_pin_map(common_properties['pin_map'], common_properties.get('package')).check(pin_nets)
 
-  c = Component(name, type, id, _current_schematic.global_id, pin_nets, common_properties, own_properties, full_notes)
-  _current_schematic.register_component(c)
+  c = _current_schematic._add_component(_current_schematic.current_scope, name, type, prefix, pin_nets,
+                                        common_properties, own_properties, full_notes, callsite)
+  if simonly:
+    _current_schematic.simonly.add(c.global_id)
   return c
 
 
@@ -487,13 +1360,11 @@ class SubschematicCapture(object):
     global _current_schematic
     self.name = name
     self.parent_schematic = _current_schematic
-    # self.path = path + [name]
 
   def __enter__(self):
     global _current_schematic
     assert self.parent_schematic is _current_schematic
-    self.old_state = _current_schematic.current_scope
-    _current_schematic.current_scope = _current_schematic.new_scope(node_i=0)
+    self.scope = _current_schematic._enter_scope(self.name if self.name else "sub")
     return self
 
   def captured(self):
@@ -504,8 +1375,8 @@ class SubschematicCapture(object):
   def __exit__(self, type, value, traceback):
     global _current_schematic
     assert self.parent_schematic is _current_schematic
-    self.captured = _current_schematic.current_scope
-    _current_schematic.current_scope = self.old_state
+    self.captured = self.scope
+    _current_schematic._exit_scope(self.scope)
     return
 
 
@@ -527,56 +1398,804 @@ def sub(function, *args, **kwargs):
     return sc.captured()
 
 
-# Aka node
-Pin = namedtuple("Pin", ["id", "component_global_id", "pin"])
+class _TemplateLog(object):
+  """Components (as (scope, global_id)) and merges made while recording a template."""
+  def __init__(self):
+    self.components = []
+    self.merges = []
+
+
+# A relocatable capture of a subschematic. See cached_sub.
+#   scopes: scope tree, as nested (name, function, anonymous nets count, children).
+#   nets: all used nets, as ("external", net), ("anonymous",), or
+#         ("scoped", scope names relative to the captured scope, local name).
+#   components: (component, scope names, pin nets as indices into nets, callsite).
+#   merges: pairs of indices into nets.
+#   ties: indices into components, of tie components.
+#   simonly: indices into components, of simonly components.
+_Template = namedtuple("_Template", ["scopes", "nets", "components", "merges", "ties", "simonly"])
+
+
+class _Instance(object):
+  """Use of a template in a scope. Its components have global ids in the
+  (start, end] range.
+
+  Pending instances (see Schematic.flatten) also have designators of their
+  components, and the start of the range of their anonymous nets.
+  """
+  __slots__ = ("template", "scope", "start", "end", "designators", "anonymous_start")
+
+  def __init__(self, template:_Template, scope, start:int = None, end:int = None):
+    self.template = template
+    self.scope = scope
+    self.start = start
+    self.end = end
+    self.designators = None
+    self.anonymous_start = None
+
+
+class _TemplateIndex(object):
+  """Lookups into a template, for connectivity queries of pending instances."""
+  def __init__(self, template:_Template):
+    # Indices of external nets, and of anonymous nets (in order of creation).
+    self.external = []
+    self.anonymous = []
+    # (scope names, local name) -> index of a scoped net.
+    self.scoped = {}
+    # Ordinal of anonymous net, or None, for each net.
+    self.anonymous_ordinals = []
+    for i, relocatable in enumerate(template.nets):
+      kind = relocatable[0]
+      self.anonymous_ordinals.append(len(self.anonymous) if kind == "anonymous" else None)
+      if kind == "external":
+        self.external.append(i)
+      elif kind == "anonymous":
+        self.anonymous.append(i)
+      else:
+        self.scoped[relocatable[1:]] = i
+    self.anonymous_count = len(self.anonymous)
+    # Net index -> list of (component index, pin key).
+    self.net_pins = [[] for _ in template.nets]
+    for k, (_, _, pins, _) in enumerate(template.components):
+      for pin_key, i in (enumerate(pins) if type(pins) is list else pins.items()):
+        if i is not None:
+          self.net_pins[i].append((k, pin_key))
+
+
+def _instance_net(instance:_Instance, index:_TemplateIndex, i:int):
+  """Net of a pending instance, for a template net index."""
+  relocatable = instance.template.nets[i]
+  kind = relocatable[0]
+  if kind == "external":
+    return relocatable[1]
+  if kind == "anonymous":
+    return Net._from_parts(-1, instance.anonymous_start + index.anonymous_ordinals[i])
+  _, names, local = relocatable
+  prefix_id = instance.scope.net_prefix_id
+  for name in names:
+    prefix_id = _intern_net_subprefix(prefix_id, name)
+  return Net._from_parts(prefix_id, local)
+
+
+def _instance_pins(instance:_Instance, index:_TemplateIndex, i:int):
+  """Pins of a pending instance, on a template net index."""
+  start, designators = instance.start, instance.designators
+  return [Pin(designators[k], start + 1 + k, pin_key) for k, pin_key in index.net_pins[i]]
+
+
+def _scope_template(scope):
+  return (scope.name, scope.function, len(scope.anonymous_nets),
+          tuple(_scope_template(sub_scope) for sub_scope in scope.sub_scopes))
+
+
+def _relocatable_net(net:Net, root_prefix_id:int, anonymous_start:int):
+  prefix_id, local = _net_parts[net]
+  if prefix_id < 0:
+    if type(local) is int and local >= anonymous_start:
+      return ("anonymous",)
+    return ("external", net)
+  names = []
+  while prefix_id != root_prefix_id:
+    if prefix_id < 0:
+      # Scoped net of some other scope, i.e. passed as an argument.
+      return ("external", net)
+    prefix_id, name = _net_prefixes[prefix_id]
+    names.append(name)
+  return ("scoped", tuple(reversed(names)), local)
+
+
+def _record_template(schematic:Schematic, scope, log:_TemplateLog, anonymous_start:int):
+  root_prefix_id = scope.net_prefix_id
+  nets = []
+  net_index = {}
+
+  def index(net):
+    if net is None:
+      return None
+    i = net_index.get(net)
+    if i is None:
+      i = net_index[net] = len(nets)
+      nets.append(_relocatable_net(net, root_prefix_id, anonymous_start))
+    return i
+
+  scope_names = {scope: ()}
+
+  def names_of(component_scope):
+    names = scope_names.get(component_scope)
+    if names is None:
+      names = scope_names[component_scope] = names_of(component_scope.parent) + (component_scope.name,)
+    return names
+
+  components = []
+  ties = []
+  simonly = []
+  for component_scope, global_id in log.components:
+    # Re-read the component, as pins could be connected after creation.
+    c = schematic.components_by_global_id[global_id]
+    if type(c.pin_nets) is list:
+      pins = [index(net) for net in c.pin_nets]
+    else:
+      pins = {pin_key: index(net) for pin_key, net in c.pin_nets.items()}
+    if global_id in schematic.ties:
+      ties.append(len(components))
+    if global_id in schematic.simonly:
+      simonly.append(len(components))
+    components.append((c, names_of(component_scope), pins, schematic.component_callsites[global_id]))
+  merges = [(index(a), index(b)) for a, b in log.merges]
+  return _Template(_scope_template(scope), nets, components, merges, ties, simonly)
+
+
+def _stamp_scopes(scope, scope_template, scopes:dict, names:tuple):
+  _, _, anonymous_count, children = scope_template
+  scopes[names] = scope
+  scope.anonymous_nets = [Net._from_parts(scope.net_prefix_id, i) for i in range(anonymous_count)]
+  for child in children:
+    sub_scope = Schematic._NewScope(child[0], scope, len(scope.sub_scopes))
+    sub_scope.function = child[1]
+    scope.sub_scopes.append(sub_scope)
+    _stamp_scopes(sub_scope, child, scopes, names + (child[0],))
+
+
+def _stamp_template(schematic:Schematic, template:_Template, scope, instance:_Instance = None):
+  """Expand a template in scope. A pending instance has global ids, designators
+  and anonymous nets reserved, and merges done already."""
+  scopes = {}
+  _stamp_scopes(scope, template.scopes, scopes, ())
+
+  nets = []
+  anonymous = instance.anonymous_start if instance is not None else None
+  for relocatable in template.nets:
+    kind = relocatable[0]
+    if kind == "external":
+      nets.append(relocatable[1])
+    elif kind == "anonymous":
+      if anonymous is None:
+        nets.append(schematic.net())
+      else:
+        nets.append(Net._from_parts(-1, anonymous))
+        anonymous += 1
+    else:
+      _, names, local = relocatable
+      nets.append(Net._from_parts(scopes[names].net_prefix_id, local))
+
+  components = []
+  for k, (c, names, pins, callsite) in enumerate(template.components):
+    if type(pins) is list:
+      pin_nets = [None if i is None else nets[i] for i in pins]
+    else:
+      pin_nets = {pin_key: (None if i is None else nets[i]) for pin_key, i in pins.items()}
+    prefix = c.id.rstrip("0123456789")
+    reserved = (instance.start + 1 + k, instance.designators[k]) if instance is not None else None
+    components.append(schematic._add_component(scopes[names], c.name, c.type, prefix, pin_nets,
+                                               c.common_properties, c.own_properties, list(c.notes), callsite,
+                                               reserved))
+  for i in template.ties:
+    schematic.register_tie(components[i])
+  for i in template.simonly:
+    schematic.simonly.add(components[i].global_id)
+  if instance is None:
+    for a, b in template.merges:
+      schematic.merge(nets[a], nets[b])
+
+
+def cached_sub(function, *args, **kwargs):
+  """Like sub, but memoizes the subschematic as a template.
+
+  The first call with a given function, arguments and shared notes runs the
+  function and records everything it created. Subsequent calls with equal
+  (hashable) arguments don't run the function again, but create a copy of
+  the recorded components, with new designators, and with scoped and
+  anonymous nets created by the function replaced by fresh ones, as if the
+  function was called again. Nets passed in arguments and global named nets
+  are shared. If arguments are not hashable, this is the same as sub.
+
+  function must be deterministic, and must not modify components created
+  outside of it (i.e. connect their pins), as this is not replayed.
+
+  In a hierarchical schematic (see NewGlobalScope), the copies are not
+  created right away, only a reference to the template is kept, so many
+  instances of a subschematic use little memory and time. Still, they get
+  designators right away, and connectivity queries see them. They are
+  expanded on export.
 
+  Example:
 
-def export():
+    for i in range(64):
+      cached_sub(psu, lm7805)
+  """
+  global _current_schematic
+  key = (function, args, tuple(sorted(kwargs.items())), tuple(edag_notes.shared_notes_stack))
+  try:
+    hash(key)
+  except TypeError:
+    return sub(function, *args, **kwargs)
+  schematic = _current_schematic
+  template = schematic.templates.get(key)
+  top_level = schematic.template_log is None
+  start = schematic.global_id
+  with SubschematicCapture() as sc:
+    if template is not None:
+      if schematic.hierarchical and top_level:
+        schematic.template_uses.append(schematic._add_instance(template, sc.scope))
+        return sc.captured()
+      _stamp_template(schematic, template, sc.scope)
+      if top_level:
+        schematic.template_uses.append(_Instance(template, sc.scope, start, schematic.global_id))
+      return sc.captured()
+    log, previous_log = _TemplateLog(), schematic.template_log
+    schematic.template_log = log
+    anonymous_start = len(schematic.anonymous_nets)
+    try:
+      function(*args, **kwargs)
+    finally:
+      schematic.template_log = previous_log
+      if previous_log is not None:
+        previous_log.components.extend(log.components)
+        previous_log.merges.extend(log.merges)
+    template = schematic.templates[key] = _record_template(schematic, sc.scope, log, anonymous_start)
+    if top_level:
+      schematic.template_uses.append(_Instance(template, sc.scope, start, schematic.global_id))
+    return sc.captured()
+
+
+def _parallel_worker(function, args, kwargs, anonymous_start:int, shared_notes:list):
+  """Captures function in a new global scope, and returns it as a _Template."""
+  edag_notes.shared_notes_stack[:] = shared_notes
+  with NewGlobalScope() as schematic:
+    # Reserve anonymous nets of the parent, as they could be passed in args.
+    schematic.anonymous_nets.extend(Net._from_parts(-1, i) for i in range(anonymous_start))
+    log = schematic.template_log = _TemplateLog()
+    # "worker" scopes are never created in the parent, so scoped nets passed
+    # in args are not mistaken for own ones.
+    with SubschematicCapture("worker") as sc:
+      function(*args, **kwargs)
+    schematic.template_log = None
+    schematic.flatten()
+    template = _record_template(schematic, sc.scope, log, anonymous_start)
+  # Call-site ids are only valid in this process.
+  components = [(c, names, pins, _callsite_info(callsite)) for c, names, pins, callsite in template.components]
+  return template._replace(components=components)
+
+
+def parallel_sub(calls, *, max_workers:int = None):
+  """Capture independent subschematics in parallel, in worker processes.
+
+  calls is a list of (function, args, kwargs) tuples. Each is captured
+  like sub(function, *args, **kwargs), but in a separate process and
+  global scope. The results are then added to the current schematic, in
+  order, with own scopes, fresh anonymous and scoped nets, and designators
+  assigned in the parent, as if sub was called for each of them in turn.
+
+  Functions, arguments and Scope decorated functions called by them must be
+  picklable (i.e. defined at the module level). Subschematics can only
+  interact through nets passed in arguments and global named nets. With
+  max_workers=1 all calls are captured in this process. Returns a list of
+  captured scopes.
+
+  Example:
+
+    channels = parallel_sub([(channel, (i, net("VIN")), {}) for i in range(16)])
+  """
+  global _current_schematic
+  schematic = _current_schematic
+  jobs = [(function, tuple(args), dict(kwargs), len(schematic.anonymous_nets), list(edag_notes.shared_notes_stack))
+          for function, args, kwargs in calls]
+  if max_workers == 1 or len(jobs) <= 1:
+    templates = [_parallel_worker(*job) for job in jobs]
+  else:
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      templates = list(executor.map(_parallel_worker, *zip(*jobs)))
+  scopes = []
+  for template in templates:
+    components = [(c, names, pins, _intern_callsite_info(info)) for c, names, pins, info in template.components]
+    with SubschematicCapture() as sc:
+      _stamp_template(schematic, template._replace(components=components), sc.scope)
+      scopes.append(sc.captured())
+  return scopes
+
+
+def export(output=None, *, compress:bool = False):
   """Export all components and connected nets, as a netlist in KiCad pcbnew compatible format.
 
+  output can be a text or binary file object, or a file name. If None, the
+  netlist is written to stdout. With compress=True (or file name ending in
+  ".gz") the netlist is gzip compressed. Compression requires a binary sink.
+
   This also saves a database with all captured internal information about
   schematic, components and nets. These information are used in subsequent
   runs to ensure stable designators.
+
+  simonly components are not exported. See export_spice for simulation.
+  """
+  return export_(_current_schematic, output, compress=compress)
+
+
+class _NetlistWriter(object):
+  """Buffered writer into a text or binary sink, with optional gzip compression.
+
+  Lines are accumulated and written in batches of about buffer_size bytes, to
+  avoid per-line write calls.
   """
-  return export_(_current_schematic)
+  def __init__(self, sink=None, *, compress:bool = False, buffer_size:int = 1 << 16):
+    self.owned = []  # Files to close when done, innermost first.
+    if sink is None:
+      sink = sys.stdout
+    elif isinstance(sink, (str, os.PathLike)):
+      compress = compress or os.fspath(sink).endswith(".gz")
+      sink = open(sink, "wb")
+      self.owned.append(sink)
+    if compress:
+      assert not isinstance(sink, io.TextIOBase), "Compressed netlist requires a binary sink"
+      # mtime=0, so the output is deterministic.
+      import gzip
+      sink = gzip.GzipFile(fileobj=sink, mode="wb", mtime=0)
+      self.owned.insert(0, sink)
+    self.sink = sink
+    self.text = isinstance(sink, io.TextIOBase)
+    self.buffer = []
+    self.buffered = 0
+    self.buffer_size = buffer_size
+
+  def write(self, line:str):
+    self.buffer.append(line)
+    self.buffered += len(line)
+    if self.buffered >= self.buffer_size:
+      self.flush()
+
+  def flush(self):
+    data = "".join(self.buffer)
+    self.buffer.clear()
+    self.buffered = 0
+    self.sink.write(data if self.text else data.encode("utf-8"))
+
+  def close(self):
+    self.flush()
+    for f in self.owned:
+      f.close()
+    if not self.owned:
+      self.sink.flush()
+
+
+def _sexpr_string(s) -> str:
+  s = str(s)
+  return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _pin_pads(component, pin_key):
+  """Yields physical pads of a component pin."""
+  common = component.common_properties
+  if not (common and 'pin_map' in common):
+    # List pins are numbered from 1, like pads on footprints.
+    yield pin_key + 1 if type(pin_key) is int else pin_key
+    return
+  pads = common['pin_map'][pin_key]
+  if type(pads) is int:
+    yield pads
+  else:
+    yield from pads
+
 
+def export_(self, output=None, *, compress:bool = False, collapse_ties:bool = False):
+  w = _NetlistWriter(output, compress=compress)
+  try:
+    _export_kicad(self, w, collapse_ties=collapse_ties)
+  finally:
+    w.close()
 
-def export_(self):
-  print("(export (version D)")
-  used_nets = Counter()
-  net_pins = defaultdict(list)
-  print("  (components")
+
+def _export_kicad(self, w, *, collapse_ties:bool = False):
+  self.flatten()
+  w.write("(export (version D)\n")
+  w.write("  (components\n")
+  ties = self.ties if collapse_ties else {}
+  simonly = self.simonly
   for component in self.registered_components:
+    if component.global_id in ties or component.global_id in simonly:
+      continue
     value = component.own_properties if component.own_properties else component.type
-    print(f"    (comp (ref {component.id}) (value {value}) (footprint X) "
-          f"(sheetpath (names /) (tstamps /)) (tstamp 5F9A2166)) "
-          f" # \"{component.name}\"; {'; '.join(repr(note) for note in component.notes)}")
-    if type(component.pin_nets) is list:
-      for pin, net in enumerate(component.pin_nets):
-        # print(net)
-        used_nets[net.name] += 1
-        net_pins[net.name].append(Pin(component.id, component.global_id, pin))
-    else:
-      for pin_name, net in component.pin_nets.items():
-        # print(net)
-        used_nets[net.name] += 1
-        net_pins[net.name].append(Pin(component.id, component.global_id, pin_name))
-  print("  )")
-
-  print("  (nets")
+    w.write(f"    (comp (ref {_sexpr_string(component.id)})\n")
+    w.write(f"      (value {_sexpr_string(value)})\n")
+    common = component.common_properties
+    if common and 'footprint' in common:
+      w.write(f"      (footprint {_sexpr_string(common['footprint'])})\n")
+    w.write(f"      (fields (field (name \"Name\") {_sexpr_string(component.name)})")
+    if component.notes:
+      notes = "; ".join(note if type(note) is str else repr(note) for note in component.notes)
+      w.write(f"\n        (field (name \"Notes\") {_sexpr_string(notes)})")
+    w.write(")\n")
+    # Derived from the designator, so it is stable between runs.
+    w.write(f"      (sheetpath (names /) (tstamps /)) (tstamp {zlib.crc32(component.id.encode('utf-8')):08X}))\n")
+  w.write("  )\n")
+
+  w.write("  (nets\n")
+  components = self.components_by_global_id
   i = 0
-  for net_name, component_count in used_nets.items():
+  for net, pins in self.net_groups(collapse_ties=collapse_ties).items():
+    if simonly:
+      pins = [pin for pin in pins if pin.component_global_id not in simonly]
+    if not pins:
+      continue
     i += 1
-    print(f"    (net (code {i}) (name \"{net_name}\")")
-    for pin in net_pins[net_name]:
-      print(f"      (node (ref {pin.id}) (pin {pin.pin}))")
-    print("    )")
-  print("  )")
+    w.write(f"    (net (code {i}) (name {_sexpr_string(net.name)})\n")
+    for pin in pins:
+      ref = _sexpr_string(pin.id)
+      for pad in _pin_pads(components[pin.component_global_id], pin.pin):
+        w.write(f"      (node (ref {ref}) (pin {_sexpr_string(pad)}))\n")
+    w.write("    )\n")
+  w.write("  )\n")
+
+  w.write(")\n")
+
+
+def export_spice(output=None, *, compress:bool = False):
+  """Export all components and connected nets, as a SPICE netlist (i.e. for ngspice).
+
+  Components are mapped to SPICE elements by type: R, C, L to resistors,
+  capacitors and inductors, D, D_Zener and D_Schottky to diodes with the
+  model in own properties, and B (battery) to a DC voltage source. Other
+  components are instantiated as X subcircuits named by the component type,
+  with nets in pin order, which need to be provided (i.e. with .include).
+
+  Each subschematic created with cached_sub is defined once, as a .subckt,
+  and every use of it is a single X line, so the netlist grows with the
+  number of unique subschematics, not the number of components. Hierarchical
+  schematics are not flattened. simonly components are included, and tie
+  components are collapsed. The GND net is node 0.
+
+  output and compress are like in export.
+  """
+  return export_spice_(_current_schematic, output, compress=compress)
+
+
+def export_spice_(self, output=None, *, compress:bool = False, collapse_ties:bool = True):
+  w = _NetlistWriter(output, compress=compress)
+  try:
+    _export_spice(self, w, collapse_ties=collapse_ties)
+  finally:
+    w.close()
+
+
+_SPICE_NODE_UNSAFE = str.maketrans({c: "_" for c in " \t\n=(),;*"})
+
+_SPICE_DIODES = ("D", "D_Zener", "D_Schottky")
+
+
+def _spice_name(letter:str, designator:str) -> str:
+  """Element name, starting with the letter of the SPICE element type."""
+  if designator[:1].upper() == letter:
+    return designator
+  return letter + designator
+
+
+def _spice_card(component, nodes, models:set) -> str:
+  """SPICE element line of a component. nodes are its node names, in pin order.
+
+  Diodes without a model get a default one, named by type, added to models.
+  """
+  type, value = component.type, component.own_properties
+  if type in ("R", "C", "L") and isinstance(value, (int, float)):
+    return f"{_spice_name(type, component.id)} {nodes[0]} {nodes[1]} {value!r}\n"
+  if type in _SPICE_DIODES:
+    model = value.get("model") if isinstance(value, dict) else None
+    if not model:
+      model = type
+      models.add(model)
+    return f"{_spice_name('D', component.id)} {nodes[0]} {nodes[1]} {model}\n"
+  if type == "B":
+    return f"{_spice_name('V', component.id)} {nodes[0]} {nodes[1]} DC {value[0]!r}\n"
+  return f"{_spice_name('X', component.id)} {' '.join(nodes)} {type.translate(_SPICE_NODE_UNSAFE)}\n"
+
+
+def _spice_nodes(component, node_of) -> list:
+  """Node names of all pins of a component. Unconnected pins get own nodes."""
+  if type(component.pin_nets) is list:
+    items = enumerate(component.pin_nets)
+  else:
+    items = component.pin_nets.items()
+  return [f"NC_{component.id}_{pin_key}" if net is None else node_of(net) for pin_key, net in items]
 
-  print(")")
 
+def _index_classes(n:int, pairs) -> list:
+  """Smallest index connected to each of range(n) indices, by pairs of indices."""
+  parent = list(range(n))
 
-def process(schematic_function):
+  def find(i):
+    while parent[i] != i:
+      parent[i] = parent[parent[i]]
+      i = parent[i]
+    return i
+
+  for a, b in pairs:
+    if a is None or b is None:
+      continue
+    a, b = find(a), find(b)
+    if a != b:
+      parent[max(a, b)] = min(a, b)
+  return [find(i) for i in range(n)]
+
+
+def _template_function_name(scope_template) -> str:
+  """Name of the first Scope decorated function in a scope template, if any."""
+  _, function, _, children = scope_template
+  if function is not None:
+    return function.__name__
+  for child in children:
+    name = _template_function_name(child)
+    if name:
+      return name
+  return None
+
+
+def _spice_subckt(w, name:str, template:_Template, node_of, models:set, collapse_ties:bool):
+  """Writes a template as a .subckt. Returns its ports, as external nets.
+
+  Every external net of the template (nets passed in arguments, or global
+  nets) is a port, except ground. If the template connects external nets
+  (by a merge or a tie), their ports are shorted inside by 0 V sources.
+  Scoped and anonymous nets are internal nodes. node_of gives top level
+  node names of external nets.
+  """
+  nets, components = template.nets, template.components
+  pairs = list(template.merges)
+  skip = set()
+  if collapse_ties:
+    for i in template.ties:
+      pins = components[i][2]
+      pairs.append((pins[0], pins[1]))
+      skip.add(i)
+  classes = _index_classes(len(nets), pairs)
+
+  names, used = {}, {"0"}
+
+  def unique(node):
+    unique, n = node, 1
+    while unique in used:
+      n += 1
+      unique = f"{node}_{n}"
+    used.add(unique)
+    return unique
+
+  # Classes connected to ground are ground.
+  externals = [(i, relocatable[1], node_of(relocatable[1])) for i, relocatable in enumerate(nets)
+               if relocatable[0] == "external"]
+  for i, _, node in externals:
+    if node == "0":
+      names[classes[i]] = node
+  ports, shorts = [], []
+  for i, net, node in externals:
+    if node == "0":
+      continue
+    port = unique(node)
+    ports.append((net, port))
+    k = classes[i]
+    if k in names:
+      shorts.append((port, names[k]))
+    else:
+      names[k] = port
+  for i, relocatable in enumerate(nets):
+    k = classes[i]
+    if k in names:
+      continue
+    if relocatable[0] == "scoped":
+      _, scope_names, local = relocatable
+      node = "/".join(scope_names + (f"anon_{local}" if type(local) is int else local,))
+      node = node.translate(_SPICE_NODE_UNSAFE)
+    else:
+      node = f"anon_{i}"
+    names[k] = unique(node)
+
+  w.write(" ".join([".subckt", name] + [node for _, node in ports]) + "\n")
+  for n, (a, b) in enumerate(shorts, 1):
+    w.write(f"Vshort{n} {a} {b} DC 0\n")
+  for i, (c, _, pins, _) in enumerate(components):
+    if i in skip:
+      continue
+    w.write(_spice_card(c, _spice_nodes(c._replace(pin_nets=pins), lambda j: names[classes[j]]), models))
+  w.write(f".ends {name}\n")
+  return [net for net, _ in ports]
+
+
+def _export_spice(self, w, *, collapse_ties:bool = True):
+  resolve = self._resolver(collapse_ties)
+  ground = GND()
+  node_names = {}
+
+  def node_of(net):
+    net = resolve(net)
+    node = node_names.get(net)
+    if node is None:
+      node = node_names[net] = "0" if net == ground else net.name.translate(_SPICE_NODE_UNSAFE)
+    return node
+
+  models = set()
+  w.write("* edag netlist\n")
+
+  # Subcircuit definitions, once per template, in order of first use.
+  subckts = {}  # id(template) -> (name, ports)
+  subckt_names = set()
+  for instance in self.template_uses:
+    template = instance.template
+    if id(template) in subckts:
+      continue
+    base = _template_function_name(template.scopes) or "sub"
+    name, n = base, 1
+    while name in subckt_names:
+      n += 1
+      name = f"{base}_{n}"
+    subckt_names.add(name)
+    ports = _spice_subckt(w, name, template, node_of, models, collapse_ties)
+    subckts[id(template)] = (name, ports)
+
+  # Components not in any subcircuit.
+  ranges = sorted((instance.start, instance.end) for instance in self.template_uses)
+  starts = [start for start, _ in ranges]
+  ties = self.ties if collapse_ties else {}
+  for component in self.registered_components:
+    global_id = component.global_id
+    i = bisect_left(starts, global_id) - 1
+    if i >= 0 and global_id <= ranges[i][1]:
+      continue
+    if global_id in ties:
+      continue
+    w.write(_spice_card(component, _spice_nodes(component, node_of), models))
+
+  for instance in self.template_uses:
+    name, ports = subckts[id(instance.template)]
+    instance_name = instance.scope.path_string.translate(_SPICE_NODE_UNSAFE).replace("/", "_")
+    w.write(" ".join([f"X{instance_name}"] + [node_of(net) for net in ports] + [name]) + "\n")
+
+  for model in sorted(models):
+    w.write(f".model {model} D\n")
+  w.write(".end\n")
+
+
+def export_dot(output=None, *, compress:bool = False, max_depth:int = None, max_components:int = None):
+  """Export all components and connected nets, as an undirected graph in Graphviz dot format.
+
+  Every scope with components is a cluster, nested like the scopes. Nets
+  connecting two components are edges, and nets connecting more (i.e. GND or
+  power rails) are a single net node, with an edge to each component.
+
+  To keep big designs renderable, scopes deeper than max_depth (the root
+  scope has depth 0), or scopes with more than max_components components
+  (including sub scopes) are collapsed into a single summary node, which
+  takes over all connections of their components.
+
+  output and compress are like in export.
+
+  Example:
+
+    export_dot("board.dot", max_depth=2)
+    # dot -Tsvg board.dot > board.svg
+  """
+  return export_dot_(_current_schematic, output, compress=compress, max_depth=max_depth,
+                     max_components=max_components)
+
+
+def export_dot_(self, output=None, *, compress:bool = False, max_depth:int = None,
+                max_components:int = None, collapse_ties:bool = False):
+  w = _NetlistWriter(output, compress=compress)
+  try:
+    _export_dot(self, w, max_depth=max_depth, max_components=max_components, collapse_ties=collapse_ties)
+  finally:
+    w.close()
+
+
+def _dot_label(*lines) -> str:
+  return '"' + "\\n".join(_sexpr_string(line)[1:-1] for line in lines) + '"'
+
+
+def _scope_label(scope) -> str:
+  return f"{scope.name} ({scope.function.__name__})" if scope.function else scope.name
+
+
+def _export_dot(self, w, *, max_depth:int = None, max_components:int = None, collapse_ties:bool = False):
+  self.flatten()
+  root = self.scopes_tree[0]
+  component_scopes = self.component_scopes
+
+  # Components of each scope, by id(scope).
+  by_scope = defaultdict(list)
+  for component in self.registered_components:
+    by_scope[id(component_scopes.get(component.global_id, root))].append(component)
+
+  # Number of components in each scope, including sub scopes.
+  totals = {}
+
+  def count(scope):
+    total = len(by_scope.get(id(scope), ()))
+    for sub_scope in scope.sub_scopes:
+      total += count(sub_scope)
+    totals[id(scope)] = total
+    return total
+
+  count(root)
+
+  # id(scope) -> graph node of all components in it, for collapsed scopes and
+  # their sub scopes.
+  summary = {}
+
+  def collapse(scope, node):
+    summary[id(scope)] = node
+    for sub_scope in scope.sub_scopes:
+      collapse(sub_scope, node)
+
+  def write_scope(scope, indent):
+    total = totals[id(scope)]
+    if not total:
+      return
+    too_deep = max_depth is not None and scope.depth > max_depth
+    too_big = max_components is not None and total > max_components
+    if scope is not root and (too_deep or too_big):
+      node = _sexpr_string("scope:" + scope.path_string)
+      collapse(scope, node)
+      w.write(f"{indent}{node} [shape=box3d, label={_dot_label(_scope_label(scope), f'{total} components')}];\n")
+      return
+    inner = indent
+    if scope is not root:
+      inner = indent + "  "
+      w.write(f"{indent}subgraph {_sexpr_string('cluster_' + scope.path_string)} {{\n")
+      w.write(f"{inner}label={_dot_label(_scope_label(scope))};\n")
+    for component in by_scope.get(id(scope), ()):
+      value = component.own_properties if component.own_properties else component.type
+      w.write(f"{inner}{_sexpr_string(component.id)} [label={_dot_label(component.id, component.name, value)}];\n")
+    for sub_scope in scope.sub_scopes:
+      write_scope(sub_scope, inner)
+    if scope is not root:
+      w.write(f"{indent}}}\n")
+
+  w.write("graph edag {\n")
+  w.write("  node [shape=box];\n")
+  write_scope(root, "  ")
+
+  components = self.components_by_global_id
+  node_of = {}  # global_id -> graph node.
+  for net, pins in self.net_groups(collapse_ties=collapse_ties).items():
+    endpoints = []
+    for pin in pins:
+      global_id = pin.component_global_id
+      node = node_of.get(global_id)
+      if node is None:
+        scope = component_scopes.get(global_id, root)
+        node = node_of[global_id] = summary.get(id(scope)) or _sexpr_string(components[global_id].id)
+      endpoints.append(node)
+    endpoints = list(dict.fromkeys(endpoints))
+    if len(endpoints) < 2:
+      continue
+    name = _sexpr_string(net.name)
+    if len(endpoints) == 2:
+      w.write(f"  {endpoints[0]} -- {endpoints[1]} [label={name}];\n")
+      continue
+    # Hyperedge.
+    net_node = _sexpr_string("net:" + net.name)
+    w.write(f"  {net_node} [shape=point, xlabel={name}];\n")
+    for endpoint in endpoints:
+      w.write(f"  {net_node} -- {endpoint};\n")
+  w.write("}\n")
+
+
+def process(schematic_function, *, cache_dir:str = None, diff:bool = False):
   """Processes a schematic function. This will do all processing, import of old
   ids, build schematic with components and nets, do an export and save new ids.
 
@@ -605,18 +2224,64 @@ def process(schematic_function):
     doesn't need to return any value. All build components will be captured
     automatically (it is possible to supress some components and nets, by using
     special scopes).
+
+
+  With cache_dir (or build_cache_dir, or EDAG_CACHE_DIR environment variable)
+  the captured schematic and the outputs are stored in a build cache, keyed
+  by a hash of the sources. If nothing changed since, the schematic function
+  is not called at all, and the outputs are loaded from the cache. See
+  edag_build_cache.
+
+  With diff=True, instead of the netlist, only changes since the previous run
+  are written (see edag_eco), and the stable ids database is not updated, so
+  the changes can be reviewed before a normal run.
   """
   if True:  # with NewGlobalScope() as schematic:
     schematic = _current_schematic
 
     assert _current_schematic is schematic
     assert _schematic_stack[-1] is schematic
+    if diff:
+      import edag_eco
+      schematic.load_stable_ids()
+      schematic_function()
+      schematic.flatten()
+      changes = edag_eco.diff(schematic.previous_scopes or [], edag_eco.scope_table(schematic))
+      sys.stdout.write(edag_eco.format_changes(changes))
+      return
+    cache_dir = cache_dir or build_cache_dir or os.environ.get("EDAG_CACHE_DIR")
+    if cache_dir:
+      import edag_build_cache
+      edag_build_cache.cached_process(schematic, schematic_function, cache_dir)
+      return
     schematic.load_stable_ids()
     schematic_function()
-    export_(schematic)
+    if process_output is None:
+      export_(schematic)
+    else:
+      netlist = io.BytesIO()
+      export_(schematic, netlist)
+      _write_output(netlist.getvalue())
     schematic.save_stable_ids()
 
 
+# Public: Directory of the build cache used by process(). See process.
+build_cache_dir = None
+
+# Public: File name of the netlist written by process(). If None, the netlist
+# is written to stdout. Otherwise the file is replaced atomically, so readers
+# (i.e. pcbnew) never see a partial netlist.
+process_output = None
+
+
+def _write_output(data:bytes):
+  """Write output of process(), to process_output or stdout."""
+  if process_output is None:
+    sys.stdout.write(data.decode("utf-8"))
+  else:
+    _atomic_write(process_output, data)
+
+
 def DifferentialPair():
   pass
 
@@ -634,3 +2299,563 @@ def BifurcationPoint():
 # TODO: There might be more to it, ie. there might be termination
 # resistors or copouling capacitors, where some sections of various nets
 # need to have various length / phase matching requirements.
+
+
+import unittest
+
+
+class Test_callsite(unittest.TestCase):
+  def test_interned(self):
+    # Compiled with a fake filename, so frames are not skipped as edag internals.
+    code = compile("[sig() for _ in range(2)] + [sig()]", "design.py", "eval")
+    a, b, c = eval(code, {"sig": _callsite_signature})
+    self.assertEqual(a, b)
+    self.assertNotEqual(a, c)
+    self.assertEqual(_callsite_info(a)[0][0], "design.py")
+    self.assertEqual(_callsite_info(a), _callsite_info(b))
+
+  def test_depth(self):
+    code = compile("sig(0)", "design.py", "eval")
+    self.assertEqual(_callsite_info(eval(code, {"sig": _callsite_signature})), ())
+
+
+class Test_pin_map(unittest.TestCase):
+  def test_validation(self):
+    pin_map = PinMap({"in": 1, "gnd": [2, 4], "out": 3}, "SOT-223")
+    self.assertEqual(pin_map, {"in": 1, "gnd": (2, 4), "out": 3})
+    self.assertEqual(pin_map["gnd"], (2, 4))
+    self.assertEqual(pin_map.pin_keys, {"in", "gnd", "out"})
+    self.assertEqual(PinMap({0: 1, 1: 2}).list_size, 2)
+    with self.assertRaises(AssertionError):
+      PinMap({"a": 1, "b": [2, 1]})  # Duplicate pin.
+    with self.assertRaises(AssertionError):
+      PinMap({"a": []})
+    with self.assertRaises(AssertionError):
+      PinMap({"a": 1, "b": 4}, "SOT-23")
+    with self.assertRaises(AssertionError):
+      PinMap({"a": 1, "b": 2, "c": 3, "d": 4}, "SOT-23")
+    PinMap({"a": 1, "b": 4}, "unknown package")
+    # Dict pin maps are validated once.
+    d = {"in": 1, "gnd": [2, 4], "out": 3}
+    self.assertIs(_as_pin_map(d), _as_pin_map(dict(d)))
+    self.assertIsNot(_as_pin_map(d), _as_pin_map({"in": 1, "gnd": [2, 5], "out": 3}))
+    self.assertEqual(_as_pin_map(d, "SOT-223").package, "SOT-223")
+    self.assertIsNone(_as_pin_map(d).package)
+    with self.assertRaises(AssertionError):
+      _as_pin_map(d, "SOT-23")
+    import pickle
+    self.assertEqual(pickle.loads(pickle.dumps(pin_map)).package, "SOT-223")
+
+  def test_make_component(self):
+    pin_map = PinMap({"in": 1, "gnd": 2, "out": 3})
+    with NewGlobalScope():
+      c = make_component("u", "lm7805", {"in": Net("a"), "gnd": GND(), "out": Net("b")}, {"pin_map": pin_map}, [])
+      self.assertIs(c.common_properties["pin_map"], pin_map)
+      with self.assertRaisesRegex(AssertionError, "out from pin_map key, not found in pin_nets dict"):
+        make_component("u", "lm7805", {"in": Net("a"), "gnd": GND()}, {"pin_map": pin_map}, [])
+      with self.assertRaisesRegex(AssertionError, "x from pin_net dict, not found in pin_map"):
+        make_component("u", "lm7805", {"in": Net("a"), "gnd": GND(), "out": Net("b"), "x": None}, {"pin_map": pin_map}, [])
+      make_component("r", "R", [Net("a"), Net("b")], {"pin_map": {0: 1, 1: 2}}, 1.0)
+      with self.assertRaises(AssertionError):
+        make_component("r", "R", [Net("a"), None], {"pin_map": {0: 1, 1: 2}}, 1.0)
+      # Plain dict pin maps are validated against the package too.
+      make_component("r", "R", [Net("a"), Net("b")], {"pin_map": {0: 1, 1: 2}, "package": "SOT-23"}, 1.0)
+      with self.assertRaisesRegex(AssertionError, "doesn't exist in SOT-23 package"):
+        make_component("r", "R", [Net("a"), Net("b")], {"pin_map": {0: 1, 1: 4}, "package": "SOT-23"}, 1.0)
+
+
+class Test_stable_ids(unittest.TestCase):
+  def test_roundtrip(self):
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+      filename = os.path.join(tmp, "ids.json")
+      s1 = Schematic()
+      self.assertEqual(s1._assign_designator("root", "R", "load", "R", 1000.0, 0), "R1")
+      self.assertEqual(s1._assign_designator("root", "R", "pullup", "R", 10.0e3, 0), "R2")
+      self.assertEqual(s1._assign_designator("root", "C", "pullup", "C", 1.0e-6, 0), "C1")
+      self.assertEqual(s1._assign_designator("root", "R", "pullup", "R", 10.0e3, 0), "R3")
+      s1.save_stable_ids(filename)
+
+      # Component added before others, and one removed.
+      s2 = Schematic()
+      s2.load_stable_ids(filename)
+      self.assertEqual(s2._assign_designator("root", "R", "new", "R", 1.0, 0), "R4")
+      self.assertEqual(s2._assign_designator("root", "R", "pullup", "R", 10.0e3, 0), "R2")
+      self.assertEqual(s2._assign_designator("root", "R", "pullup", "R", 10.0e3, 0), "R3")
+      self.assertEqual(s2._assign_designator("root", "C", "pullup", "C", 1.0e-6, 0), "C1")
+      # Different prefix, so can't reuse C1.
+      self.assertEqual(s2._assign_designator("root", "C", "pullup", "CP", 1.0e-6, 0), "CP1")
+
+  def test_callsite(self):
+    import tempfile
+    a = _intern_callsite_info((("design.py", 10, "top"),))
+    b = _intern_callsite_info((("design.py", 20, "top"),))
+    with tempfile.TemporaryDirectory() as tmp:
+      filename = os.path.join(tmp, "ids.json")
+      s1 = Schematic()
+      self.assertEqual(s1._assign_designator("root", "R", "r", "R", 1.0, a), "R1")
+      self.assertEqual(s1._assign_designator("root", "R", "r", "R", 2.0, b), "R2")
+      s1.save_stable_ids(filename)
+      # Same names, created in the other order. Matched by call-site first.
+      s2 = Schematic()
+      s2.load_stable_ids(filename)
+      self.assertEqual(s2._assign_designator("root", "R", "r", "R", 2.0, b), "R2")
+      self.assertEqual(s2._assign_designator("root", "R", "r", "R", 1.0, a), "R1")
+      # Call-sites moved, so matched by name only, in order.
+      s3 = Schematic()
+      s3.load_stable_ids(filename)
+      c = _intern_callsite_info((("design.py", 11, "top"),))
+      self.assertEqual(s3._assign_designator("root", "R", "r", "R", 2.0, c), "R1")
+      self.assertEqual(s3._assign_designator("root", "R", "r", "R", 1.0, b), "R2")
+
+      # One more component from a call-site, before components of another
+      # call-site. It doesn't take their designator.
+      s4 = Schematic()
+      s4.load_stable_ids(filename)
+      self.assertEqual([s4._assign_designator("root", "R", "r", "R", 1.0, site) for site in (a, a, b)],
+                       ["R1", "R3", "R2"])
+      # A new component in another function, before the others.
+      s5 = Schematic()
+      s5.load_stable_ids(filename)
+      x = _intern_callsite_info((("helper.py", 5, "helper"),))
+      self.assertEqual([s5._assign_designator("root", "R", "r", "R", 1.0, site) for site in (x, a, b)],
+                       ["R3", "R1", "R2"])
+
+  def test_atomic_write_mode(self):
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+      filename = os.path.join(tmp, "ids.json")
+      umask = os.umask(0o022)
+      try:
+        _atomic_write(filename, b"1")
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o644)
+        os.chmod(filename, 0o640)
+        _atomic_write(filename, b"2")
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)
+      finally:
+        os.umask(umask)
+      self.assertEqual(os.listdir(tmp), ["ids.json"])
+
+  def test_missing_file(self):
+    s = Schematic()
+    s.load_stable_ids("/nonexistent/ids.json")
+    self.assertEqual(s.stable_ids_index, {})
+
+
+def _test_schematic():
+  s = Schematic()
+  s.register_component(Component("load", "R", "R1", 1, [Net("a"), Net("GND")], [], 1000.0, ['say "hi"']))
+  s.register_component(Component("u", "lm7805", "U1", 2, {"in": Net("a"), "gnd": Net("GND"), "out": Net("b")},
+                                 {"pin_map": {"in": 1, "gnd": [2, 4], "out": 3}}, [], []))
+  return s
+
+
+@Scope()
+def _test_channel(vin, value):
+  mid = scoped_net("mid")
+  make_component("top", "R", [vin, mid], [], value, prefix="R")
+  make_component("bottom", "C", [mid, net()], [], 1.0e-9, prefix="C")
+
+
+class Test_export(unittest.TestCase):
+  def schematic(self):
+    return _test_schematic()
+
+  def test_text(self):
+    out = io.StringIO()
+    export_(self.schematic(), out)
+    netlist = out.getvalue()
+    self.assertTrue(netlist.startswith("(export (version D)\n"))
+    self.assertIn('(field (name "Notes") "say \\"hi\\"")', netlist)
+    self.assertIn('(net (code 2) (name "GND")\n'
+                  '      (node (ref "R1") (pin "2"))\n'
+                  '      (node (ref "U1") (pin "2"))\n'
+                  '      (node (ref "U1") (pin "4"))\n', netlist)
+    self.assertEqual(netlist.count("("), netlist.count(")"))
+
+  def test_binary_gzip(self):
+    import gzip
+    text, raw, compressed = io.StringIO(), io.BytesIO(), io.BytesIO()
+    export_(self.schematic(), text)
+    export_(self.schematic(), raw)
+    export_(self.schematic(), compressed, compress=True)
+    self.assertEqual(raw.getvalue().decode("utf-8"), text.getvalue())
+    self.assertEqual(gzip.decompress(compressed.getvalue()), raw.getvalue())
+
+  def test_small_buffer(self):
+    a, b = io.StringIO(), io.StringIO()
+    _export_kicad(self.schematic(), _NetlistWriter(a))
+    w = _NetlistWriter(b, buffer_size=1)
+    _export_kicad(self.schematic(), w)
+    w.close()
+    self.assertEqual(a.getvalue(), "")  # Not flushed yet.
+    self.assertTrue(b.getvalue().endswith(")\n"))
+
+
+
+class Test_connectivity(unittest.TestCase):
+  def test_index(self):
+    s = _test_schematic()
+    a, b, gnd = Net("a"), Net("b"), Net("GND")
+    self.assertEqual(s.pins_on_net(gnd), [Pin("R1", 1, 1), Pin("U1", 2, "gnd")])
+    self.assertEqual(s.net_degree(a), 2)
+    self.assertEqual(s.net_degree(b), 1)
+    self.assertEqual(s.net_degree(Net("unused")), 0)
+    self.assertEqual(s.nets_of_component(2), [a, gnd, b])
+    self.assertEqual(s.nets_of_component(s.registered_components[0]), [a, gnd])
+
+
+
+class Test_merge(unittest.TestCase):
+  def test_union(self):
+    u = _NetUnion()
+    nets = [Net(f"anon_{i}") for i in range(100)]
+    for a, b in zip(nets, nets[1:]):
+      u.union(a, b)
+    u.union(nets[50], Net("VCC"))
+    self.assertEqual({u.find(net) for net in nets}, {u.find(Net("VCC"))})
+    self.assertEqual(u.resolve(nets[7]), Net("VCC"))
+    self.assertEqual(len(u.set_of(nets[0])), 101)
+    self.assertEqual(u.resolve(Net("other")), Net("other"))
+
+  def test_merge_and_connect(self):
+    s = _test_schematic()
+    a, b, gnd = Net("a"), Net("b"), Net("GND")
+    self.assertEqual(s.merge(Net("anon_1"), b), b)
+    s.merge(a, b)
+    self.assertEqual(s.net_degree(a), 3)
+    self.assertEqual(s.nets_of_component(2), [s.find_net(a), gnd])
+    self.assertEqual(s.connect(Pin("U1", 2, "gnd"), Net("GND2")), gnd)
+    c = Component("r", "R", "R2", 3, [Net("x"), None], [], 1.0, [])
+    s.register_component(c)
+    s.connect((c, 1), gnd)
+    self.assertEqual(s.net_degree(gnd), 3)
+    self.assertEqual(list(s.net_groups()), [s.find_net(a), gnd, Net("x")])
+
+  def test_tie(self):
+    s = _test_schematic()
+    tie = Component("tie", "R", "R2", 3, [Net("b"), Net("c")], [], 0.0, [])
+    s.register_component(tie)
+    s.register_tie(tie)
+    self.assertEqual(len(s.net_groups()), 4)
+    groups = s.net_groups(collapse_ties=True)
+    self.assertEqual(len(groups), 3)
+    self.assertEqual(groups[Net("b")], [Pin("U1", 2, "out")])
+    out = io.StringIO()
+    export_(s, out, collapse_ties=True)
+    self.assertNotIn("R2", out.getvalue())
+
+
+
+class Test_net(unittest.TestCase):
+  def test_interned(self):
+    import pickle
+    self.assertEqual(Net("GND"), GND())
+    self.assertEqual(Net("root/x/anon_3"), Net._from_parts(_intern_net_prefix("root/x"), 3))
+    self.assertNotEqual(Net("root/x/anon_3"), Net("root/y/anon_3"))
+    self.assertEqual(Net("root/x/anon_3").name, "root/x/anon_3")
+    self.assertEqual(repr(Net("a")), "net(name='a')")
+    self.assertEqual(pickle.loads(pickle.dumps(Net("root/x/in"))), Net("root/x/in"))
+    self.assertEqual(_net_name_rank(Net("root/x/anon_3")), 0)
+    self.assertEqual(_net_name_rank(Net("root/x/in")), 1)
+    self.assertEqual(_net_name_rank(Net("GND")), 2)
+    self.assertIs(Net("a"), Net("a"))
+    self.assertNotEqual(Net("a"), int(Net("a")))
+    self.assertNotIn(int(Net("a")), {Net("a")})
+
+  def test_first_net(self):
+    import subprocess
+    import sys
+    # The first net in a process has id 0, but must still be true.
+    code = ("import edag; vout = edag.net('VOUT'); assert int(vout) == 0 and vout\n"
+            "import edag_components\n"
+            "with edag.NewGlobalScope() as s:\n"
+            "  edag_components.voltage_divider('div', r_high=1000, r_low=1000, high=edag.net('VIN'), low=edag.GND(),"
+            " output=vout)\n"
+            "  print(s.net_degree(vout))\n")
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True).stdout
+    self.assertEqual(out, "2\n")
+
+
+class Test_scope(unittest.TestCase):
+  def test_tree(self):
+    s = Schematic()
+    nets = []
+
+    @s.Scope()
+    def inner():
+      nets.append(s.scoped_net("x"))
+
+    @s.Scope()
+    def outer():
+      inner()
+      inner()
+
+    outer()
+    outer()
+    self.assertIs(s.current_scope, s.scopes_tree[0])
+    self.assertEqual(s.scopes, [s.current_scope])
+    self.assertEqual([n.name for n in nets], ["root/scope_0/scope_0/x", "root/scope_0/scope_1/x",
+                                              "root/scope_1/scope_0/x", "root/scope_1/scope_1/x"])
+    scope = s.scopes_tree[0].sub_scopes[1].sub_scopes[0]
+    self.assertEqual(scope.path, ["root", "scope_1", "scope_0"])
+    self.assertEqual((scope.depth, scope.node_i, scope.function.__name__), (2, 0, "inner"))
+
+  def test_trace_and_exceptions(self):
+    s = Schematic()
+    events = []
+
+    @s.Scope()
+    def broken():
+      raise ValueError("oops")
+
+    previous = trace_scopes(lambda event, scope: events.append((event, scope.path_string)))
+    try:
+      with self.assertRaises(ValueError):
+        broken()
+    finally:
+      trace_scopes(previous)
+    self.assertEqual(events, [("enter", "root/scope_0"), ("exit", "root/scope_0")])
+    self.assertEqual(s.scopes, [s.current_scope])
+    self.assertEqual(repr(s.current_scope), "<scope root>")
+
+
+class Test_cached_sub(unittest.TestCase):
+  def test_stamp(self):
+    calls = []
+
+    @Scope()
+    def divider(top, ratio):
+      calls.append(ratio)
+      mid, tap = scoped_net("mid"), net()
+      make_component("top", "R", [top, mid], [], ratio, prefix="R")
+      bottom = make_component("bottom", "R", [mid, None], [], 1000.0, prefix="R")
+      connect((bottom, 1), GND())
+      make_component("tap", "R", [mid, tap], [], 0.0, prefix="R")
+      merge(tap, scoped_net())
+
+    with NewGlobalScope() as s:
+      vin = net("VIN")
+      scopes = [cached_sub(divider, vin, 2.0) for _ in range(3)]
+      self.assertEqual(calls, [2.0])
+      first, second = [[c for c in s.registered_components[i:i + 3]] for i in (0, 3)]
+      self.assertEqual([c.id for c in first + second], ["R1", "R2", "R3", "R4", "R5", "R6"])
+      self.assertEqual(second[1].pin_nets, [Net("root/sub_1/scope_0/mid"), GND()])
+      self.assertEqual(second[0].pin_nets[0], vin)
+      self.assertNotEqual(first[2].pin_nets[1], second[2].pin_nets[1])
+      self.assertEqual(s.net_union.resolve(second[2].pin_nets[1]), s.net_union.resolve(Net("root/sub_1/scope_0/anon_0")))
+      self.assertNotEqual(s.net_union.resolve(first[2].pin_nets[1]), s.net_union.resolve(second[2].pin_nets[1]))
+      self.assertEqual(scopes[2].sub_scopes[0].function.__name__, "divider")
+      self.assertEqual(s.net_degree(Net("root/sub_2/scope_0/mid")), 3)
+      # Unhashable arguments are not cached.
+      cached_sub(divider, vin, [3.0])
+      cached_sub(divider, vin, [3.0])
+      self.assertEqual(calls, [2.0, [3.0], [3.0]])
+
+
+class Test_hierarchical(unittest.TestCase):
+  def capture(self, hierarchical):
+    @Scope()
+    def channel(vin):
+      mid = scoped_net("mid")
+      make_component("top", "R", [vin, mid], [], 1000.0, prefix="R")
+      make_component("bottom", "C", [mid, GND()], [], 1.0e-9, prefix="C")
+
+    with NewGlobalScope(hierarchical=hierarchical) as s:
+      vin = net("VIN")
+      for _ in range(8):
+        cached_sub(channel, vin)
+      pending = len(s.instances)
+      degree = net_degree(vin)
+      out = io.StringIO()
+      export_(s, out)
+    return pending, degree, out.getvalue()
+
+  def test_flatten(self):
+    pending, degree, netlist = self.capture(True)
+    self.assertEqual((pending, degree), (7, 8))
+    self.assertEqual(self.capture(False), (0, 8, netlist))
+    self.assertIn('(net (code 10) (name "root/sub_7/scope_0/mid")', netlist)
+
+  def test_queries(self):
+    @Scope()
+    def channel(vin):
+      mid, low = scoped_net("mid"), net()
+      make_component("top", "R", [vin, mid], [], 1000.0, prefix="R")
+      make_component("bottom", "C", [mid, low], [], 1.0e-9, prefix="C")
+      merge(low, GND())
+
+    results = []
+    for hierarchical in (True, False):
+      with NewGlobalScope(hierarchical=hierarchical) as s:
+        vin = net("VIN")
+        for _ in range(4):
+          cached_sub(channel, vin)
+        make_component("load", "R", [vin, GND()], [], 10.0, prefix="R")
+        mid = Net("root/sub_2/scope_0/mid")
+        queries = (pins_on_net(vin), net_degree(GND()), pins_on_net(mid), s.find_net(Net("anon_3")),
+                   component_nets(pins_on_net(mid)[1].component_global_id))
+        pending = len(s.instances)
+        out = io.StringIO()
+        export_(s, out)
+        results.append((pending, queries, out.getvalue()))
+    self.assertEqual(results[0][0], 3)
+    self.assertEqual(results[0][1], (
+        [Pin("R1", 1, 0), Pin("R2", 3, 0), Pin("R3", 5, 0), Pin("R4", 7, 0), Pin("R5", 9, 0)], 5,
+        [Pin("R3", 5, 1), Pin("C3", 6, 0)], GND(), [Net("root/sub_2/scope_0/mid"), GND()]))
+    self.assertEqual(results[0][1:], results[1][1:])
+
+
+class Test_spice(unittest.TestCase):
+  def capture(self, hierarchical, count):
+    @Scope()
+    def channel(vin):
+      mid, out = scoped_net("mid"), scoped_net("out")
+      make_component("top", "R", [vin, mid], [], 1000.0, prefix="R")
+      make_component("bottom", "C", [mid, GND()], [], 1.0e-9, prefix="C")
+      tie = make_component("tie", "R", [mid, out], [], 0.0, prefix="R")
+      _current_schematic.register_tie(tie)
+      make_component("clamp", "D_Zener", [out, net()], [], {"model": None}, prefix="D")
+
+    with NewGlobalScope(hierarchical=hierarchical) as s:
+      vin = net("VIN")
+      make_component("bat", "B", [vin, GND()], [], [9.0, 3600.0])
+      for _ in range(count):
+        cached_sub(channel, vin)
+      make_component("probe", "R", [vin, GND()], [], 1.0e6, prefix="R", simonly=True)
+      spice, kicad = io.StringIO(), io.StringIO()
+      export_spice_(s, spice)
+      pending = len(s.instances)
+      export_(s, kicad)
+    return pending, spice.getvalue(), kicad.getvalue()
+
+  def test_subckt(self):
+    pending, netlist, kicad = self.capture(True, 8)
+    self.assertEqual(pending, 7)
+    self.assertTrue(netlist.startswith("* edag netlist\n.subckt channel VIN\n"))
+    self.assertIn("R1 VIN scope_0/mid 1000.0\n"
+                  "C1 scope_0/mid 0 1e-09\n"
+                  "D1 scope_0/mid anon_4 D_Zener\n"
+                  ".ends channel\n"
+                  "VB1 VIN 0 DC 9.0\n", netlist)
+    self.assertEqual(netlist.count(".subckt"), 1)
+    self.assertIn("Xroot_sub_7 VIN channel\n", netlist)
+    self.assertTrue(netlist.endswith(".model D_Zener D\n.end\n"))
+    # One line per instance, and a simonly probe.
+    self.assertEqual(len(self.capture(True, 16)[1].splitlines()), len(netlist.splitlines()) + 8)
+    self.assertIn(" VIN 0 1000000.0\n", netlist)
+    self.assertNotIn("probe", kicad)
+    # Same designators and order, as if instances were expanded right away.
+    self.assertEqual(self.capture(False, 8)[1:], (netlist, kicad))
+
+  def test_tied_ports(self):
+    @Scope()
+    def bridge(a, b):
+      tie = make_component("tie", "R", [a, b], [], 0.0, prefix="R")
+      _current_schematic.register_tie(tie)
+      make_component("load", "R", [b, GND()], [], 10.0, prefix="R")
+
+    with NewGlobalScope(hierarchical=True) as s:
+      a, b = net("A"), net("B")
+      make_component("src", "R", [a, GND()], [], 1.0, prefix="R")
+      for _ in range(2):
+        cached_sub(bridge, a, b)
+      out = io.StringIO()
+      export_spice_(s, out)
+    # Both are ports, shorted inside.
+    self.assertIn(".subckt bridge A A_2\n"
+                  "Vshort1 A_2 A DC 0\n"
+                  "R3 A 0 10.0\n"
+                  ".ends bridge\n", out.getvalue())
+    self.assertIn("Xroot_sub_1 A A bridge\n", out.getvalue())
+
+  def test_flat(self):
+    with NewGlobalScope() as s:
+      a = net("A")
+      r = make_component("r", "R", [a, None], [], 10.0)
+      make_component("u", "lm7805", {"in": a, "gnd": GND(), "out": scoped_net("out")}, [], [], prefix="U")
+      make_component("tie", "R", [a, net("B")], [], 0.0)
+      s.register_tie(s.registered_components[-1])
+      make_component("c", "C", [net("B"), GND()], [], 1.0e-6)
+      out = io.StringIO()
+      export_spice_(s, out)
+    self.assertEqual(out.getvalue(), "* edag netlist\n"
+                                     f"R1 A NC_{r.id}_1 10.0\n"
+                                     "XU1 A 0 root/out lm7805\n"
+                                     "C1 A 0 1e-06\n"
+                                     ".end\n")
+
+
+class Test_dot(unittest.TestCase):
+  def capture(self, **kwargs):
+    @Scope()
+    def channel(vin):
+      mid = scoped_net("mid")
+      make_component("top", "R", [vin, mid], [], 1000.0, prefix="R")
+      make_component("bottom", "C", [mid, GND()], [], 1.0e-9, prefix="C")
+
+    with NewGlobalScope(hierarchical=True) as s:
+      vin = net("VIN")
+      make_component("load", "R", [vin, GND()], [], 10.0, prefix="R")
+      for _ in range(3):
+        cached_sub(channel, vin)
+      out = io.StringIO()
+      export_dot_(s, out, **kwargs)
+    return out.getvalue()
+
+  def test_clusters(self):
+    graph = self.capture()
+    self.assertTrue(graph.startswith('graph edag {\n  node [shape=box];\n  "R1" [label="R1\\nload\\n10.0"];\n'))
+    self.assertIn('    subgraph "cluster_root/sub_2/scope_0" {\n'
+                  '      label="scope_0 (channel)";\n'
+                  '      "R4" [label="R4\\ntop\\n1000.0"];\n', graph)
+    # Hyperedges, and a plain edge for a two pin net.
+    self.assertEqual(graph.count('"net:GND" -- '), 4)
+    self.assertIn('  "R4" -- "C3" [label="root/sub_2/scope_0/mid"];\n', graph)
+    self.assertEqual(graph.count("{"), graph.count("}"))
+
+  def test_collapse(self):
+    graph = self.capture(max_depth=1)
+    self.assertIn('"scope:root/sub_0/scope_0" [shape=box3d, label="scope_0 (channel)\\n2 components"];', graph)
+    self.assertNotIn("mid", graph)
+    self.assertIn('  "net:VIN" -- "scope:root/sub_1/scope_0";\n', graph)
+    graph = self.capture(max_components=1)
+    self.assertIn('  "scope:root/sub_0" [shape=box3d, label="sub_0\\n2 components"];\n', graph)
+    self.assertNotIn("cluster_", graph)
+
+
+class Test_parallel(unittest.TestCase):
+  def capture(self, parallel):
+    with NewGlobalScope() as s:
+      vin = scoped_net("vin")
+      calls = [(_test_channel, (vin, float(i)), {}) for i in range(4)]
+      if parallel:
+        parallel_sub(calls, max_workers=2)
+      else:
+        for function, args, kwargs in calls:
+          sub(function, *args, **kwargs)
+      out = io.StringIO()
+      export_(s, out)
+    return s, out.getvalue()
+
+  def test_same_as_serial(self):
+    s, netlist = self.capture(True)
+    self.assertEqual(netlist, self.capture(False)[1])
+    self.assertIn('(name "root/sub_3/scope_0/mid")', netlist)
+    self.assertEqual(s.net_degree(Net("root/vin")), 4)
+
+  def test_pickle(self):
+    import pickle
+    s, netlist = self.capture(False)
+    s2 = pickle.loads(pickle.dumps(s))
+    out = io.StringIO()
+    export_(s2, out)
+    self.assertEqual(out.getvalue(), netlist)
+    self.assertEqual(s2.scopes_tree[0].sub_scopes[2].sub_scopes[0].path_string, "root/sub_2/scope_0")
+    self.assertEqual([_callsite_info(r.callsite) for r in s2.stable_ids_records],
+                     [_callsite_info(r.callsite) for r in s.stable_ids_records])
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+
+"""Compact binary file format of captured schematics.
+
+A design file is a header, a section directory, and sections, each aligned
+to 8 bytes. All integers are little endian.
+
+  header: magic b"EDAGBIN\\0", format version (u32), number of sections (u32)
+  directory: per section, tag (4 bytes), offset (u64), length (u64)
+
+Sections (i32 unless noted, -1 is none):
+
+  SOFF, SDAT: string table, offsets (i64, one more than strings) into utf-8 data
+  VOFF, VDAT: value table, offsets (i64) into encoded values: b"f" and a
+              float64, b"j" and JSON, or b"p" and a pickle (see below). In
+              JSON, tuples, nets, dicts with non string keys, PinMap, notes
+              and non finite floats are objects with a "$<type>" key.
+  NETS: string id of the name of each net
+  CNAM, CTYP, CDES: string ids of component names, types and designators
+  CGID: component global ids (i64)
+  CVAL, CPRP, CNOT: value ids of own properties, common properties and notes
+  CKND: pin kind of each component (i8), 0 for list pins, 1 for dict pins
+  CSCO: scope row of each component
+  POFF: CSR pin table offsets (i64), pins of component i are POFF[i]:POFF[i+1]
+  PKEY, PNET: value id of pin key (-1 for list pins), and net id of each pin
+  SCOP: scope tree in pre-order, name string id, parent row, function string
+        id ("module:qualname") and number of anonymous nets, per row
+  MERG: pairs of merged net id and representative net id
+  TIES, SIMO: global ids (i64) of tie and simonly components
+  META: JSON with designator counters and the last global id
+
+save() writes a schematic in one pass over components. Pending hierarchical
+instances are expanded first. DesignFile reads a file through mmap. Numeric
+columns are used in place, and strings, values and components are decoded
+only when accessed. DesignFile.schematic() (or load()) builds a complete
+Schematic again.
+
+Values of other types can't be saved, unless allow_pickle=True is given to
+save(). Such files can only be read with allow_pickle=True too. Never do it
+with untrusted files, as unpickling can run arbitrary code.
+
+Example:
+
+  save(schematic, "board.edag")
+  with DesignFile("board.edag") as design:
+    print(len(design), design[0].id)
+"""
+
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+import edag
+from edag_columnar import _Interner, _value_key
+import edag_notes
+
+_MAGIC = b"EDAGBIN\0"
+# Bump on incompatible changes of the format.
+_VERSION = 2
+
+_HEADER = struct.Struct("<8sII")
+_DIRECTORY_ENTRY = struct.Struct("<4sQQ")
+_FLOAT = struct.Struct("<d")
+_INF = float("inf")
+
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+_NOTE_TYPES = {t.__name__: t for t in (edag_notes.Comment, edag_notes.PlacementHint, edag_notes.Warning)}
+
+
+def _to_json(value):
+  """JSON representation of a value. Types JSON doesn't have are tagged
+  objects with a single "$..." key. Raises TypeError for unknown types."""
+  t = type(value)
+  if value is None or t is str or t is int or t is bool:
+    return value
+  if t is float:
+    return value if value == value and value not in (_INF, -_INF) else {"$float": repr(value)}
+  if t is list:
+    return [_to_json(item) for item in value]
+  if t is dict:
+    if all(type(key) is str and not key.startswith("$") for key in value):
+      return {key: _to_json(item) for key, item in value.items()}
+    return {"$dict": [[_to_json(key), _to_json(item)] for key, item in value.items()]}
+  if t is tuple:
+    return {"$tuple": [_to_json(item) for item in value]}
+  if t is edag.Net:
+    return {"$net": value.name}
+  if t is edag.PinMap:
+    return {"$pin_map": [[_to_json(key), _to_json(pads)] for key, pads in value.items()], "package": value.package}
+  if _NOTE_TYPES.get(t.__name__) is t:
+    return {"$note": t.__name__, "value": _to_json(value[0])}
+  raise TypeError(f"Can't store {t.__name__} value {value!r} in a design file")
+
+
+def _from_json(value):
+  t = type(value)
+  if t is list:
+    return [_from_json(item) for item in value]
+  if t is not dict:
+    return value
+  if "$float" in value:
+    return float(value["$float"])
+  if "$dict" in value:
+    return {_from_json(key): _from_json(item) for key, item in value["$dict"]}
+  if "$tuple" in value:
+    return tuple(_from_json(item) for item in value["$tuple"])
+  if "$net" in value:
+    return edag.Net(value["$net"])
+  if "$pin_map" in value:
+    return edag.PinMap({_from_json(key): _from_json(pads) for key, pads in value["$pin_map"]}, value["package"])
+  if "$note" in value:
+    return _NOTE_TYPES[value["$note"]](_from_json(value["value"]))
+  return {key: _from_json(item) for key, item in value.items()}
+
+
+def _encode_value(value, allow_pickle:bool = False) -> bytes:
+  if type(value) is float:
+    return b"f" + _FLOAT.pack(value)
+  try:
+    return b"j" + json.dumps(_to_json(value), separators=(",", ":")).encode("utf-8")
+  except TypeError:
+    if not allow_pickle:
+      raise
+  import pickle
+  return b"p" + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_value(data, allow_pickle:bool = False):
+  tag = data[:1]
+  if tag == b"f":
+    return _FLOAT.unpack_from(data, 1)[0]
+  if tag == b"j":
+    return _from_json(json.loads(bytes(data[1:])))
+  if not allow_pickle:
+    raise ValueError("Design file contains pickled values. Open it with allow_pickle=True, only if it is trusted")
+  import pickle
+  return pickle.loads(data[1:])
+
+
+def _table(items) -> (array, bytes):
+  """Offsets and data of a table of byte strings."""
+  offsets = array("q", [0])
+  total = 0
+  for item in items:
+    total += len(item)
+    offsets.append(total)
+  return offsets, b"".join(items)
+
+
+def _column(typecode:str, values=()) -> array:
+  return array(typecode, values)
+
+
+def _function_name(function):
+  if function is None:
+    return None
+  return f"{function.__module__}:{function.__qualname__}"
+
+
+def save(schematic, filename:str, *, allow_pickle:bool = False):
+  """Atomically write a schematic into a design file.
+
+  Raises TypeError for values of unsupported types, unless allow_pickle.
+  """
+  schematic.flatten()
+  strings, values, nets = _Interner(), _Interner(), _Interner()
+  intern_string, intern_net = strings.intern, nets.intern
+
+  def intern_value(value):
+    return values.intern(value, _value_key(value))
+
+  # Scope tree, in pre-order.
+  scope_rows = {}
+  scope_columns = _column("i")
+  stack = [(schematic.scopes_tree[0], -1)]
+  while stack:
+    scope, parent = stack.pop()
+    scope_rows[id(scope)] = len(scope_rows)
+    function = _function_name(scope.function)
+    scope_columns.extend((intern_string(scope.name), parent,
+                          -1 if function is None else intern_string(function), len(scope.anonymous_nets)))
+    row = scope_rows[id(scope)]
+    stack.extend((sub_scope, row) for sub_scope in reversed(scope.sub_scopes))
+
+  columns = {tag: _column("i") for tag in ("CNAM", "CTYP", "CDES", "CVAL", "CPRP", "CNOT", "CSCO", "PKEY", "PNET")}
+  global_ids, kinds, pin_offsets = _column("q"), _column("b"), _column("q", [0])
+  names, types, designators = columns["CNAM"], columns["CTYP"], columns["CDES"]
+  own, common, notes, scopes = columns["CVAL"], columns["CPRP"], columns["CNOT"], columns["CSCO"]
+  pin_keys, pin_nets = columns["PKEY"], columns["PNET"]
+  component_scopes, root_row = schematic.component_scopes, 0
+  for component in schematic.registered_components:
+    names.append(intern_string(component.name))
+    types.append(intern_string(component.type))
+    designators.append(intern_string(component.id))
+    global_ids.append(component.global_id)
+    own.append(intern_value(component.own_properties))
+    common.append(intern_value(component.common_properties))
+    notes.append(intern_value(list(component.notes)))
+    scope = component_scopes.get(component.global_id)
+    scopes.append(root_row if scope is None else scope_rows[id(scope)])
+    if type(component.pin_nets) is list:
+      kinds.append(0)
+      for net in component.pin_nets:
+        pin_keys.append(-1)
+        pin_nets.append(-1 if net is None else intern_net(net))
+    else:
+      kinds.append(1)
+      for pin_key, net in component.pin_nets.items():
+        pin_keys.append(intern_value(pin_key))
+        pin_nets.append(-1 if net is None else intern_net(net))
+    pin_offsets.append(len(pin_nets))
+
+  merges = _column("i")
+  union = schematic.net_union
+  for members in union.members.values():
+    representative = intern_net(union.resolve(members[0]))
+    for net in members:
+      net = intern_net(net)
+      if net != representative:
+        merges.extend((net, representative))
+
+  net_names = _column("i", [intern_string(net.name) for net in nets.values])
+  string_offsets, string_data = _table([s.encode("utf-8") for s in strings.values])
+  value_offsets, value_data = _table([_encode_value(v, allow_pickle) for v in values.values])
+  meta = {"global_id": schematic.global_id, "component_id": dict(schematic.component_id)}
+
+  sections = [("SOFF", string_offsets), ("SDAT", string_data), ("VOFF", value_offsets), ("VDAT", value_data),
+              ("NETS", net_names), ("CGID", global_ids), ("CKND", kinds), ("POFF", pin_offsets)]
+  sections += list(columns.items())
+  sections += [("SCOP", scope_columns), ("MERG", merges),
+               ("TIES", _column("q", schematic.ties)), ("SIMO", _column("q", sorted(schematic.simonly))),
+               ("META", json.dumps(meta).encode("utf-8"))]
+
+  chunks = []
+  offset = _HEADER.size + _DIRECTORY_ENTRY.size * len(sections)
+  directory = [_HEADER.pack(_MAGIC, _VERSION, len(sections))]
+  for tag, data in sections:
+    if isinstance(data, array):
+      if not _LITTLE_ENDIAN:
+        data = array(data.typecode, data)
+        data.byteswap()
+      data = data.tobytes()
+    padding = -offset % 8
+    chunks.append(b"\0" * padding)
+    offset += padding
+    directory.append(_DIRECTORY_ENTRY.pack(tag.encode("ascii"), offset, len(data)))
+    chunks.append(data)
+    offset += len(data)
+  edag._atomic_write(filename, b"".join(directory + chunks))
+
+
+class DesignFile(object):
+  """A design file, read through mmap. A list-like container of components.
+
+  Indexing and iteration return new Component views, decoded on access.
+  Common properties, and other values, are shared by views. They should
+  not be modified. Use as a context manager, or call close(). Pickled
+  values are only read with allow_pickle (unsafe for untrusted files).
+  """
+  def __init__(self, filename:str, *, allow_pickle:bool = False):
+    self.allow_pickle = allow_pickle
+    self.file = open(filename, "rb")
+    self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    self.views = [memoryview(self.mmap)]
+    data = self.views[0]
+    magic, version, count = _HEADER.unpack_from(data, 0)
+    assert magic == _MAGIC, f"{filename} is not an edag design file"
+    assert version == _VERSION, f"Unsupported design file version {version} in {filename}"
+    self.sections = {}
+    for i in range(count):
+      tag, offset, length = _DIRECTORY_ENTRY.unpack_from(data, _HEADER.size + i * _DIRECTORY_ENTRY.size)
+      self.sections[tag.decode("ascii")] = self._view(data[offset:offset + length])
+
+    self.string_offsets, self.value_offsets = self._column("SOFF", "q"), self._column("VOFF", "q")
+    self.net_names = self._column("NETS", "i")
+    self.name_ids, self.type_ids, self.designator_ids = (self._column(tag, "i") for tag in ("CNAM", "CTYP", "CDES"))
+    self.global_ids, self.pin_kinds = self._column("CGID", "q"), self._column("CKND", "b")
+    self.value_ids, self.property_ids, self.notes_ids = (self._column(tag, "i") for tag in ("CVAL", "CPRP", "CNOT"))
+    self.scope_ids = self._column("CSCO", "i")
+    self.pin_offsets = self._column("POFF", "q")
+    self.pin_key_ids, self.pin_net_ids = self._column("PKEY", "i"), self._column("PNET", "i")
+    self.meta = json.loads(bytes(self.sections["META"]))
+    self._strings, self._values, self._nets = {}, {}, {}
+
+  def _view(self, view):
+    self.views.append(view)
+    return view
+
+  def _column(self, tag:str, typecode:str):
+    data = self.sections[tag]
+    if _LITTLE_ENDIAN:
+      return self._view(data.cast(typecode))
+    column = array(typecode, bytes(data))
+    column.byteswap()
+    return column
+
+  def close(self):
+    # All views of the mmap must be released first.
+    for view in reversed(self.views):
+      view.release()
+    self.views.clear()
+    self.mmap.close()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def string(self, i:int) -> str:
+    s = self._strings.get(i)
+    if s is None:
+      offsets = self.string_offsets
+      s = self._strings[i] = str(self.sections["SDAT"][offsets[i]:offsets[i + 1]], "utf-8")
+    return s
+
+  def value(self, i:int):
+    if i in self._values:
+      return self._values[i]
+    offsets = self.value_offsets
+    value = self._values[i] = _decode_value(self.sections["VDAT"][offsets[i]:offsets[i + 1]], self.allow_pickle)
+    return value
+
+  def net(self, i:int):
+    net = self._nets.get(i)
+    if net is None:
+      net = self._nets[i] = edag.Net(self.string(self.net_names[i]))
+    return net
+
+  def __len__(self):
+    return len(self.global_ids)
+
+  def __getitem__(self, i:int):
+    if i < 0:
+      i += len(self.global_ids)
+    if not 0 <= i < len(self.global_ids):
+      raise IndexError(i)
+    return self._component(i)
+
+  def __iter__(self):
+    for i in range(len(self.global_ids)):
+      yield self._component(i)
+
+  def _pin_nets(self, i:int):
+    net = self.net
+    start, end = self.pin_offsets[i], self.pin_offsets[i + 1]
+    nets = [None if n < 0 else net(n) for n in self.pin_net_ids[start:end]]
+    if self.pin_kinds[i] == 0:
+      return nets
+    value = self.value
+    return {value(k): n for k, n in zip(self.pin_key_ids[start:end], nets)}
+
+  def _component(self, i:int):
+    string, value = self.string, self.value
+    return edag.Component(string(self.name_ids[i]), string(self.type_ids[i]), string(self.designator_ids[i]),
+                          self.global_ids[i], self._pin_nets(i), value(self.property_ids[i]),
+                          value(self.value_ids[i]), list(value(self.notes_ids[i])))
+
+  def scopes(self):
+    """Scope tree, as a list of _NewScope in pre-order. The first is the root."""
+    rows = self._column("SCOP", "i")
+    scopes = []
+    for i in range(0, len(rows), 4):
+      name, parent, function, anonymous_count = rows[i:i + 4]
+      parent = scopes[parent] if parent >= 0 else None
+      scope = edag.Schematic._NewScope(self.string(name), parent, len(parent.sub_scopes) if parent else 0)
+      scope.function = None if function < 0 else _resolve_function(self.string(function))
+      scope.anonymous_nets = [edag.Net._from_parts(scope.net_prefix_id, k) for k in range(anonymous_count)]
+      if parent is not None:
+        parent.sub_scopes.append(scope)
+      scopes.append(scope)
+    return scopes
+
+  def schematic(self, *, columnar:bool = False):
+    """A new Schematic with all components, nets and scopes of the design."""
+    s = edag.Schematic(columnar=columnar)
+    scopes = self.scopes()
+    s.scopes_tree = [scopes[0]]
+    s.scopes = [scopes[0]]
+    s.current_scope = scopes[0]
+    scope_ids = self.scope_ids
+    for i in range(len(self)):
+      component = self._component(i)
+      s.register_component(component)
+      s.component_scopes[component.global_id] = scopes[scope_ids[i]]
+      s.used_designators.add(component.id)
+    merges = self._column("MERG", "i")
+    for i in range(0, len(merges), 2):
+      # Representative first, so it stays the name of the merged net.
+      s.net_union.union(self.net(merges[i + 1]), self.net(merges[i]))
+    for global_id in self._column("TIES", "q"):
+      s.register_tie(s.components_by_global_id[global_id])
+    s.simonly.update(self._column("SIMO", "q"))
+    s.global_id = self.meta["global_id"]
+    s.component_id.update(self.meta["component_id"])
+    return s
+
+
+def _resolve_function(name:str):
+  """Function of a scope, only if its module is already imported."""
+  module_name, qualname = name.split(":")
+  obj = sys.modules.get(module_name)
+  for attribute in qualname.split("."):
+    obj = getattr(obj, attribute, None)
+  return obj
+
+
+def load(filename:str, *, columnar:bool = False, allow_pickle:bool = False):
+  """Read a design file into a new Schematic."""
+  with DesignFile(filename, allow_pickle=allow_pickle) as design:
+    return design.schematic(columnar=columnar)
+
+
+import unittest
+
+
+class Test_binary(unittest.TestCase):
+  def capture(self):
+    import edag_components
+
+    @edag.Scope()
+    def channel(vin, value):
+      mid = edag.scoped_net("mid")
+      edag.make_component("top", "R", [vin, mid], [], value, prefix="R", notes=["top"])
+      edag.make_component("u", "lm7805", {"in": mid, "gnd": edag.GND(), "out": None},
+                          {"pin_map": edag.PinMap({"in": 1, "gnd": 2, "out": 3}, "TO-220")}, {"voltage": 5.0})
+      edag_components.tie("tie", a=mid, b=edag.net())
+
+    with edag.NewGlobalScope(hierarchical=True) as s:
+      vin = edag.net("VIN")
+      for i in range(3):
+        edag.cached_sub(channel, vin, 1000.0)
+      edag.make_component("probe", "R", [vin, None], [], (1, 2), prefix="R", simonly=True)
+      edag.merge(vin, edag.net("VBAT"))
+      edag.sub(edag._test_channel, vin, 10.0)
+    return s
+
+  def netlist(self, s):
+    import io
+    out = io.StringIO()
+    edag.export_(s, out, collapse_ties=True)
+    return out.getvalue()
+
+  def test_roundtrip(self):
+    from collections import defaultdict
+    import tempfile
+    s = self.capture()
+    with tempfile.TemporaryDirectory() as tmp:
+      filename = os.path.join(tmp, "design.edag")
+      save(s, filename)
+      with DesignFile(filename) as design:
+        self.assertEqual(len(design), 12)
+        self.assertEqual(list(design), list(s.registered_components))
+        by_name = defaultdict(list)
+        for component in design:
+          by_name[component.name].append(component)
+        self.assertEqual(by_name["probe"][0].own_properties, (1, 2))
+        self.assertEqual(by_name["top"][0].notes, ["top"])
+        u = by_name["u"]
+        self.assertEqual(type(u[0].common_properties["pin_map"]).__name__, "PinMap")
+        self.assertIs(u[0].own_properties, u[2].own_properties)
+        self.assertEqual(design[-1], s.registered_components[-1])
+      for columnar in (False, True):
+        s2 = load(filename, columnar=columnar)
+        self.assertEqual(self.netlist(s2), self.netlist(s))
+        self.assertEqual(s2.find_net(edag.net("VBAT")), s.find_net(edag.net("VBAT")))
+        self.assertEqual(s2.simonly, s.simonly)
+        self.assertEqual(s2.scopes_tree[0].sub_scopes[2].sub_scopes[0].path_string, "root/sub_2/scope_0")
+        # Only module level functions are found.
+        self.assertIsNone(s2.scopes_tree[0].sub_scopes[1].sub_scopes[0].function)
+        self.assertIs(s2.scopes_tree[0].sub_scopes[3].sub_scopes[0].function, edag._test_channel)
+        self.assertEqual({global_id: scope.path_string for global_id, scope in s2.component_scopes.items()},
+                         {global_id: scope.path_string for global_id, scope in s.component_scopes.items()})
+        # Capture can continue, with new designators.
+        self.assertEqual(s2._assign_designator("root", "R", "new", "R", 1.0, 0), "R9")
+
+  def test_values(self):
+    pin_map = edag.PinMap({"in": 1, "gnd": (2, 4), "out": 3}, "SOIC-8")
+    for value in (1.5, 1, "x", [1, "a"], {"model": None}, {1: 2}, {"$net": 1}, (1, (2,)), [], float("inf"),
+                  edag.GND(), {"pin_map": pin_map}, [edag_notes.Warning("hot"), "x"], True):
+      decoded = _decode_value(_encode_value(value))
+      self.assertEqual(decoded, value)
+      self.assertIs(type(decoded), type(value))
+    self.assertNotEqual(_decode_value(_encode_value(float("nan"))), 0.0)
+    self.assertEqual(_decode_value(_encode_value(pin_map)).package, "SOIC-8")
+    self.assertEqual(_encode_value((1,)), b'j{"$tuple":[1]}')
+
+  def test_equal_values(self):
+    import math
+    import tempfile
+    values = [(1000, 0.25), (1000.0, 0.25), 0.0, -0.0, 1, 1.0]
+    with edag.NewGlobalScope() as s:
+      for value in values:
+        edag.make_component("r", "R", [edag.net("A"), None], [], value)
+    with tempfile.TemporaryDirectory() as tmp:
+      filename = os.path.join(tmp, "design.edag")
+      save(s, filename)
+      loaded = [c.own_properties for c in load(filename).registered_components]
+    self.assertEqual([repr(v) for v in loaded], [repr(v) for v in values])
+    self.assertEqual(math.copysign(1.0, loaded[2]), 1.0)
+
+  def test_pickle(self):
+    import tempfile
+    with self.assertRaises(TypeError):
+      _encode_value(object())
+    data = _encode_value({1, 2}, allow_pickle=True)
+    self.assertEqual(data[:1], b"p")
+    with self.assertRaises(ValueError):
+      _decode_value(data)
+    self.assertEqual(_decode_value(data, allow_pickle=True), {1, 2})
+    with edag.NewGlobalScope() as s:
+      edag.make_component("r", "R", [edag.net("A"), None], [], {1, 2})
+    with tempfile.TemporaryDirectory() as tmp:
+      filename = os.path.join(tmp, "design.edag")
+      with self.assertRaises(TypeError):
+        save(s, filename)
+      self.assertFalse(os.path.exists(filename))
+      save(s, filename, allow_pickle=True)
+      with DesignFile(filename) as design:
+        with self.assertRaises(ValueError):
+          design[0]
+      self.assertEqual(load(filename, allow_pickle=True).registered_components[0].own_properties, {1, 2})
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
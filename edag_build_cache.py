@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+"""Content addressed build cache for edag.process().
+
+The key of a build is a hash of all sources it could depend on: the edag
+library (edag*.py and everything in parts/), the design (all modules it
+could import from its import root, see source_files), the
+schematic function and its arguments (if it is a functools.partial),
+command line arguments, and the stable ids database loaded at the start of
+the run.
+
+A cache entry is a pickle of the captured schematic, the exported netlist,
+and the saved stable ids database. On a hit, the schematic function is not
+called. The schematic is restored from the entry, and the outputs are
+written like by a normal run. Other side effects of the schematic function
+(i.e. printed messages) are not replayed. Schematics that can't be pickled
+(i.e. with Scope decorated functions not defined at the module level) are
+never cached.
+
+Entries are never removed. It is safe to delete the cache directory at any
+time.
+"""
+
+import functools
+import hashlib
+import io
+import os
+import pickle
+import sys
+
+import edag
+
+
+# Bump when the content of entries changes, to invalidate old caches.
+_CACHE_VERSION = 1
+
+_LIBRARY_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _design_root(filename:str) -> str:
+  """Import root of a module: its directory, or the directory above its top level package."""
+  directory = os.path.dirname(os.path.abspath(filename))
+  while os.path.exists(os.path.join(directory, "__init__.py")):
+    directory = os.path.dirname(directory)
+  return directory
+
+
+def source_files(function):
+  """Sorted list of (root directory, path) of all sources a design can depend on.
+
+  Design sources are all modules importable from the import root of the
+  schematic function module (see _design_root), not only the loaded ones, as
+  the schematic function can import more: Python files in the root, and in
+  packages (directories with __init__.py) below it. Other directories are
+  not searched, so the cost stays low even for a script in a big directory
+  (i.e. a home directory, or a monorepo root). Still, all these files are
+  read on every run.
+  """
+  files = set()
+  for name in os.listdir(_LIBRARY_DIR):
+    if name.startswith("edag") and name.endswith(".py"):
+      files.add((_LIBRARY_DIR, os.path.join(_LIBRARY_DIR, name)))
+  parts = os.path.join(_LIBRARY_DIR, "parts")
+  for directory, _, names in os.walk(parts):
+    for name in names:
+      if name.endswith(".py"):
+        files.add((_LIBRARY_DIR, os.path.join(directory, name)))
+  while isinstance(function, functools.partial):
+    function = function.func
+  module = sys.modules.get(function.__module__)
+  filename = getattr(module, "__file__", None)
+  if filename:
+    design_dir = _design_root(filename)
+    for directory, dirs, names in os.walk(design_dir):
+      dirs[:] = [d for d in dirs if not d.startswith(".") and os.path.exists(os.path.join(directory, d, "__init__.py"))]
+      for name in names:
+        if name.endswith(".py"):
+          files.add((design_dir, os.path.join(directory, name)))
+  return sorted(files)
+
+
+def _function_signature(function):
+  """Name and arguments of a schematic function, possibly wrapped in functools.partial."""
+  if isinstance(function, functools.partial):
+    return [_function_signature(function.func), repr(function.args), repr(sorted(function.keywords.items()))]
+  return f"{function.__module__}.{function.__qualname__}"
+
+
+def build_key(function, stable_ids:bytes = None) -> str:
+  """Cache key of a process() run of function, with a given stable ids database content."""
+  h = hashlib.sha256()
+  header = [_CACHE_VERSION, list(sys.version_info[:2]), _function_signature(function), sys.argv[1:]]
+  h.update(repr(header).encode("utf-8"))
+  for root, filename in source_files(function):
+    with open(filename, "rb") as f:
+      data = f.read()
+    # Relative, so the cache can be shared between checkouts.
+    h.update(f"\0{os.path.relpath(filename, root)}\0{len(data)}\0".encode("utf-8"))
+    h.update(data)
+  h.update(b"\0ids\0" + (stable_ids if stable_ids is not None else b"-"))
+  return h.hexdigest()
+
+
+def _entry_filename(directory:str, key:str) -> str:
+  return os.path.join(directory, key[:2], key + ".pickle")
+
+
+def load(directory:str, key:str):
+  """Cache entry (a dict), or None if not found."""
+  try:
+    with open(_entry_filename(directory, key), "rb") as f:
+      entry = pickle.load(f)
+  except FileNotFoundError:
+    return None
+  except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+    # Corrupted, or refers to things that don't exist anymore.
+    return None
+  if entry.get("version") != _CACHE_VERSION:
+    return None
+  return entry
+
+
+def store(directory:str, key:str, entry:dict):
+  """Atomically store a cache entry. Returns False if it can't be pickled."""
+  try:
+    data = pickle.dumps(dict(entry, version=_CACHE_VERSION), protocol=pickle.HIGHEST_PROTOCOL)
+  except (pickle.PicklingError, AttributeError, TypeError):
+    return False
+  filename = _entry_filename(directory, key)
+  os.makedirs(os.path.dirname(filename), exist_ok=True)
+  edag._atomic_write(filename, data)
+  return True
+
+
+def _read(filename:str):
+  try:
+    with open(filename, "rb") as f:
+      return f.read()
+  except FileNotFoundError:
+    return None
+
+
+def cached_process(schematic, function, directory:str):
+  """Like edag.process(function), but using the build cache in directory.
+
+  Returns True on a cache hit.
+  """
+  ids_filename = edag._default_stable_ids_filename()
+  stable_ids = _read(ids_filename)
+  key = build_key(function, stable_ids)
+  entry = load(directory, key)
+  if entry is not None:
+    schematic.__dict__.update(entry["schematic"].__dict__)
+    hit = True
+  else:
+    schematic.load_stable_ids(ids_filename)
+    function()
+    netlist = io.BytesIO()
+    edag.export_(schematic, netlist)
+    schematic.save_stable_ids(ids_filename)
+    entry = {"schematic": schematic, "netlist": netlist.getvalue(), "stable_ids": _read(ids_filename)}
+    store(directory, key, entry)
+    hit = False
+  edag._write_output(entry["netlist"])
+  if hit and entry["stable_ids"] != stable_ids:
+    edag._atomic_write(ids_filename, entry["stable_ids"])
+  return hit
+
+
+import unittest
+
+
+_test_calls = []
+
+
+def _test_design():
+  _test_calls.append(1)
+  vin = edag.net("VIN")
+  edag.make_component("load", "R", [vin, edag.GND()], [], 1000.0, prefix="R")
+  edag.make_component("bulk", "C", [vin, edag.GND()], [], 1.0e-6, prefix="C")
+
+
+class Test_build_cache(unittest.TestCase):
+  def run_process(self, function, cache_dir):
+    import contextlib
+    out = io.StringIO()
+    with edag.NewGlobalScope() as s, contextlib.redirect_stdout(out):
+      edag.process(function, cache_dir=cache_dir)
+    return s, out.getvalue()
+
+  def test_hit(self):
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+      previous, edag.stable_ids_filename = edag.stable_ids_filename, os.path.join(tmp, "ids.json")
+      try:
+        cache = os.path.join(tmp, "cache")
+        _test_calls.clear()
+        s1, netlist = self.run_process(_test_design, cache)
+        self.assertIn('(comp (ref "C1")', netlist)
+        # First run creates the stable ids, so the key changes once.
+        s2, netlist2 = self.run_process(_test_design, cache)
+        s3, netlist3 = self.run_process(_test_design, cache)
+        self.assertEqual(len(_test_calls), 2)
+        self.assertEqual(netlist3, netlist)
+        self.assertEqual([c.id for c in s3.registered_components], ["R1", "C1"])
+        self.assertEqual(s3.net_degree(edag.net("VIN")), 2)
+        # Different arguments are a miss.
+        self.run_process(functools.partial(_test_design), cache)
+        self.assertEqual(len(_test_calls), 3)
+        # Same as the first run, which restores the stable ids.
+        os.unlink(edag.stable_ids_filename)
+        self.run_process(_test_design, cache)
+        self.assertEqual(len(_test_calls), 3)
+        self.assertTrue(os.path.exists(edag.stable_ids_filename))
+      finally:
+        edag.stable_ids_filename = previous
+
+  def test_key(self):
+    key = build_key(_test_design)
+    self.assertEqual(key, build_key(_test_design))
+    self.assertNotEqual(key, build_key(_test_design, b"{}"))
+    self.assertNotEqual(key, build_key(functools.partial(_test_design)))
+    files = [os.path.relpath(f, root) for root, f in source_files(_test_design)]
+    self.assertIn("edag.py", files)
+    self.assertIn(os.path.join("parts", "edag_linear.py"), files)
+
+  def test_key_not_loaded_module(self):
+    import importlib
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+      with open(os.path.join(tmp, "_edag_cache_test_top.py"), "w") as f:
+        f.write("def top():\n  import _edag_cache_test_sib\n  _edag_cache_test_sib.build()\n")
+      sib = os.path.join(tmp, "_edag_cache_test_sib.py")
+      with open(sib, "w") as f:
+        f.write("VALUE = 10.0\n")
+      sys.path.insert(0, tmp)
+      try:
+        top = importlib.import_module("_edag_cache_test_top")
+        key = build_key(top.top)
+        self.assertNotIn("_edag_cache_test_sib", sys.modules)
+        with open(sib, "w") as f:
+          f.write("VALUE = 22.0\n")
+        self.assertNotEqual(key, build_key(top.top))
+        # Packages below the root are included, other directories are not.
+        for directory in ("pkg", "data"):
+          os.mkdir(os.path.join(tmp, directory))
+        for name in ("pkg/__init__.py", "pkg/mod.py", "data/script.py"):
+          with open(os.path.join(tmp, name), "w") as f:
+            f.write("\n")
+        files = [os.path.relpath(f, root) for root, f in source_files(top.top) if root == tmp]
+        self.assertEqual(files, ["_edag_cache_test_sib.py", "_edag_cache_test_top.py",
+                                 os.path.join("pkg", "__init__.py"), os.path.join("pkg", "mod.py")])
+        self.assertEqual(_design_root(os.path.join(tmp, "pkg", "mod.py")), tmp)
+      finally:
+        sys.path.remove(tmp)
+        sys.modules.pop("_edag_cache_test_top", None)
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
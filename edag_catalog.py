@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+"""Indexed parametric parts catalog.
+
+Parts modules (parts/*.py) describe their parts in a module level CATALOG
+list of dicts. These must be literals, so they are read with ast, without
+importing the modules (and everything they import).
+
+All entries are stored in an sqlite index file, with secondary indexes on
+kind, package and every numeric parameter. By default, the index is in the
+EDAG_CATALOG_DIR directory if set, otherwise in edag/ of the user cache
+directory ($XDG_CACHE_HOME, or ~/.cache), so the sources can be read-only.
+It is independent of EDAG_CACHE_DIR, which turns on the build cache of
+edag.process().
+The index is rebuilt automatically when any parts module changes (by size
+and modification time).
+
+The same sources give the manifest of public names of parts modules
+(parts/_manifest.py), used by the parts package to import a module only when
+one of its names is used. Regenerate it with write_manifest() after adding
+or renaming parts.
+
+Queries return CatalogPart with a callable factory. The factory imports the
+parts module on first call, if the part has a factory function there, or
+creates the component from the pin map of the package otherwise. Then nets
+of all pins must be given (None for unconnected pins).
+
+Example:
+
+  # LDO, 3.3V, at least 500mA, in SOT-223.
+  for part in query(kind="ldo", voltage=3.3, current_min=0.5, package="SOT-223"):
+    print(part.name, part.params["dropout"])
+  part.factory("ldo", package="SOT-223", input=v_in, gnd=gnd, output=v_out)
+"""
+
+from collections import namedtuple
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+
+
+# Bump when the index schema or content changes.
+_INDEX_VERSION = 1
+
+_PARTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parts")
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE parts (id INTEGER PRIMARY KEY, name TEXT, kind TEXT, manufacturer TEXT,
+                    module TEXT, factory TEXT, description TEXT);
+CREATE TABLE packages (part_id INTEGER, package TEXT, pin_map TEXT);
+CREATE TABLE params (part_id INTEGER, key TEXT, value REAL);
+CREATE INDEX parts_name ON parts (name COLLATE NOCASE);
+CREATE INDEX parts_kind ON parts (kind);
+CREATE INDEX packages_package ON packages (package, part_id);
+CREATE INDEX packages_part ON packages (part_id);
+CREATE INDEX params_key_value ON params (key, value, part_id);
+CREATE INDEX params_part ON params (part_id);
+"""
+
+# Keys of an entry, which are not parameters.
+_FIELDS = ("name", "kind", "manufacturer", "factory", "description", "packages")
+
+# name, kind, manufacturer and description are strings (or None).
+# packages: dict of package -> pin map (dict pin -> number, or None).
+# params: dict of numeric parameters, i.e. voltage, current, dropout, drift.
+# factory: callable creating the component, or None if not possible.
+CatalogPart = namedtuple("CatalogPart", ["name", "kind", "manufacturer", "description", "packages", "params", "factory"])
+
+
+def default_index(sources:str = _PARTS_DIR):
+  """Index file of the sources directory, in the cache directory (see module docstring)."""
+  directory = os.environ.get("EDAG_CATALOG_DIR")
+  if not directory:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    directory = os.path.join(cache_home, "edag")
+  # One per sources directory, i.e. of different checkouts.
+  key = hashlib.sha256(os.path.abspath(sources).encode("utf-8")).hexdigest()[:16]
+  return os.path.join(directory, f"catalog-{key}.sqlite")
+
+
+def _source_files(sources:str):
+  return sorted(os.path.join(sources, f) for f in os.listdir(sources) if f.endswith(".py"))
+
+
+def _signature(sources:str):
+  """Identifies the state of all parts modules, without reading them."""
+  return json.dumps([(os.path.basename(f), s.st_size, s.st_mtime_ns)
+                     for f, s in ((f, os.stat(f)) for f in _source_files(sources))])
+
+
+def read_entries(filename:str):
+  """Returns CATALOG list of the parts module, without importing it."""
+  with open(filename, "r", encoding="utf-8") as f:
+    tree = ast.parse(f.read(), filename)
+  for node in tree.body:
+    if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == "CATALOG" for t in node.targets):
+      entries = ast.literal_eval(node.value)
+      for entry in entries:
+        assert "name" in entry and "kind" in entry, f"Catalog entry without a name or kind in {filename}: {entry}"
+      return entries
+  return []
+
+
+def _public_names(filename:str):
+  """Names of module level functions, classes and variables, without importing it."""
+  with open(filename, "r", encoding="utf-8") as f:
+    tree = ast.parse(f.read(), filename)
+  names = []
+  for node in tree.body:
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+      names.append(node.name)
+    elif isinstance(node, ast.Assign):
+      names += [t.id for t in node.targets if isinstance(t, ast.Name)]
+  return [name for name in dict.fromkeys(names) if not name.startswith("_") and name != "CATALOG"]
+
+
+def manifest(sources:str = _PARTS_DIR):
+  """Returns dict of public name -> parts module (without the package) defining it."""
+  result = {}
+  for filename in _source_files(sources):
+    module = os.path.basename(filename)[:-3]
+    if module.startswith("_"):
+      continue
+    for name in _public_names(filename):
+      assert name not in result, f"{name} defined in both {result.get(name)} and {module}"
+      result[name] = module
+  return result
+
+
+_MANIFEST_HEADER = """\
+# Generated by edag_catalog.write_manifest(). Do not edit.
+#
+# Public names of parts modules -> module defining them, for lazy imports.
+
+"""
+
+
+def _manifest_source(sources:str):
+  lines = [f"  {name!r}: {module!r},\n" for name, module in manifest(sources).items()]
+  return _MANIFEST_HEADER + "MANIFEST = {\n" + "".join(lines) + "}\n"
+
+
+def write_manifest(sources:str = _PARTS_DIR):
+  """Regenerate _manifest.py of the parts package."""
+  import edag
+  edag._atomic_write(os.path.join(sources, "_manifest.py"), _manifest_source(sources).encode("utf-8"))
+
+
+def _build(index:str, sources:str, signature:str):
+  """Writes a new index file, replacing the old one atomically."""
+  package = os.path.basename(sources)
+  os.makedirs(os.path.dirname(os.path.abspath(index)), exist_ok=True)
+  tmp = f"{index}.tmp{os.getpid()}"
+  if os.path.exists(tmp):
+    os.remove(tmp)
+  db = sqlite3.connect(tmp)
+  try:
+    db.executescript(_SCHEMA)
+    db.executemany("INSERT INTO meta VALUES (?, ?)", [("version", str(_INDEX_VERSION)), ("signature", signature)])
+    for filename in _source_files(sources):
+      if os.path.basename(filename).startswith("_"):
+        continue
+      module = f"{package}.{os.path.basename(filename)[:-3]}"
+      for entry in read_entries(filename):
+        part_id = db.execute("INSERT INTO parts (name, kind, manufacturer, module, factory, description) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (entry["name"], entry["kind"], entry.get("manufacturer"), module,
+                              entry.get("factory"), entry.get("description"))).lastrowid
+        db.executemany("INSERT INTO packages VALUES (?, ?, ?)",
+                       [(part_id, p, json.dumps(pin_map)) for p, pin_map in entry.get("packages", {}).items()])
+        db.executemany("INSERT INTO params VALUES (?, ?, ?)",
+                       [(part_id, key, value) for key, value in entry.items()
+                        if key not in _FIELDS and type(value) in (int, float)])
+    db.commit()
+  finally:
+    db.close()
+  os.replace(tmp, index)
+
+
+class _LazyFactory(object):
+  """Factory function from a parts module, imported on first call."""
+  def __init__(self, module:str, name:str):
+    self.module = module
+    self.name = name
+    self.function = None
+
+  def __call__(self, *args, **kwargs):
+    if self.function is None:
+      import importlib
+      self.function = getattr(importlib.import_module(self.module), self.name)
+    return self.function(*args, **kwargs)
+
+  def __repr__(self):
+    return f"<factory {self.module}.{self.name}>"
+
+
+class _PinMapFactory(object):
+  """Creates a part from the pin map of its package.
+
+  Nets are passed by pin names. All pins are required, pass None for
+  unconnected ones.
+  """
+  def __init__(self, name:str, packages:dict, params:dict):
+    self.name = name
+    self.packages = packages
+    self.params = params
+    self.pin_maps = {}  # package -> edag.PinMap
+
+  def __call__(self, name:str, *, package:str = None, **nets):
+    import edag
+    package = package or next(p for p, pin_map in self.packages.items() if pin_map)
+    pin_map = self.pin_maps.get(package)
+    if pin_map is None:
+      assert self.packages.get(package), f"Pin map of {self.name} in {package} package is not known"
+      pin_map = self.pin_maps[package] = edag.PinMap(self.packages[package], package)
+    unknown = set(nets) - set(pin_map)
+    assert not unknown, f"{self.name} in {package} package has no pins {sorted(unknown)}"
+    missing = set(pin_map) - set(nets)
+    assert not missing, f"Pins {sorted(missing)} of {self.name} not given. Pass None for unconnected pins"
+    return edag.make_component(name, self.name, {pin: nets[pin] for pin in pin_map},
+                               {"package": package, "pin_map": pin_map}, dict(self.params), prefix="U")
+
+  def __repr__(self):
+    return f"<factory {self.name}>"
+
+
+class Catalog(object):
+  """The parts catalog, backed by an index file. See query."""
+  def __init__(self, index:str = None, sources:str = _PARTS_DIR):
+    self.sources = sources
+    self.index = index or default_index(sources)
+    self.db = None
+    self.signature = None
+
+  def _connect(self):
+    signature = _signature(self.sources)
+    if self.db is not None and signature == self.signature:
+      return self.db
+    if self.db is not None:
+      self.db.close()
+      self.db = None
+    if not self._valid(signature):
+      _build(self.index, self.sources, signature)
+    self.db = sqlite3.connect(self.index, check_same_thread=False)
+    self.signature = signature
+    return self.db
+
+  def _valid(self, signature:str):
+    if not os.path.exists(self.index):
+      return False
+    db = sqlite3.connect(self.index)
+    try:
+      meta = dict(db.execute("SELECT key, value FROM meta"))
+    except sqlite3.DatabaseError:
+      return False
+    finally:
+      db.close()
+    return meta.get("version") == str(_INDEX_VERSION) and meta.get("signature") == signature
+
+  def close(self):
+    if self.db is not None:
+      self.db.close()
+      self.db = None
+
+  def __len__(self):
+    return self._connect().execute("SELECT COUNT(*) FROM parts").fetchone()[0]
+
+  def query(self, *, name:str = None, kind:str = None, manufacturer:str = None, package:str = None, **params):
+    """Returns list of CatalogPart matching all conditions, ordered by name.
+
+    name is a case insensitive glob pattern, i.e. "LM78*". params are
+    conditions on numeric parameters: voltage=3.3 (equal, within 1e-9
+    relative), current_min=0.5 (at least), or noise_rms_max=30e-6 (at most).
+    Parts without the parameter never match.
+    """
+    where, args = [], []
+    if name is not None:
+      where.append("upper(name) GLOB upper(?)")
+      args.append(name)
+    if kind is not None:
+      where.append("kind = ?")
+      args.append(kind)
+    if manufacturer is not None:
+      where.append("manufacturer = ? COLLATE NOCASE")
+      args.append(manufacturer)
+    if package is not None:
+      where.append("id IN (SELECT part_id FROM packages WHERE package = ?)")
+      args.append(package)
+    for key, value in params.items():
+      if key.endswith("_min"):
+        low, high, key = value, None, key[:-4]
+      elif key.endswith("_max"):
+        low, high, key = None, value, key[:-4]
+      else:
+        low, high = sorted((value * (1.0 - 1e-9), value * (1.0 + 1e-9)))
+      condition = "key = ?"
+      args.append(key)
+      if low is not None:
+        condition += " AND value >= ?"
+        args.append(low)
+      if high is not None:
+        condition += " AND value <= ?"
+        args.append(high)
+      where.append(f"id IN (SELECT part_id FROM params WHERE {condition})")
+    sql = "SELECT id, name, kind, manufacturer, module, factory, description FROM parts"
+    if where:
+      sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY name, id"
+    db = self._connect()
+    return [self._part(db, *row) for row in db.execute(sql, args)]
+
+  def get(self, name:str):
+    """The part with the exact name (case insensitive), or None."""
+    parts = self.query(name=name.replace("[", "[[]").replace("*", "[*]").replace("?", "[?]"))
+    return parts[0] if parts else None
+
+  def _part(self, db, part_id, name, kind, manufacturer, module, factory, description):
+    packages = {package: json.loads(pin_map) for package, pin_map in
+                db.execute("SELECT package, pin_map FROM packages WHERE part_id = ? ORDER BY rowid", (part_id,))}
+    params = dict(db.execute("SELECT key, value FROM params WHERE part_id = ? ORDER BY rowid", (part_id,)))
+    if factory:
+      factory = _LazyFactory(module, factory)
+    elif any(packages.values()):
+      factory = _PinMapFactory(name, packages, params)
+    else:
+      factory = None
+    return CatalogPart(name, kind, manufacturer, description, packages, params, factory)
+
+
+_catalog = None
+
+
+def query(**kwargs):
+  """Query the default catalog (of parts/ directory). See Catalog.query."""
+  global _catalog
+  if _catalog is None:
+    _catalog = Catalog()
+  return _catalog.query(**kwargs)
+
+
+import unittest
+
+
+class Test_catalog(unittest.TestCase):
+  def setUp(self):
+    import tempfile
+    self.tmp = tempfile.TemporaryDirectory()
+    self.catalog = Catalog(os.path.join(self.tmp.name, "catalog.sqlite"))
+
+  def tearDown(self):
+    self.catalog.close()
+    self.tmp.cleanup()
+
+  def test_query(self):
+    parts = self.catalog.query(kind="ldo", voltage=3.3, current_min=0.5, package="SOT-223")
+    self.assertEqual([p.name for p in parts], ["AMS1117-3.3", "BL1117-33", "LM1117-3.3"])
+    self.assertEqual(parts[1].packages["SOT-223"], {"gnd": 1, "output": 2, "input": 3})
+    self.assertEqual(parts[1].params["dropout"], 1.3)
+    self.assertEqual([p.name for p in self.catalog.query(name="lm78*", voltage_min=12)],
+                     ["LM7812", "LM7815", "LM7818", "LM7824"])
+    self.assertEqual([p.name for p in self.catalog.query(kind="reference", noise_pp_max=2.0e-6)],
+                     ["ADR420", "ADR421", "ADR423", "LTC6655-2.5"])
+    self.assertEqual(self.catalog.get("tl431").params, {"voltage": 2.495, "accuracy": 0.5})
+    self.assertIsNone(self.catalog.get("LTZ1000").factory)
+    self.assertIsNone(self.catalog.get("no such part"))
+
+  def test_factories(self):
+    import edag
+    bl1117, ams1117 = self.catalog.query(name="*1117-33") + self.catalog.query(name="AMS1117-3.3")
+    with edag.NewGlobalScope() as s:
+      v_in, gnd, v_out = edag.net("v_in"), edag.net("gnd"), edag.net("v_out")
+      u1 = bl1117.factory("ldo1", input=v_in, gnd=gnd, output=v_out)
+      self.assertEqual((u1.type, u1.own_properties), ("bl1117-33", {"voltage": 3.3}))
+      u2 = ams1117.factory("ldo2", package="TO-252", input=v_in, gnd=gnd, output=v_out)
+      self.assertEqual(u2.type, "AMS1117-3.3")
+      self.assertEqual(u2.common_properties, {"package": "TO-252", "pin_map": {"gnd": 1, "output": 2, "input": 3}})
+      self.assertEqual(u2.pin_nets, {"gnd": gnd, "output": v_out, "input": v_in})
+      with self.assertRaises(AssertionError):
+        ams1117.factory("ldo3", input=v_in, enable=v_in)
+      with self.assertRaisesRegex(AssertionError, r"Pins \['output'\] of AMS1117-3.3 not given"):
+        ams1117.factory("ldo3", input=v_in, gnd=gnd)
+      u3 = ams1117.factory("ldo3", input=v_in, gnd=gnd, output=None)
+      self.assertEqual(u3.pin_nets, {"gnd": gnd, "output": None, "input": v_in})
+
+  def test_default_index(self):
+    environ = dict(os.environ)
+    try:
+      os.environ.pop("EDAG_CATALOG_DIR", None)
+      os.environ["EDAG_CACHE_DIR"] = os.path.join(self.tmp.name, "build")
+      os.environ["XDG_CACHE_HOME"] = self.tmp.name
+      index = default_index()
+      self.assertEqual(os.path.dirname(index), os.path.join(self.tmp.name, "edag"))
+      self.assertNotEqual(index, default_index(os.path.join(self.tmp.name, "parts")))
+      os.environ["EDAG_CATALOG_DIR"] = os.path.join(self.tmp.name, "cache")
+      catalog = Catalog()
+      self.assertEqual(os.path.dirname(catalog.index), os.path.join(self.tmp.name, "cache"))
+      self.assertGreater(len(catalog), 0)
+      self.assertTrue(os.path.exists(catalog.index))
+      catalog.close()
+    finally:
+      os.environ.clear()
+      os.environ.update(environ)
+
+  def test_manifest(self):
+    with open(os.path.join(_PARTS_DIR, "_manifest.py"), encoding="utf-8") as f:
+      self.assertEqual(f.read(), _manifest_source(_PARTS_DIR), "Outdated manifest, run write_manifest()")
+    self.assertEqual(manifest()["lm7805"], "edag_linear")
+    import subprocess
+    import sys
+    code = "import parts, sys; print(parts.lm7805.__name__, sorted(m for m in sys.modules if m.startswith('parts.')))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(_PARTS_DIR),
+                         capture_output=True, text=True, check=True).stdout
+    self.assertEqual(out, "lm7805 ['parts._manifest', 'parts.edag_linear']\n")
+
+  def test_rebuild(self):
+    import shutil
+    sources = os.path.join(self.tmp.name, "parts")
+    os.mkdir(sources)
+    shutil.copy(os.path.join(_PARTS_DIR, "edag_references.py"), sources)
+    catalog = Catalog(os.path.join(self.tmp.name, "other.sqlite"), sources)
+    count = len(catalog)
+    self.assertEqual(len(catalog.query(kind="ldo")), 0)
+    with open(os.path.join(sources, "edag_new.py"), "w") as f:
+      f.write('CATALOG = [{"name": "NEW1", "kind": "ldo", "voltage": 1.0}]\n')
+    self.assertEqual(len(catalog), count + 1)
+    self.assertEqual(catalog.get("new1").params, {"voltage": 1.0})
+    self.assertEqual(catalog.get("new1").factory, None)
+    catalog.close()
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
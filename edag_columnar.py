@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+"""Columnar (struct of arrays) storage of components, for very large designs.
+
+Every component stored in a plain Schematic is a Component namedtuple, with
+own pin_nets dict or list, common_properties and a copied notes list. At
+millions of components this per-object overhead dominates memory.
+
+ColumnarComponentStore keeps the same information in typed arrays (one entry
+per component), a CSR (compressed sparse row) pin -> net table, and interned
+tables of names, types, values, properties and notes, which are usually
+shared by many components. Component views are created on demand.
+
+The connectivity index (net -> pins) of a columnar schematic keeps pins as
+(global_id, pin) integer pairs too, see ColumnarPins.
+
+Use it with edag.NewGlobalScope(columnar=True), or Schematic(columnar=True).
+"""
+
+from array import array
+from bisect import bisect_left
+
+
+class _Interner(object):
+  """Maps values to small integers. Equal values get the same id."""
+  def __init__(self):
+    self.values = []
+    self.ids = {}
+
+  def intern(self, value, key=None):
+    key = value if key is None else key
+    i = self.ids.get(key)
+    if i is None:
+      i = self.ids[key] = len(self.values)
+      self.values.append(value)
+    return i
+
+  def __getitem__(self, i):
+    return self.values[i]
+
+  def __len__(self):
+    return len(self.values)
+
+
+_SCALARS = (str, int, bool, type(None))
+
+
+def _value_key(value):
+  """Interning key of an arbitrary value.
+
+  Equal keys only for values of the same types, at any depth, so i.e. 1 and
+  1.0, or 0.0 and -0.0 are not merged. Other than plain scalars, floats,
+  tuples, lists and dicts, values are interned by identity.
+  """
+  t = type(value)
+  if t in _SCALARS:
+    return (t, value)
+  if t is float:
+    return (t, value.hex())
+  if t is tuple or t is list:
+    return (t, tuple(_value_key(item) for item in value))
+  if t is dict:
+    return (t, tuple((_value_key(k), _value_key(v)) for k, v in value.items()))
+  if issubclass(t, int) and t.__hash__ is int.__hash__:
+    return (t, int(value))  # i.e. Net.
+  return (t, id(value))
+
+
+_LIST_PINS = 0
+_DICT_PINS = 1
+
+
+class _ByGlobalId(object):
+  """Read-only mapping view, global_id -> something, backed by the store."""
+  def __init__(self, store, getter):
+    self.store = store
+    self.getter = getter
+
+  def __getitem__(self, global_id):
+    return self.getter(self.store._row(global_id))
+
+  def __contains__(self, global_id):
+    try:
+      self.store._row(global_id)
+    except KeyError:
+      return False
+    return True
+
+
+class ColumnarPins(object):
+  """Pins on a net, stored as (global_id, pin) integer pairs.
+
+  pin is the index of a list pin, or -1 - interned key of a dict pin. Behaves
+  like a list of Pin, with Pin views created on demand (with designators from
+  the store).
+  """
+  __slots__ = ("store", "global_ids", "pin_ids")
+
+  def __init__(self, store):
+    self.store = store
+    self.global_ids = array('q')
+    self.pin_ids = array('i')
+
+  def add(self, global_id, pin_key):
+    self.global_ids.append(global_id)
+    self.pin_ids.append(pin_key if type(pin_key) is int and pin_key >= 0 else -1 - self.store.pin_keys.intern(pin_key))
+
+  def append(self, pin):
+    self.add(pin.component_global_id, pin.pin)
+
+  def __len__(self):
+    return len(self.global_ids)
+
+  def _pin(self, k):
+    store = self.store
+    global_id, pin = self.global_ids[k], self.pin_ids[k]
+    designator = store.strings.values[store.designator_ids[store._row(global_id)]]
+    return store.pin_class(designator, global_id, pin if pin >= 0 else store.pin_keys.values[-1 - pin])
+
+  def __getitem__(self, k):
+    if k < 0:
+      k += len(self.global_ids)
+    if not 0 <= k < len(self.global_ids):
+      raise IndexError(k)
+    return self._pin(k)
+
+  def __iter__(self):
+    pin = self._pin
+    for k in range(len(self.global_ids)):
+      yield pin(k)
+
+  def sort(self):
+    """Reorder pins by global_id (stable)."""
+    global_ids, pin_ids = self.global_ids, self.pin_ids
+    order = sorted(range(len(global_ids)), key=global_ids.__getitem__)
+    self.global_ids = array('q', [global_ids[k] for k in order])
+    self.pin_ids = array('i', [pin_ids[k] for k in order])
+
+
+class ColumnarComponentStore(object):
+  """A list-like container of components, stored column by column.
+
+  Supports append(), len(), iteration and indexing, like a list of
+  components. Indexing and iteration return new Component views. Modifying
+  a view doesn't modify the store, use set_pin_net() for that.
+
+  common_properties are interned by value, so views of components with equal
+  common_properties share the same object. They should not be modified.
+
+  pin_class is the class of pin views of ColumnarPins (see new_pins).
+  """
+  def __init__(self, component_class, pin_class=None):
+    self.component_class = component_class
+    self.pin_class = pin_class
+
+    self.strings = _Interner()  # names, types, designators
+    self.values = _Interner()   # own_properties
+    self.properties = _Interner()  # common_properties
+    self.notes = _Interner()    # tuples of notes
+    self.pin_keys = _Interner()
+    self.nets = _Interner()
+
+    self.name_ids = array('i')
+    self.type_ids = array('i')
+    self.designator_ids = array('i')
+    self.global_ids = array('q')
+    self.value_ids = array('i')
+    self.property_ids = array('i')
+    self.notes_ids = array('i')
+    self.pin_kinds = array('b')
+
+    # CSR pin table. Pins of row i are pin_offsets[i]:pin_offsets[i+1].
+    self.pin_offsets = array('q', [0])
+    self.pin_key_ids = array('i')
+    self.pin_net_ids = array('i')  # -1 for unconnected pin.
+
+    # False if rows are not in increasing global_id order. See sort().
+    self.sorted = True
+
+    self.by_global_id = _ByGlobalId(self, self._view)
+    self.nets_by_global_id = _ByGlobalId(self, self._row_nets)
+
+  def append(self, component):
+    global_ids = self.global_ids
+    if global_ids and component.global_id <= global_ids[-1]:
+      self.sorted = False
+    strings = self.strings
+    self.name_ids.append(strings.intern(component.name))
+    self.type_ids.append(strings.intern(component.type))
+    self.designator_ids.append(strings.intern(component.id))
+    global_ids.append(component.global_id)
+    value = component.own_properties
+    self.value_ids.append(self.values.intern(value, _value_key(value)))
+    common = component.common_properties
+    self.property_ids.append(self.properties.intern(common, _value_key(common)))
+    notes = tuple(component.notes)
+    self.notes_ids.append(self.notes.intern(notes))
+
+    pin_key_ids, pin_net_ids = self.pin_key_ids, self.pin_net_ids
+    intern_key, intern_net = self.pin_keys.intern, self.nets.intern
+    pin_nets = component.pin_nets
+    if type(pin_nets) is list:
+      self.pin_kinds.append(_LIST_PINS)
+      for net in pin_nets:
+        pin_net_ids.append(-1 if net is None else intern_net(net))
+    else:
+      self.pin_kinds.append(_DICT_PINS)
+      for pin_key, net in pin_nets.items():
+        pin_key_ids.append(intern_key(pin_key))
+        pin_net_ids.append(-1 if net is None else intern_net(net))
+    self.pin_offsets.append(len(pin_net_ids))
+    # Keep key ids aligned with net ids. List pins keys are implicit.
+    pin_key_ids.extend([-1] * (len(pin_net_ids) - len(pin_key_ids)))
+
+  def __len__(self):
+    return len(self.global_ids)
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self.global_ids)
+    if not 0 <= i < len(self.global_ids):
+      raise IndexError(i)
+    return self._view(i)
+
+  def __iter__(self):
+    view = self._view
+    for i in range(len(self.global_ids)):
+      yield view(i)
+
+  def sort(self):
+    """Reorder rows by global_id, after components were appended out of order."""
+    if self.sorted:
+      return
+    global_ids = self.global_ids
+    order = sorted(range(len(global_ids)), key=global_ids.__getitem__)
+    for name in ("name_ids", "type_ids", "designator_ids", "global_ids", "value_ids", "property_ids",
+                 "notes_ids", "pin_kinds"):
+      column = getattr(self, name)
+      setattr(self, name, array(column.typecode, [column[i] for i in order]))
+    offsets, key_ids, net_ids = self.pin_offsets, self.pin_key_ids, self.pin_net_ids
+    self.pin_offsets, self.pin_key_ids, self.pin_net_ids = array('q', [0]), array('i'), array('i')
+    for i in order:
+      start, end = offsets[i], offsets[i + 1]
+      self.pin_key_ids.extend(key_ids[start:end])
+      self.pin_net_ids.extend(net_ids[start:end])
+      self.pin_offsets.append(len(self.pin_net_ids))
+    self.sorted = True
+
+  def _row(self, global_id):
+    if not self.sorted:
+      self.sort()
+    global_ids = self.global_ids
+    i = bisect_left(global_ids, global_id)
+    if i == len(global_ids) or global_ids[i] != global_id:
+      raise KeyError(global_id)
+    return i
+
+  def _row_pin_nets(self, i):
+    nets = self.nets.values
+    start, end = self.pin_offsets[i], self.pin_offsets[i + 1]
+    net_ids = self.pin_net_ids[start:end]
+    if self.pin_kinds[i] == _LIST_PINS:
+      return [None if n < 0 else nets[n] for n in net_ids]
+    keys = self.pin_keys.values
+    return {keys[k]: (None if n < 0 else nets[n]) for k, n in zip(self.pin_key_ids[start:end], net_ids)}
+
+  def _row_nets(self, i):
+    nets = self.nets.values
+    return [nets[n] for n in self.pin_net_ids[self.pin_offsets[i]:self.pin_offsets[i + 1]] if n >= 0]
+
+  def _view(self, i):
+    strings = self.strings.values
+    return self.component_class(strings[self.name_ids[i]],
+                                strings[self.type_ids[i]],
+                                strings[self.designator_ids[i]],
+                                self.global_ids[i],
+                                self._row_pin_nets(i),
+                                self.properties.values[self.property_ids[i]],
+                                self.values.values[self.value_ids[i]],
+                                list(self.notes.values[self.notes_ids[i]]))
+
+  def new_pins(self):
+    """A new, empty ColumnarPins list."""
+    return ColumnarPins(self)
+
+  def set_pin_net(self, global_id, pin_key, net):
+    """Connect a pin of a component to a net.
+
+    Pins not stored yet (past the end of list pins, or new keys of dict pins)
+    are added. That moves the pins of all following components, so it is
+    slow for large stores.
+    """
+    i = self._row(global_id)
+    start, end = self.pin_offsets[i], self.pin_offsets[i + 1]
+    if self.pin_kinds[i] == _LIST_PINS:
+      if not 0 <= pin_key < end - start:
+        if type(pin_key) is not int or pin_key < 0:
+          raise KeyError(pin_key)
+        self._insert_pins(i, [-1] * (pin_key + 1 - (end - start)))
+      slot = start + pin_key
+    else:
+      key_id = self.pin_keys.ids.get(pin_key)
+      slots = [j for j in range(start, end) if self.pin_key_ids[j] == key_id]
+      if slots:
+        slot = slots[0]
+      else:
+        self._insert_pins(i, [self.pin_keys.intern(pin_key)])
+        slot = end
+    self.pin_net_ids[slot] = self.nets.intern(net)
+
+  def _insert_pins(self, i, key_ids):
+    """Add unconnected pins at the end of pins of row i."""
+    end, count = self.pin_offsets[i + 1], len(key_ids)
+    self.pin_key_ids[end:end] = array('i', key_ids)
+    self.pin_net_ids[end:end] = array('i', [-1] * count)
+    offsets = self.pin_offsets
+    for j in range(i + 1, len(offsets)):
+      offsets[j] += count
+
+  def nbytes(self):
+    """Approximate memory used by the per-component arrays, in bytes."""
+    columns = (self.name_ids, self.type_ids, self.designator_ids, self.global_ids, self.value_ids,
+               self.property_ids, self.notes_ids, self.pin_kinds,
+               self.pin_offsets, self.pin_key_ids, self.pin_net_ids)
+    return sum(column.itemsize * len(column) for column in columns)
+
+
+import unittest
+
+
+class Test_ColumnarComponentStore(unittest.TestCase):
+  def setUp(self):
+    import edag
+    self.edag = edag
+    self.Net, self.Component = edag.Net, edag.Component
+
+  def test_roundtrip(self):
+    Net, Component = self.Net, self.Component
+    components = [
+      Component("load", "R", "R1", 1, [Net("a"), Net("GND")], [], 1000.0, ["psu"]),
+      Component("u", "lm7805", "U1", 2, {"in": Net("a"), "gnd": Net("GND"), "out": None},
+                {"pin_map": {"in": 1, "gnd": 2, "out": 3}}, {"voltage": 5.0}, []),
+      Component("load", "R", "R2", 5, [Net("b"), Net("GND")], [], 1000.0, ["psu"]),
+      Component("one", "R", "R3", 6, [Net("b"), Net("GND")], [], 1, ["psu"]),
+    ]
+    store = ColumnarComponentStore(Component)
+    for c in components:
+      store.append(c)
+    self.assertEqual(list(store), components)
+    self.assertEqual(store[-1], components[-1])
+    self.assertEqual(type(store[3].own_properties), int)
+    self.assertEqual(store.by_global_id[5], components[2])
+    self.assertNotIn(3, store.by_global_id)
+    self.assertEqual(store.nets_by_global_id[2], [Net("a"), Net("GND")])
+    self.assertEqual(len(store.values), 3)
+    keys = [_value_key(v) for v in (1000, 1000.0, (1000, 0.25), (1000.0, 0.25), 0.0, -0.0, [1], [1.0], {"a": 1})]
+    self.assertEqual(len(set(keys)), len(keys))
+    self.assertEqual(_value_key({"a": [1.5]}), _value_key({"a": [1.5]}))
+    self.assertEqual(len(store.notes), 2)
+    store.set_pin_net(2, "out", Net("c"))
+    self.assertEqual(store.by_global_id[2].pin_nets["out"], Net("c"))
+    # New pins, in the middle of the store.
+    store.set_pin_net(2, "adj", Net("d"))
+    store.set_pin_net(1, 3, Net("e"))
+    self.assertEqual(store.by_global_id[2].pin_nets, {"in": Net("a"), "gnd": Net("GND"), "out": Net("c"), "adj": Net("d")})
+    self.assertEqual(store.by_global_id[1].pin_nets, [Net("a"), Net("GND"), None, Net("e")])
+    self.assertEqual(list(store)[2:], components[2:])
+    with self.assertRaises(IndexError):
+      store[4]
+
+  def test_schematic(self):
+    edag = self.edag
+    Net = self.Net
+    with edag.NewGlobalScope(columnar=True) as s:
+      # Not isinstance, as this module might be running as __main__.
+      self.assertEqual(type(s.registered_components).__name__, "ColumnarComponentStore")
+      r = edag.make_component("r", "R", [Net("a"), None], [], 10.0)
+      edag.make_component("c", "C", [Net("a"), Net("GND")], [], 1.0e-6)
+      self.assertEqual(edag.net_degree(Net("a")), 2)
+      edag.connect((r, 1), Net("GND"))
+      self.assertEqual(edag.component_nets(r), [Net("a"), Net("GND")])
+      self.assertEqual(s.registered_components[0].pin_nets, [Net("a"), Net("GND")])
+      # Pins are stored as integers, and viewed as Pin.
+      pins = s.net_pins[Net("GND")]
+      self.assertEqual(type(pins).__name__, "ColumnarPins")
+      self.assertEqual(pins.pin_ids.tolist(), [1, 1])
+      self.assertEqual(edag.pins_on_net(Net("GND")), [edag.Pin("C1", 2, 1), edag.Pin("R1", 1, 1)])
+      # A new pin of a list pins component.
+      edag.connect((r, 3), Net("b"))
+      self.assertEqual(s.registered_components[0].pin_nets, [Net("a"), Net("GND"), None, Net("b")])
+      self.assertEqual(s.registered_components[1].pin_nets, [Net("a"), Net("GND")])
+      self.assertEqual(edag.pins_on_net(Net("b")), [edag.Pin("R1", 1, 3)])
+      self.assertEqual(edag.component_nets(r), [Net("a"), Net("GND"), Net("b")])
+
+  def test_hierarchical(self):
+    import io
+    edag = self.edag
+
+    @edag.Scope()
+    def channel(vin):
+      edag.make_component("top", "R", [vin, edag.scoped_net("mid")], [], 1000.0, prefix="R")
+
+    netlists = []
+    for columnar in (True, False):
+      with edag.NewGlobalScope(columnar=columnar, hierarchical=columnar) as s:
+        for _ in range(3):
+          edag.cached_sub(channel, self.Net("VIN"))
+        # Appended before pending instances are expanded.
+        edag.make_component("load", "R", [self.Net("VIN"), edag.GND()], [], 10.0, prefix="R")
+        out = io.StringIO()
+        edag.export_(s, out)
+        netlists.append(out.getvalue())
+        self.assertEqual([c.id for c in s.registered_components], ["R1", "R2", "R3", "R4"])
+    self.assertEqual(netlists[0], netlists[1])
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
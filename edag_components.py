@@ -21,6 +21,8 @@
 # so 53k. 102 means 10 and 2 zeros, so 1000 or 1k.
 
 
+import edag
+import edag_eseries
 from edag import make_component, tofloat, net, scoped_net
 from edag_utils import tofloat_V, tofloat_Charge, tofloat_C, tofloat_R, tofloat_L, tofloat_I, tofloat_P, ohm_law, sign_V, abs_V
 
@@ -90,8 +92,16 @@ def tie(name : str,
         *, physical=False):
   """Basically a zero ohm perfect resistor. It is used to connect different nets.
   Often will have no representation on PCB at all. But could be also realized
-  as a 0 ohm resistor or jumper, or a link."""
-  return make_component(name, "R", [a, b], [], 0.0)
+  as a 0 ohm resistor or jumper, or a link.
+
+  PCB netlists keep the tie as a component between two nets. Exporters can
+  collapse it instead, merging both nets (i.e. for SPICE simulation).
+
+  To merge nets unconditionally, use edag.merge().
+  """
+  c = make_component(name, "R", [a, b], [], 0.0)
+  edag._current_schematic.register_tie(c)
+  return c
 
 
 def diode(name : str, *,
@@ -262,16 +272,14 @@ def voltage_divider(name : str, *,
                     r_high:'Ohm', r_low:'Ohm',
                     high:'NET', low:'NET', output:'NET'=None,
                     accuracy:'%'=1):
-  """Accuracy is used to select standard series resistors for the divider.
+  """Voltage divider with given resistors.
 
-  If better accuracy is needed, a combinations of resistors will be used.
-
-  TODO(baryluk): Quantize to R24, R48, R92 series.
+  See voltage_divider_auto, to select standard series resistors automatically.
   """
   # TODO: Scope(name)
   assert accuracy > 0.0
 
-  output = output if output else net()
+  output = output if output is not None else net()
   res("r_high", r_high, a=high, b=output)
   res("r_low", r_low, a=output, b=low)
   return output
@@ -283,6 +291,12 @@ def voltage_divider_auto(name : str, *,
                          output_voltage:'V'=3.3,
                          high:'NET', low:'NET', output:'NET'=None,
                          accuracy:'%'=1, load_current:'A'="1uA"):
+  """Voltage divider with standard series resistors, for the given voltages.
+
+  Resistors are selected from the E-series matching the accuracy (in %),
+  i.e. E96 for 1%, so the divider ratio is within accuracy, and the idle
+  current is within 25% of the requested one.
+  """
   assert accuracy > 0.0
 
   assert sign_V(input_voltage) == sign_V(output_voltage), f"Sign of input and output voltage must match, got: {input_voltage} and {output_voltage}"
@@ -298,12 +312,37 @@ def voltage_divider_auto(name : str, *,
   # print(f"voltage divider: {input_voltage} -> {output_voltage}: {total_resistance}Ohm total, with {r_high} + {r_low}")
   assert r_high >= 0.0
   assert r_high <= total_resistance
-  # TODO: Quantize to accuracy using R6, R12, R24, R48, series,
-  # or not quantizing for very high accuracies.
-  return voltage_divider(name,
-                         r_high=r_high, r_low=r_low,
-                         high=high, low=low, output=output,
-                         accuracy=accuracy)
+  series = edag_eseries.series_for_accuracy(accuracy)
+  ratio = r_low / total_resistance
+  if not 0.0 < ratio < 1.0:
+    # Output voltage equal to the input voltage (or zero). The output is the
+    # high (or low) net, and a single resistor sets the idle current.
+    tied = high if ratio >= 1.0 else low
+    output = edag.merge(output, tied) if output is not None else tied
+    res("r_low" if ratio >= 1.0 else "r_high", edag_eseries.nearest(total_resistance, series), a=high, b=low)
+    return output
+  # Quantize to the E-series of the accuracy, i.e. E96 for 1%. If needed
+  # one of the resistors is replaced by two in series or in parallel.
+  tolerance = accuracy / 100.0
+  d = edag_eseries.divider(ratio, total_resistance, tolerance=tolerance, series=series)
+  assert d and d.error <= tolerance, \
+         f"No standard resistors for {input_voltage} -> {output_voltage} divider within {accuracy}%"
+  output = output if output is not None else net()
+  _divider_leg("r_high", d.high, high, output)
+  _divider_leg("r_low", d.low, output, low)
+  return output
+
+
+def _divider_leg(name:str, resistance:'edag_eseries.Resistance', a:'NET', b:'NET'):
+  if len(resistance.parts) == 1:
+    res(name, resistance.value, a=a, b=b)
+  elif resistance.parallel:
+    res(f"{name}_1", resistance.parts[0], a=a, b=b)
+    res(f"{name}_2", resistance.parts[1], a=a, b=b)
+  else:
+    middle = net()
+    res(f"{name}_1", resistance.parts[0], a=a, b=middle)
+    res(f"{name}_2", resistance.parts[1], a=middle, b=b)
 
 
 def voltage_divider_test():
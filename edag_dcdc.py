@@ -2,11 +2,58 @@
 
 """A module with various DC/DC converter ICs and ready to use PSU sub-schematics."""
 
-from edag import make_component, tofloat, net, scoped_net
+from edag import make_component, tofloat, net, scoped_net, PinMap
 from edag_components import res, cap, ucap, inductor, diode, schottky, voltage_divider_auto
 from edag_utils import tofloat_V, tofloat_C, tofloat_R, tofloat_L, tofloat_I, tofloat_Hz
 
 
+def _operand(x):
+  """Lists and tuples are converted to NumPy arrays. Floats and arrays are used as is."""
+  if isinstance(x, (list, tuple)):
+    import numpy
+    return numpy.asarray(x, dtype=float)
+  return x
+
+
+def _all_ok(design:dict):
+  ok = True
+  for key, mask in design.items():
+    if key.startswith("ok_"):
+      ok = ok & mask
+  return ok
+
+
+def mp2359_design(V_in_min, V_in_max, V_out):
+  """Design equations and constraints of MP2359, for many operating points at once.
+
+  Arguments are floats, or NumPy arrays (or lists) of the same or broadcastable
+  shapes. Returns a dict of derived values, and boolean feasibility masks of
+  each constraint ("ok_" keys), and of all of them ("ok"). "needs_" masks
+  tell which optional components are required.
+  """
+  V_in_min, V_in_max, V_out = _operand(V_in_min), _operand(V_in_max), _operand(V_out)
+  design = {}
+  design["duty_cycle"] = V_out / V_in_min
+  design["ok_output_voltage"] = V_out >= 0.5  # TODO: To check.
+  design["ok_headroom"] = V_out + 1.0 <= V_in_min  # TODO: To check.
+  design["ok_input_voltage"] = (V_in_min <= V_in_max) & (V_in_max <= 25.0)
+  design["needs_d3"] = V_in_min <= 5.0
+  design["needs_bootstrap_diode"] = (V_out <= 5.0) & (design["duty_cycle"] > 0.65)
+  design["ok"] = _all_ok(design)
+  return design
+
+
+# Same for SOT23-6 and TSOT23-6.
+_MP2359_PIN_MAP = PinMap({
+  "in": 5,
+  "gnd": 2,
+  "en": 4,
+  "bst": 1,
+  "sw": 6,
+  "fb": 3,
+}, "SOT23-6")
+
+
 def dcdc_mp2359_full(name:str, *, v_in:'NET', gnd:'NET', v_out:'NET', en:'NET'=None,
                      output_voltage:'V'=3.3,
                      max_output_current:'A'=1.2,
@@ -49,22 +96,14 @@ def dcdc_mp2359_full(name:str, *, v_in:'NET', gnd:'NET', v_out:'NET', en:'NET'=N
 
   if en:
     en_pullup = "100kΩ"
-  en = en if en else v_in
+  en = en if en is not None else v_in
 
 
   # TODO(baryluk): Factor this (pin_map and make_component) into function.
-  pin_map = {
-    "in": 5,
-    "gnd": 2,
-    "en": 4,
-    "bst": 1,
-    "sw": 6,
-    "fb": 3,
-  }
   u = make_component("dcdc_mp2359", "MP3259", {
                        "in":v_in, "gnd":gnd, "en":en, "bst":scoped_net(),
                        "sw":scoped_net(), "fb":scoped_net(),
-                     }, {"pin_map": pin_map}, [], prefix="U")
+                     }, {"pin_map": _MP2359_PIN_MAP}, [], prefix="U")
 
   if en_pullup:
     res("en_pullup", en_pullup, v_in, u.pin_nets["en"])
@@ -76,15 +115,15 @@ def dcdc_mp2359_full(name:str, *, v_in:'NET', gnd:'NET', v_out:'NET', en:'NET'=N
   max_input_voltage = tofloat_V(max_input_voltage)
   max_current = tofloat_I(max_output_current)
 
-  assert output_voltage >= 0.5  # TODO: To check.
+  design = mp2359_design(min_input_voltage, max_input_voltage, output_voltage)
 
-  assert output_voltage + 1.0 <= min_input_voltage  # TODO: To check.
+  assert design["ok_output_voltage"]
 
-  assert min_input_voltage <= max_input_voltage
+  assert design["ok_headroom"]
 
-  assert max_input_voltage <= 25.0
+  assert design["ok_input_voltage"]
 
-  if min_input_voltage <= 5.0:
+  if design["needs_d3"]:
     assert opt_d3, "For input voltage less than 5V, an external diode is required."
 
   if opt_d3:
@@ -98,8 +137,7 @@ def dcdc_mp2359_full(name:str, *, v_in:'NET', gnd:'NET', v_out:'NET', en:'NET'=N
   # TODO: Calculate the inductance required
 
 
-  duty_cycle = tofloat_V(output_voltage) / min_input_voltage
-  if tofloat_V(output_voltage) <= 5.0 and duty_cycle > 0.65:
+  if design["needs_bootstrap_diode"]:
     assert external_bootstrap_diode, ("For output voltage less than 5V and duty cycle above 65%, "
                                       "an external bootstrap diode is required.")
 
@@ -137,6 +175,74 @@ def _mp2359_test():
 #_mp2359_test()
 
 
+def tps543x_design(V_in_min, V_in_max, V_out, *, I_out=3.0, L=15.0e-6, V_diode=0.5, V_ripple=0.030):
+  """Design equations and constraints of TPS5430 / TPS5431, for many operating points at once.
+
+  Arguments are floats, or NumPy arrays (or lists) of the same or broadcastable
+  shapes, in V, A and H. Returns a dict of derived values (L_inductor_min,
+  V_out_min, V_out_max), and boolean feasibility masks of each constraint
+  ("ok_" keys), and of all of them ("ok").
+
+  Example, a feasibility map over a million operating points:
+
+    V_in, V_out = numpy.meshgrid(numpy.linspace(5.5, 36, 1000), numpy.linspace(1, 30, 1000))
+    ok = tps543x_design(V_in, V_in, V_out)["ok"]
+  """
+  V_in_min, V_in_max, V_out = _operand(V_in_min), _operand(V_in_max), _operand(V_out)
+  I_out, L, V_diode, V_ripple = _operand(I_out), _operand(L), _operand(V_diode), _operand(V_ripple)
+
+  # Output inductor series resistance. Typical.
+  R_inductor = 0.037
+  # Minimum and maximum output load current.
+  I_out_min = 0.001
+  I_out_max = 3.000
+  K_inductor = 0.25  # Should be between 0.2 and 0.3 usually.
+  F_sw = 500.0e3
+
+  design = {}
+  design["ok_input_voltage"] = (V_in_min >= 5.5) & (V_in_max <= 36.0)
+  design["ok_output_voltage"] = (V_out >= 1.23) & (V_out <= 31.0) & (V_out <= V_in_min - 0.5)  # Rough approximation.
+  design["ok_inductance_range"] = (10.0e-6 <= L) & (L <= 100.0e-6)
+
+  # Section 8.2.1.2.4.1, equation 4.
+  design["L_inductor_min"] = (V_out + V_ripple) * (V_in_max - V_out) / (V_in_max * K_inductor * I_out * F_sw)
+  design["ok_inductance"] = L >= design["L_inductor_min"]
+
+  design["ok_diode"] = V_diode >= 0.2
+  V_diode_min = V_diode * 0.99
+  V_diode_max = V_diode * 1.01
+
+  # Section 8.2.1.2.8.1, equation 13.
+  # Minimum maximum duty cycle of 87%. Typical maximum duty cycle is 89%.
+  # This assumes a worst case scenario of high resistence of the internal high side FET.
+  # In practice the voltage can be slightly higher depending on a specific die quality.
+  # Typical R_DS(on) is 0.110 Ω, maximum R_DS(on) is 0.230Ω.
+  # With V_in = 5.5 V, the typical R_DS(on) is 150 mΩ.
+  design["V_out_max"] = 0.87 * ((V_in_min - I_out_max * 0.230) + V_diode_max) - I_out_max * R_inductor - V_diode_min
+  # Equation 14.
+  # Constrained by minimum current, input voltage, and minimum switch on time
+  # (which can be as high as 200ns). Typical minimum controllable on time is 150ns.
+  design["V_out_min"] = 0.12 * ((V_in_max - I_out_min * 0.110) + V_diode_min) - I_out_min * R_inductor - V_diode_max
+  design["ok_duty_max"] = V_out < design["V_out_max"]
+  design["ok_duty_min"] = design["V_out_min"] < V_out
+  design["ok"] = _all_ok(design)
+  return design
+
+
+_TPS543X_PIN_MAP = PinMap({
+  "vin": 7,
+  "ena": 5,
+  "nc": [2,3],
+  "gnd": 6,
+  "PowerPAD": 9,  # Power Pad. Must be connected to GND pin (6) for proper operation.
+                  # 6 thermal vias for it should be enough. Device PowerPad must be
+                  # soldered down to PCB for correct performance. Not just thermally bounded!
+  "boot": 1,
+  "ph": 8,
+  "vsense": 4,  # Feedback
+}, "HSOP-8")
+
+
 def dcdc_tps543x_full(name:str, *,
                       v_in:'NET', gnd:'NET', v_out:'NET', en:'NET'=None,
                       output_voltage:'V'=5.0,
@@ -196,8 +302,7 @@ def dcdc_tps543x_full(name:str, *,
   # Example: Sumida CDRH10RNP-150N, 15uH ± 30% (at 100kHz/1V),
   # 50mOhm max DCR (37mOhm typ), saturation 3.60A, Temperature rise current 3.10A.
 
-  # Minimum and maximum output load current.
-  I_out_min = 0.001
+  # Maximum output load current.
   I_out_max = 3.000
 
   assert R_inductor * I_out_max <= 1, \
@@ -206,50 +311,27 @@ def dcdc_tps543x_full(name:str, *,
   V_in_min = tofloat_V(min_input_voltage)
   V_in_max = tofloat_V(max_input_voltage)
 
-  assert V_in_min >= 5.5
-  assert V_in_max <= 36.0
+  design = tps543x_design(V_in_min, V_in_max, tofloat_V(output_voltage),
+                          I_out=tofloat_I(max_current), L=tofloat_L(inductance),
+                          V_diode=tofloat_V(V_diode), V_ripple=tofloat_V(output_ripple))
 
-  assert tofloat_V(output_voltage) >= 1.23
-  assert tofloat_V(output_voltage) <= 31.0
-  assert tofloat_V(output_voltage) <= V_in_min - 0.5  # Rough approximation.
+  assert design["ok_input_voltage"]
 
-  K_inductor = 0.25  # Should be between 0.2 and 0.3 usually.
-
-  assert tofloat_L('10µH') <= tofloat_L(inductance), \
-         "Output inductor inductance should be bigger then 10µH."
-  assert tofloat_L(inductance) <= tofloat_L('100µH'), \
-         "Output inductor inductance should be smaller than 100µH."
+  assert design["ok_output_voltage"]
 
-  F_sw = tofloat_Hz("500kHz")
+  assert design["ok_inductance_range"], \
+         "Output inductor inductance should be between 10µH and 100µH."
 
-  V_out = tofloat_V(output_voltage)
-  V_out_max = tofloat_V(output_voltage) + tofloat_V(output_ripple)
-  I_out = tofloat_I(max_current)
-
-  # Section 8.2.1.2.4.1, equation 4.
-  L_inductor_min = V_out_max * (V_in_max - V_out) / (V_in_max * K_inductor * I_out * F_sw)
-  assert tofloat_L(inductance) >= L_inductor_min, f"Requsted inductance {inductance} should be >= {L_inductor_min}"
+  L_inductor_min = design["L_inductor_min"]
+  assert design["ok_inductance"], f"Requsted inductance {inductance} should be >= {L_inductor_min}"
 
-  assert tofloat_V(V_diode) >= 0.2, \
+  assert design["ok_diode"], \
          "Catch diode voltage drop unrealistically low or negative."
-  V_diode_min = tofloat_V(V_diode) * 0.99
-  V_diode_max = tofloat_V(V_diode) * 1.01
 
-  # Section 8.2.1.2.8.1, equation 13.
-  # Minimum maximum duty cycle of 87%. Typical maximum duty cycle is 89%.
-  # This assumes a worst case scenario of high resistence of the internal high side FET.
-  # In practice the voltage can be slightly higher depending on a specific die quality.
-  # Typical R_DS(on) is 0.110 Ω, maximum R_DS(on) is 0.230Ω.
-  # With V_in = 5.5 V, the typical R_DS(on) is 150 mΩ.
-  V_out_max = 0.87 * ((V_in_min - I_out_max * 0.230) + V_diode_max) - I_out_max * R_inductor - V_diode_min
-  # Equation 14.
-  # Constrained by minimum current, input voltage, and minimum switch on time
-  # (which can be as high as 200ns). Typical minimum controllable on time is 150ns.
-  V_out_min = 0.12 * ((V_in_max - I_out_min * 0.110) + V_diode_min) - I_out_min * R_inductor - V_diode_max
-
-  assert tofloat_V(output_voltage) < V_out_max, \
+  V_out_min, V_out_max = design["V_out_min"], design["V_out_max"]
+  assert design["ok_duty_max"], \
          f"Condition fail: {output_voltage} < {V_out_max} failed"
-  assert V_out_min < tofloat_V(output_voltage), \
+  assert design["ok_duty_min"], \
          f"Condition fail: {V_out_min} < {output_voltage} failed"
   if __debug__:
     print(f"Desired output voltage: {output_voltage} within design limits: {V_out_min} - {V_out_max}")
@@ -261,7 +343,7 @@ def dcdc_tps543x_full(name:str, *,
 
   if en:
     en_pullup = "100kΩ"
-  en = en if en else v_in
+  en = en if en is not None else v_in
   # Note, TPS543x ENA pin has an internal pull-up current source, so the ENA pin can be floated.
   # Otherwise, use open drain or open collector output logic to interface witht the pin.
   # Bringing ENA to ground or below 0.5V, will disable the regulator and activate the shutdown mode.
@@ -271,24 +353,12 @@ def dcdc_tps543x_full(name:str, *,
   # start-up inrush current.
 
   # TODO(baryluk): Factor this (pin_map and make_component) into function.
-  pin_map = {
-    "vin": 7,
-    "ena": 5,
-    "nc": [2,3],
-    "gnd": 6,
-    "PowerPAD": 9,  # Power Pad. Must be connected to GND pin (6) for proper operation.
-                    # 6 thermal vias for it should be enough. Device PowerPad must be
-                    # soldered down to PCB for correct performance. Not just thermally bounded!
-    "boot": 1,
-    "ph": 8,
-    "vsense": 4,  # Feedback
-  }
   u = make_component("dcdc_tps5430", "TPS5430", {
                        "vin":v_in, "gnd":gnd,
                        "ena":en, "boot":scoped_net(),
                        "ph":scoped_net(), "vsense":scoped_net(),
                        "PowerPAD": gnd, "nc":net(),
-                     }, {"pin_map": pin_map}, [], prefix="U")  # U1
+                     }, {"pin_map": _TPS543X_PIN_MAP}, [], prefix="U")  # U1
 
   ucap("bootstrap_cap", "0.01uF", a=u.pin_nets["boot"], b=u.pin_nets["ph"])  # C3  # TODO(baryluk): Voltage
   if all_ceramic_output_filter_caps:
@@ -350,13 +420,6 @@ def dcdc_tps543x_full(name:str, *,
   return {"out":v_out, "en":en}
 
 
-def _tps543x_test():
-  dcdc_tps543x_full("5.0V regulator", v_in=net(), gnd=net(), v_out=net())
-
-
-_tps543x_test()
-
-
 def dcdc_tps65131_full(name:str, *,
                        v_in:'NET', gnd:'NET', v_out:'NET', en:'NET'=None,
                        output_voltage_positive:'V'=12.0,
@@ -391,3 +454,43 @@ def dcdc_tps65131_full(name:str, *,
   # Example: V_POS = 10.5V => R2 = 130kΩ, R1 = 1.0MΩ
   #          V_NEG = -10V => R4 = 121.2kΩ, R3 = 1.0MΩ
   pass
+
+
+import unittest
+
+
+class Test_design(unittest.TestCase):
+  def test_scalar(self):
+    design = tps543x_design(12.0, 36.0, 5.0)
+    self.assertTrue(design["ok"])
+    self.assertAlmostEqual(design["L_inductor_min"], 1.1550e-05, places=9)
+    self.assertFalse(tps543x_design(12.0, 36.0, 5.0, I_out=1.0)["ok_inductance"])
+    self.assertFalse(mp2359_design(4.0, 12.0, 3.3)["ok"])
+    self.assertTrue(mp2359_design(12.0, 24.0, 3.3)["ok"])
+
+  def test_vectorized(self):
+    try:
+      import numpy
+    except ImportError:
+      self.skipTest("requires numpy")
+    V_in = numpy.linspace(5.0, 40.0, 50)
+    V_out = numpy.linspace(1.0, 32.0, 40)[:, None]
+    design = tps543x_design(V_in, V_in, V_out, L=[[10.0e-6], [20.0e-6]] * 20)
+    self.assertEqual(design["ok"].shape, (40, 50))
+    for i, j in [(0, 0), (3, 10), (5, 30), (20, 49), (39, 1)]:
+      scalar = tps543x_design(float(V_in[j]), float(V_in[j]), float(V_out[i, 0]), L=[10.0e-6, 20.0e-6][i % 2])
+      for key, value in scalar.items():
+        self.assertAlmostEqual(float(numpy.broadcast_to(design[key], (40, 50))[i, j]), float(value), msg=key)
+    self.assertEqual(mp2359_design([12.0, 4.0], 24.0, 3.3)["ok"].tolist(), [True, False])
+
+
+class Test_capture(unittest.TestCase):
+  def test_tps543x(self):
+    import edag
+    with edag.NewGlobalScope() as s:
+      dcdc_tps543x_full("5.0V regulator", v_in=net(), gnd=net(), v_out=net())
+      self.assertIn("TPS5430", [c.type for c in s.registered_components])
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+"""Per scope content hashes, and minimal change lists (ECO) between runs.
+
+The scope table of a schematic has a row per scope of the scopes tree, in
+pre-order:
+
+  [path, parent row index (-1 for root), hash, own hash, records]
+
+records describe components created directly in the scope, as
+[designator, type, name, value, pins], where value is repr of own
+properties, and pins are [pin, net name] pairs (merged nets are resolved).
+Global anonymous nets (net()) are numbered by a process wide counter, so
+they are named by their first pin instead, as "~<designator>.<pin>" of the
+smallest (designator, pin) on the net. Then adding a net() elsewhere doesn't
+change the records.
+own hash covers the records, and hash (a Merkle hash) covers the own hash
+and hashes of all sub scopes.
+
+The table is saved in the stable ids database (see
+edag.Schematic.save_stable_ids). diff() compares two tables, but only
+descends into scopes with different hashes, so a small change in a big
+design is found quickly. Designators are stable between runs, so components
+are matched by them.
+
+Example:
+
+  process(myboard, diff=True)  # Prints changes since the previous run.
+
+  # Or from saved databases:
+  print(format_changes(diff_stable_ids("old.edag_ids.json", "myboard.edag_ids.json")), end="")
+"""
+
+from collections import namedtuple, defaultdict
+import hashlib
+import json
+
+
+# kind: "added", "removed", "value" (value or type changed), or "pin" (pin
+# connected to a different net). scope is the path of the scope of the
+# component. pin is None, except for "pin". old and new are values, or net
+# names for "pin" (None if not connected), None if not applicable.
+Change = namedtuple("Change", ["kind", "designator", "scope", "pin", "old", "new"])
+
+
+def _hash(data:str) -> str:
+  return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _record(component, name_of):
+  if type(component.pin_nets) is list:
+    items = enumerate(component.pin_nets)
+  else:
+    items = component.pin_nets.items()
+  pins = [[pin_key, None if net is None else name_of(net)] for pin_key, net in items]
+  return [component.id, component.type, component.name, repr(component.own_properties), pins]
+
+
+def scope_table(schematic) -> list:
+  """Scope table of a schematic. See module documentation."""
+  import edag
+  schematic.flatten()
+  root = schematic.scopes_tree[0]
+  component_scopes = schematic.component_scopes
+  resolve = schematic.net_union.resolve
+  net_parts = edag._net_parts
+  names = {}
+
+  def name_of(net):
+    name = names.get(net)
+    if name is None:
+      net = resolve(net)
+      prefix_id, local = net_parts[net]
+      if prefix_id < 0 and type(local) is int:
+        pin = min(schematic.pins_on_net(net), key=lambda pin: (pin.id, str(pin.pin)))
+        name = f"~{pin.id}.{pin.pin}"
+      else:
+        name = net.name
+      names[net] = name
+    return name
+
+  by_scope = defaultdict(list)
+  for component in schematic.registered_components:
+    by_scope[id(component_scopes.get(component.global_id, root))].append(_record(component, name_of))
+
+  rows = []
+
+  def visit(scope, parent:int):
+    records = by_scope.get(id(scope), [])
+    own = _hash(json.dumps(records, separators=(",", ":")))
+    row = [scope.path_string, parent, None, own, records]
+    i = len(rows)
+    rows.append(row)
+    children = [f"{sub_scope.name}:{visit(sub_scope, i)}" for sub_scope in scope.sub_scopes]
+    row[2] = _hash(own + "/" + ",".join(children))
+    return row[2]
+
+  visit(root, -1)
+  return rows
+
+
+def diff(old:list, new:list) -> list:
+  """List of Change between two scope tables. Removed components are last.
+
+  Scopes with equal hashes are skipped, with all their sub scopes.
+  """
+  old_children, new_children = defaultdict(list), defaultdict(list)
+  for rows, children in ((old, old_children), (new, new_children)):
+    for row in rows:
+      if row[1] >= 0:
+        children[rows[row[1]][0]].append(row)
+
+  old_records, new_records = {}, {}
+
+  def collect(row, records):
+    for record in row[4]:
+      records[record[0]] = (row[0], record)
+
+  def walk(old_row, new_row):
+    if old_row is not None and new_row is not None:
+      if old_row[2] == new_row[2]:
+        return
+      if old_row[3] != new_row[3]:
+        collect(old_row, old_records)
+        collect(new_row, new_records)
+    elif old_row is not None:
+      collect(old_row, old_records)
+    else:
+      collect(new_row, new_records)
+    olds = {row[0]: row for row in old_children.get(old_row[0], ())} if old_row is not None else {}
+    news = {row[0]: row for row in new_children.get(new_row[0], ())} if new_row is not None else {}
+    for path, row in news.items():
+      walk(olds.pop(path, None), row)
+    for row in olds.values():
+      walk(row, None)
+
+  if old or new:
+    walk(old[0] if old else None, new[0] if new else None)
+
+  changes = []
+  for designator, (scope, record) in new_records.items():
+    previous = old_records.pop(designator, None)
+    if previous is None:
+      changes.append(Change("added", designator, scope, None, None, record[3]))
+      continue
+    old_record = previous[1]
+    if old_record[1:4] != record[1:4]:
+      changes.append(Change("value", designator, scope, None, old_record[3], record[3]))
+    old_pins, new_pins = dict(map(tuple, old_record[4])), dict(map(tuple, record[4]))
+    for pin, net in new_pins.items():
+      if old_pins.get(pin) != net:
+        changes.append(Change("pin", designator, scope, pin, old_pins.get(pin), net))
+    for pin, net in old_pins.items():
+      if pin not in new_pins and net is not None:
+        changes.append(Change("pin", designator, scope, pin, net, None))
+  for designator, (scope, record) in old_records.items():
+    changes.append(Change("removed", designator, scope, None, record[3], None))
+  return changes
+
+
+def format_changes(changes) -> str:
+  """Human readable change list, one change per line."""
+  lines = []
+  for c in changes:
+    if c.kind == "added":
+      lines.append(f"+ {c.designator} {c.new} ({c.scope})\n")
+    elif c.kind == "removed":
+      lines.append(f"- {c.designator} {c.old} ({c.scope})\n")
+    elif c.kind == "value":
+      lines.append(f"~ {c.designator} {c.old} -> {c.new}\n")
+    else:
+      lines.append(f"~ {c.designator} pin {c.pin}: {c.old} -> {c.new}\n")
+  return "".join(lines)
+
+
+def diff_stable_ids(old_filename:str, new_filename:str) -> list:
+  """List of Change between two stable ids databases."""
+  tables = []
+  for filename in (old_filename, new_filename):
+    with open(filename, "r", encoding="utf-8") as f:
+      tables.append(json.load(f).get("scopes", []))
+  return diff(*tables)
+
+
+import unittest
+
+
+class Test_eco(unittest.TestCase):
+  def capture(self, values, *, extra=False, rewire=False):
+    import edag
+
+    @edag.Scope()
+    def channel(vin, value):
+      mid = edag.scoped_net("mid")
+      edag.make_component("top", "R", [vin, mid], [], value, prefix="R")
+      edag.make_component("bottom", "C", [mid, edag.GND() if not rewire else edag.net("AGND")], [], 1.0e-9,
+                          prefix="C")
+
+    with edag.NewGlobalScope() as s:
+      vin = edag.net("VIN")
+      for value in values:
+        channel(vin, value)
+      if extra:
+        edag.make_component("bleeder", "R", [vin, edag.GND()], [], 1.0e6, prefix="R")
+      return scope_table(s)
+
+  def test_hashes(self):
+    values = [1000.0] * 20
+    table = self.capture(values)
+    self.assertEqual(len(table), 21)
+    self.assertEqual(table[1][0], "root/scope_0")
+    self.assertEqual(table[1][4][0], ["R1", "R", "top", "1000.0", [[0, "VIN"], [1, "root/scope_0/mid"]]])
+    self.assertEqual(table, self.capture(values))
+    self.assertEqual(diff(table, table), [])
+    changed = self.capture(values[:5] + [2200.0] + values[6:])
+    self.assertEqual([row[2] == other[2] for row, other in zip(table, changed)].count(False), 2)
+
+  def test_diff(self):
+    values = [1000.0] * 20
+    table = self.capture(values)
+    changes = diff(table, self.capture(values[:5] + [2200.0] + values[6:], extra=True))
+    self.assertEqual(changes, [Change("added", "R21", "root", None, None, "1000000.0"),
+                               Change("value", "R6", "root/scope_5", None, "1000.0", "2200.0")])
+    self.assertEqual(format_changes(changes), "+ R21 1000000.0 (root)\n~ R6 1000.0 -> 2200.0\n")
+    changes = diff(table, self.capture(values[:19], rewire=True))
+    self.assertEqual(len(changes), 19 + 2)
+    self.assertEqual(changes[0], Change("pin", "C1", "root/scope_0", 1, "GND", "AGND"))
+    self.assertEqual(changes[-1], Change("removed", "C20", "root/scope_19", None, "1e-09", None))
+    self.assertEqual(len(diff([], table)), 40)
+
+  def test_anonymous_nets(self):
+    import edag
+
+    @edag.Scope()
+    def filter_(vin, value):
+      mid = edag.net()
+      edag.make_component("r", "R", [vin, mid], [], value, prefix="R")
+      edag.make_component("c", "C", [mid, edag.GND()], [], 1.0e-9, prefix="C")
+
+    def capture(extra):
+      with edag.NewGlobalScope() as s:
+        # Created first, so it shifts numbers of all later net().
+        anonymous = edag.net() if extra else None
+        for _ in range(5):
+          filter_(edag.net("VIN"), 1000.0)
+        if extra:
+          edag.make_component("bleeder", "R", [anonymous, edag.GND()], [], 1.0e6, prefix="R")
+        return scope_table(s)
+
+    table = capture(False)
+    self.assertEqual(table[1][4][0], ["R1", "R", "r", "1000.0", [[0, "VIN"], [1, "~C1.0"]]])
+    changed = capture(True)
+    self.assertEqual(diff(table, changed), [Change("added", "R6", "root", None, None, "1000000.0")])
+    self.assertEqual([row[2] == other[2] for row, other in zip(table, changed)], [False] + [True] * 5)
+
+  def test_process(self):
+    import contextlib
+    import edag
+    import io
+    import os
+    import tempfile
+
+    def board(value):
+      def capture():
+        vin = edag.net("VIN")
+        edag.make_component("load", "R", [vin, edag.GND()], [], value, prefix="R")
+        edag.make_component("bulk", "C", [vin, edag.GND()], [], 1.0e-6, prefix="C")
+      return capture
+
+    with tempfile.TemporaryDirectory() as tmp:
+      previous, edag.stable_ids_filename = edag.stable_ids_filename, os.path.join(tmp, "ids.json")
+      try:
+        outputs = []
+        for value, diff_mode in ((10.0, False), (22.0, True), (22.0, True)):
+          out = io.StringIO()
+          with edag.NewGlobalScope(), contextlib.redirect_stdout(out):
+            edag.process(board(value), diff=diff_mode)
+          outputs.append(out.getvalue())
+        self.assertIn("(export", outputs[0])
+        # The database is not updated in diff mode.
+        self.assertEqual(outputs[1:], ["~ R1 10.0 -> 22.0\n"] * 2)
+      finally:
+        edag.stable_ids_filename = previous
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
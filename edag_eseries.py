@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""Standard E-series (IEC 60063) values, and resistor divider synthesis.
+
+Values of each series (E6 to E192) are precomputed once, over the 1Ω - 10MΩ
+range, as sorted lists, so the nearest standard value is found by bisection.
+
+divider() finds a pair of standard resistors (or, if needed, pairs of
+resistors in series or in parallel) for a voltage divider with a given ratio
+and total resistance (idle current).
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+import functools
+import math
+
+
+_E24 = (10, 11, 12, 13, 15, 16, 18, 20, 22, 24, 27, 30, 33, 36, 39, 43, 47, 51, 56, 62, 68, 75, 82, 91)
+
+_E192 = (
+  100, 101, 102, 104, 105, 106, 107, 109, 110, 111, 113, 114, 115, 117, 118, 120,
+  121, 123, 124, 126, 127, 129, 130, 132, 133, 135, 137, 138, 140, 142, 143, 145,
+  147, 149, 150, 152, 154, 156, 158, 160, 162, 164, 165, 167, 169, 172, 174, 176,
+  178, 180, 182, 184, 187, 189, 191, 193, 196, 198, 200, 203, 205, 208, 210, 213,
+  215, 218, 221, 223, 226, 229, 232, 234, 237, 240, 243, 246, 249, 252, 255, 258,
+  261, 264, 267, 271, 274, 277, 280, 284, 287, 291, 294, 298, 301, 305, 309, 312,
+  316, 320, 324, 328, 332, 336, 340, 344, 348, 352, 357, 361, 365, 370, 374, 379,
+  383, 388, 392, 397, 402, 407, 412, 417, 422, 427, 432, 437, 442, 448, 453, 459,
+  464, 470, 475, 481, 487, 493, 499, 505, 511, 517, 523, 530, 536, 542, 549, 556,
+  562, 569, 576, 583, 590, 597, 604, 612, 619, 626, 634, 642, 649, 657, 665, 673,
+  681, 690, 698, 706, 715, 723, 732, 741, 750, 759, 768, 777, 787, 796, 806, 816,
+  825, 835, 845, 856, 866, 876, 887, 898, 909, 920, 931, 942, 953, 965, 976, 988,
+)
+
+# Significant digits of each series, for one decade.
+_MANTISSAS = {
+  "E6": _E24[::4],
+  "E12": _E24[::2],
+  "E24": _E24,
+  "E48": _E192[::4],
+  "E96": _E192[::2],
+  "E192": _E192,
+}
+
+# Typical tolerance (in %) of parts in each series, from the most accurate.
+_TOLERANCES = (("E192", 0.5), ("E96", 1), ("E48", 2), ("E24", 5), ("E12", 10), ("E6", 20))
+
+# Range of generated values, as powers of ten.
+_MIN_DECADE = 0  # 1Ω
+_MAX_DECADE = 7  # 10MΩ
+
+
+@functools.lru_cache(maxsize=None)
+def series_values(series:str = "E96"):
+  """Sorted tuple of all values of the series, from 1Ω to 10MΩ."""
+  mantissas = _MANTISSAS[series]
+  scale = mantissas[0]
+  values = [round(m * 10.0 ** decade / scale, 12)
+            for decade in range(_MIN_DECADE, _MAX_DECADE) for m in mantissas]
+  values.append(10.0 ** _MAX_DECADE)
+  return tuple(values)
+
+
+def series_for_accuracy(accuracy:'%'):
+  """The least dense series, with parts of the given accuracy (in %) or better."""
+  for series, tolerance in reversed(_TOLERANCES):
+    if tolerance <= accuracy:
+      return series
+  return "E192"
+
+
+def _neighbours(values, x:float):
+  """Values just below and above x."""
+  i = bisect_left(values, x)
+  return values[max(i - 1, 0):i + 1]
+
+
+def nearest(value:float, series:str = "E96"):
+  """Nearest standard value of the series."""
+  return min(_neighbours(series_values(series), value), key=lambda v: abs(v - value))
+
+
+# value: total resistance, parts: standard values, and parallel: True if
+# parts are in parallel, otherwise in series (or a single part).
+Resistance = namedtuple("Resistance", ["value", "parts", "parallel"])
+
+# high and low are Resistance, ratio is the resulting low / (high + low)
+# ratio, and error is the relative error of the ratio.
+Divider = namedtuple("Divider", ["high", "low", "ratio", "error"])
+
+
+def _composites(x:float, values):
+  """Yields best pairs of standard resistors, in series and in parallel, approximating x."""
+  # Series a + b, with a being the bigger one.
+  for a in values[bisect_left(values, x / 2):bisect_left(values, x)]:
+    for b in _neighbours(values, x - a):
+      yield Resistance(a + b, (a, b), False)
+  # Parallel a || b, with a being the smaller one.
+  for a in values[bisect_right(values, x):bisect_right(values, 2 * x)]:
+    for b in _neighbours(values, a * x / (a - x)):
+      yield Resistance(a * b / (a + b), (a, b), True)
+
+
+@functools.lru_cache(maxsize=4096)
+def divider(ratio:float, total:'Ω', *, tolerance:float = 0.01, series:str = "E96",
+            total_range:float = 1.25, combinations:bool = True):
+  """Find standard resistors for a voltage divider.
+
+  ratio is the output / input voltage ratio (low / (high + low)), total is the
+  desired total resistance (input voltage / idle current). Only dividers with
+  total resistance within a factor of total_range of it are considered.
+
+  Returns the Divider with the smallest ratio error, using single resistors
+  of the series if any pair is within tolerance (relative), or pairs of
+  resistors in series or in parallel if combinations is True. If nothing
+  is within tolerance, the best divider found is returned anyway.
+  """
+  assert 0.0 < ratio < 1.0, f"Divider ratio must be between 0 and 1, got {ratio}"
+  values = series_values(series)
+  total_min, total_max = total / total_range, total * total_range
+
+  def key(d):
+    return (d.error, abs(math.log((d.high.value + d.low.value) / total)))
+
+  def make(high, low):
+    actual = low.value / (high.value + low.value)
+    return Divider(high, low, actual, abs(actual - ratio) / ratio)
+
+  best = None
+  lows = values[bisect_left(values, ratio * total_min):bisect_right(values, ratio * total_max)]
+  for r_low in lows:
+    for r_high in _neighbours(values, r_low * (1.0 - ratio) / ratio):
+      if total_min <= r_low + r_high <= total_max:
+        d = make(Resistance(r_high, (r_high,), False), Resistance(r_low, (r_low,), False))
+        if best is None or key(d) < key(best):
+          best = d
+  if best is not None and best.error <= tolerance or not combinations:
+    return best
+
+  # One side made of two resistors. The other side is kept single.
+  for r_low in lows:
+    low = Resistance(r_low, (r_low,), False)
+    for high in _composites(r_low * (1.0 - ratio) / ratio, values):
+      if total_min <= r_low + high.value <= total_max:
+        d = make(high, low)
+        if best is None or key(d) < key(best):
+          best = d
+  highs = values[bisect_left(values, (1.0 - ratio) * total_min):bisect_right(values, (1.0 - ratio) * total_max)]
+  for r_high in highs:
+    high = Resistance(r_high, (r_high,), False)
+    for low in _composites(r_high * ratio / (1.0 - ratio), values):
+      if total_min <= r_high + low.value <= total_max:
+        d = make(high, low)
+        if best is None or key(d) < key(best):
+          best = d
+  return best
+
+
+def dividers(requests, **kwargs):
+  """Solve many dividers at once. requests are (ratio, total) pairs.
+
+  Returns a list of Divider (see divider for kwargs). Equal requests, common
+  for i.e. feedback dividers of identical regulators, are solved only once.
+  """
+  return [divider(ratio, total, **kwargs) for ratio, total in requests]
+
+
+import unittest
+
+
+class Test_series(unittest.TestCase):
+  def test_tables(self):
+    self.assertEqual({series: len(m) for series, m in _MANTISSAS.items()},
+                     {"E6": 6, "E12": 12, "E24": 24, "E48": 48, "E96": 96, "E192": 192})
+    self.assertEqual(_MANTISSAS["E96"][:6], (100, 102, 105, 107, 110, 113))
+    self.assertEqual(_MANTISSAS["E48"][-3:], (866, 909, 953))
+    values = series_values("E24")
+    self.assertEqual(values[:3], (1.0, 1.1, 1.2))
+    self.assertEqual(list(values), sorted(values))
+    self.assertIn(4700.0, values)
+    self.assertEqual(nearest(9447.5, "E96"), 9530.0)
+    self.assertEqual(nearest(4.8e3, "E12"), 4700.0)
+    self.assertEqual(series_for_accuracy(1), "E96")
+    self.assertEqual(series_for_accuracy(5), "E24")
+    self.assertEqual(series_for_accuracy(0.1), "E192")
+
+  def test_divider(self):
+    d = divider(1.221 / 5.0, 12.5e3)
+    self.assertLessEqual(d.error, 0.01)
+    self.assertEqual(len(d.high.parts) + len(d.low.parts), 2)
+    self.assertTrue(d.high.value in series_values("E96") and d.low.value in series_values("E96"))
+    self.assertTrue(10.0e3 <= d.high.value + d.low.value <= 15.625e3)
+    # Not possible with a pair of E6 values, so a combination is used.
+    d = divider(0.5123, 10.0e3, series="E6", tolerance=0.002)
+    self.assertLessEqual(d.error, 0.002)
+    self.assertEqual(len(d.high.parts) + len(d.low.parts), 3)
+    self.assertEqual(dividers([(0.5123, 10.0e3), (0.5123, 10.0e3)], series="E6", tolerance=0.002), [d, d])
+
+  def test_divider_auto(self):
+    import edag
+    import edag_components
+    for output_voltage, tied in ((5.0, "VIN"), (0.0, "GND")):
+      with edag.NewGlobalScope() as s:
+        output = edag_components.voltage_divider_auto("div", idle_current="1mA", input_voltage=5.0,
+                                                      output_voltage=output_voltage, high=edag.net("VIN"),
+                                                      low=edag.GND(), output=edag.net("OUT"))
+        self.assertEqual([c.own_properties for c in s.registered_components], [4990.0])
+        self.assertEqual(s.find_net(output), s.find_net(edag.net(tied)))
+        self.assertEqual(s.find_net(edag.net("OUT")), s.find_net(edag.net(tied)))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
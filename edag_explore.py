@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""Design space exploration of parametric subschematics.
+
+A builder (i.e. dcdc_tps543x_full) is captured for many parameter sets, each
+in own global scope (see edag.NewGlobalScope), in a pool of worker
+processes. Nothing is emitted into the current schematic. Failed design
+constraints (assertions in the builder) are collected, together with the
+number of components and user defined metrics.
+
+Results can be cached in a JSON file, keyed by a hash of the builder (name,
+and all sources it can depend on, like for the build cache), its arguments,
+nets, metric names and parameters, so repeating a sweep only evaluates new
+points. Arguments and parameters must be JSON serializable.
+
+Example:
+
+  points = grid(output_voltage=[3.3, 5.0, 12.0], max_current=[1.0, 2.0, 3.0])
+  results = explore(dcdc_tps543x_full, points, args=("dcdc",),
+                    nets=("v_in", "gnd", "v_out"), cache="dcdc_sweep.json")
+  feasible = [r.params for r in results if r.ok]
+"""
+
+from collections import namedtuple
+import hashlib
+import itertools
+import json
+import os
+import random
+import traceback
+
+import edag
+
+
+# params: dict of builder keyword arguments.
+# ok: False if the builder failed an assertion, and error is its message.
+# components: number of captured components.
+# metrics: dict of metric name -> value, for successful captures.
+Result = namedtuple("Result", ["params", "ok", "error", "components", "metrics"])
+
+# Bump when the content of results changes, to invalidate old caches.
+_CACHE_VERSION = 3
+
+
+def grid(**axes):
+  """Returns list of all combinations of values (a full grid) of the axes.
+
+  grid(a=[1, 2], b=["x", "y"]) => [{"a": 1, "b": "x"}, {"a": 1, "b": "y"}, ...]
+  """
+  names = list(axes)
+  return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def random_sample(samples:int, /, *, seed:int = 0, **axes):
+  """Returns a list of samples random parameter sets.
+
+  Each axis is a list of values to choose from, or a (low, high) tuple for a
+  uniformly distributed float. Same seed gives the same points.
+  """
+  rng = random.Random(seed)
+  points = []
+  for _ in range(samples):
+    point = {}
+    for name, axis in axes.items():
+      point[name] = rng.uniform(*axis) if isinstance(axis, tuple) else rng.choice(axis)
+    points.append(point)
+  return points
+
+
+def _source_hash(builder) -> str:
+  """Hash of all sources builder can depend on: the edag library, parts, and
+  the design. See edag_build_cache.source_files."""
+  import edag_build_cache
+  h = hashlib.sha256()
+  for root, filename in edag_build_cache.source_files(builder):
+    with open(filename, "rb") as f:
+      data = f.read()
+    h.update(f"\0{os.path.relpath(filename, root)}\0{len(data)}\0".encode("utf-8"))
+    h.update(data)
+  return h.hexdigest()
+
+
+def _context_key(builder, args, nets, metrics) -> list:
+  """Part of the cache key common to all points of a sweep."""
+  name = f"{builder.__module__}.{builder.__qualname__}"
+  metric_names = [[metric_name, f"{getattr(metric, '__module__', '')}.{getattr(metric, '__qualname__', '')}"]
+                  for metric_name, metric in sorted((metrics or {}).items())]
+  return [_CACHE_VERSION, name, _source_hash(builder), list(args), list(nets), metric_names]
+
+
+def _key(context:list, params:dict) -> str:
+  # No default=repr. Default reprs differ between runs, and equal reprs don't
+  # mean equal values. Raises TypeError for such values.
+  data = json.dumps(context + [params], sort_keys=True)
+  return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def params_key(builder, params:dict, *, args=(), nets=(), metrics=None) -> str:
+  """Cache key of a builder evaluation (see evaluate).
+
+  args and params must be JSON serializable, otherwise TypeError is raised.
+  """
+  return _key(_context_key(builder, args, nets, metrics), params)
+
+
+def evaluate(builder, params:dict, *, args=(), nets=(), metrics=None) -> Result:
+  """Capture builder(*args, **params) in a new global scope, and return a Result.
+
+  Keyword arguments named in nets get fresh global nets of the same name.
+  metrics is a dict of name -> function(schematic), called after a successful
+  capture. Only assertions are treated as failed constraints, other
+  exceptions are propagated.
+  """
+  kwargs = dict(params)
+  with edag.NewGlobalScope() as schematic:
+    for name in nets:
+      kwargs[name] = edag.net(name)
+    try:
+      builder(*args, **kwargs)
+    except AssertionError as e:
+      return Result(params, False, str(e) or _assertion_location(e), len(schematic.registered_components), {})
+    schematic.flatten()
+    values = {name: metric(schematic) for name, metric in (metrics or {}).items()}
+    return Result(params, True, None, len(schematic.registered_components), values)
+
+
+def _assertion_location(e:AssertionError):
+  """Description of an assertion without a message, from its location."""
+  frame = traceback.extract_tb(e.__traceback__)[-1]
+  return f"{os.path.basename(frame.filename)}:{frame.lineno}: {frame.line}"
+
+
+def _evaluate_job(job):
+  builder, params, args, nets, metrics = job
+  return evaluate(builder, params, args=args, nets=nets, metrics=metrics)
+
+
+def _load_cache(filename:str):
+  try:
+    with open(filename, "r", encoding="utf-8") as f:
+      cache = json.load(f)
+  except FileNotFoundError:
+    return {}
+  if cache.get("version") != _CACHE_VERSION:
+    return {}
+  return cache["results"]
+
+
+def explore(builder, points, *, args=(), nets=(), metrics=None, max_workers:int = None, cache:str = None):
+  """Evaluate builder for each parameter set in points. Returns a list of Result.
+
+  Points not found in the cache file (if any) are evaluated in parallel in
+  worker processes (in this process with max_workers=1), and added to the
+  cache. builder, args and metrics must be picklable, and metric values
+  must be JSON serializable to be cached. See evaluate.
+  """
+  points = list(points)
+  results = _load_cache(cache) if cache else {}
+  context = _context_key(builder, args, nets, metrics)
+  keys = [_key(context, params) for params in points]
+  todo = {}
+  for key, params in zip(keys, points):
+    if key not in results:
+      todo.setdefault(key, params)
+  jobs = [(builder, params, tuple(args), tuple(nets), metrics) for params in todo.values()]
+  if max_workers == 1 or len(jobs) <= 1:
+    evaluated = [_evaluate_job(job) for job in jobs]
+  else:
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, len(jobs) // (4 * (max_workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      evaluated = list(executor.map(_evaluate_job, jobs, chunksize=chunksize))
+  for key, result in zip(todo, evaluated):
+    results[key] = [result.ok, result.error, result.components, result.metrics]
+  if cache and evaluated:
+    data = json.dumps({"version": _CACHE_VERSION, "results": results}, separators=(",", ":"))
+    edag._atomic_write(cache, data.encode("utf-8"))
+  return [Result(params, *results[key]) for key, params in zip(keys, points)]
+
+
+import unittest
+
+
+def _test_builder(name, *, vin, gnd, count, value):
+  assert count <= 3, f"Too many resistors: {count}"
+  for i in range(count):
+    edag.make_component(f"{name}{i}", "R", [vin, gnd], [], value, prefix="R")
+
+
+def _test_total(schematic):
+  return sum(c.own_properties for c in schematic.registered_components)
+
+
+class Test_explore(unittest.TestCase):
+  def test_sweep(self):
+    import tempfile
+    points = grid(count=[1, 2, 4], value=[10.0, 20.0])
+    self.assertEqual(len(points), 6)
+    with tempfile.TemporaryDirectory() as tmp:
+      cache = os.path.join(tmp, "sweep.json")
+      kwargs = dict(args=("r",), nets=("vin", "gnd"), metrics={"total": _test_total}, cache=cache)
+      results = explore(_test_builder, points, max_workers=2, **kwargs)
+      self.assertEqual([r.ok for r in results], [True] * 4 + [False] * 2)
+      self.assertEqual(results[3], Result({"count": 2, "value": 20.0}, True, None, 2, {"total": 40.0}))
+      self.assertEqual(results[4].error, "Too many resistors: 4")
+      # Only the new point is evaluated, the rest come from the cache.
+      more = points + [{"count": 3, "value": 1.0}]
+      results2 = explore(_test_builder, more, max_workers=1, **kwargs)
+      self.assertEqual(results2[:6], results)
+      self.assertEqual(results2[6].metrics, {"total": 3.0})
+
+  def test_params_key(self):
+    params = {"count": 1, "value": 10.0}
+    key = params_key(_test_builder, params, args=("r",), nets=("vin", "gnd"), metrics={"total": _test_total})
+    self.assertEqual(key, params_key(_test_builder, dict(params), args=("r",), nets=("vin", "gnd"),
+                                     metrics={"total": _test_total}))
+    self.assertEqual(len({key,
+                          params_key(_test_builder, params, args=("x",), nets=("vin", "gnd"),
+                                     metrics={"total": _test_total}),
+                          params_key(_test_builder, params, args=("r",), nets=("vin",), metrics={"total": _test_total}),
+                          params_key(_test_builder, params, args=("r",), nets=("vin", "gnd"), metrics={"sum": _test_total}),
+                          params_key(_test_builder, params, args=("r",), nets=("vin", "gnd"))}), 5)
+    self.assertEqual(len(_source_hash(_test_builder)), 64)
+    with self.assertRaises(TypeError):
+      params_key(_test_builder, {"count": 1, "value": object()})
+
+  def test_random_sample(self):
+    points = random_sample(5, seed=1, count=[1, 2], value=(1.0, 2.0))
+    self.assertEqual(points, random_sample(5, seed=1, count=[1, 2], value=(1.0, 2.0)))
+    self.assertTrue(all(1.0 <= p["value"] <= 2.0 for p in points))
+
+
+if __name__ == '__main__':
+  unittest.main(verbosity=0)
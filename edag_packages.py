@@ -26,16 +26,21 @@ m_6332, i_2512 = "SMD 6332 metric", "SMD 2512 imperial"
 SOT32_6 = "SOT32-6"
 SOT_23 = "SOT-23"
 SOT_89 = "SOT-89"
+SOT_223 = "SOT-223"
+SOT_23_5 = "SOT-23-5"
+TSOT_23_5 = "TSOT-23-5"
+SOT23_6 = "SOT23-6"
+TSOT23_6 = "TSOT23-6"
 USP_6B = "USP-6B"  # TorexSemiconductor Ltd.
 TO_220 = "TO-220"
 TO_220_short_shoulder = "TO-220 (short shoulder)"
+TO_92 = "TO-92"
 
 # TI package designators.
 
 TI_KC = TO_220
 TI_KCS = TO_220_short_shoulder
 # TI_KCT = TO_220  # ??
-TI_KTT = TO_263
 TI_DCY = SOT_223
 
 # Texas Instruments PowerFLEX from 1996.
@@ -70,6 +75,7 @@ DPAK_5 = "DPAK_5"  # aka TO-252. 5 pins with 45 mils (1.1mm) spacing.
 
 TO_252_3 = DPAK_3
 TO_252_5 = DPAK_5
+TO_252 = "TO-252"  # 3 pins (with the tab), like DPAK_3.
 
 # TO-263, very similar to TO-220,
 # but intented for SMD, with shorter leads, and shorter metal tab (and no mounting hole).
@@ -78,6 +84,8 @@ TO_252_5 = DPAK_5
 D2PAK = "D2PAK"  # aka TO-263
 DDPAK = D2PAK  # aka TO-263
 TO_263AA = D2PAK
+TO_263 = D2PAK
+TI_KTT = TO_263
 
 # D2PAKs can have 3 to 9 terminals, sometimes 2 terminals (central pin of 3 terminal one can be missing).
 D2PAK_3 = "D2PAK-3"  # terminal pitch 100mils, central terminal missing.
@@ -147,8 +155,8 @@ QIP_with_tabs = "QIP-.. with tabs"  # HA1306  # TODO(baryluk): Find stuff.
 # JEDAC MS-013 (7.50mm body width)
 # JEITA (previously EIAJ) SDP. EIAJ Type II is 5.3mm body width.
 SOIC8N = "SOIC-8-N"
-SOIC16N
-SOIC14N
+SOIC14N = "SOIC-14-N"
+SOIC16N = "SOIC-16-N"
 
 # Most manufacturers will usually use high pin ones using JEITA/EIAJ, and JEDEC for small pin count ones.
 # Often the 5.3mm wide ones will be refered as SOP, and the 3.9mm and 7.5mm ones as SOIC.
@@ -183,125 +191,126 @@ PSOP44 = "PSOP-44"  # i.e. Hynix HY29LV800
 # FBGA - Fine-Pitch Ball Grid Array
 FBGA48 = "FBGA-48"  # i.e. Hynix HY29LV800, 8mm x 9mm
 
-SQP
-SW
-QFN  # Quad Flat No-Lead ?
-QFP  # quad flat-pack?
-SOP
-SOT23
-SOT223
-SOT89
-SO
-VSO
-SSOP
-HTSSOP
-TSSOP
-HSOP
-PMFP
-SQFP
-LQFP
-HLQFP
-HTQFP
-TQFP
-PGA
-PLCC
-PQFP
-SOP
-PQFP100L
-SOT26
-SOT363
-SSOP_16L
-SOT89
-TO_252
-SOT223
-SOT523
-SSOP
-T7_TO220
-FDIP
-PDIP
-PENTAWATT
-TO2205
-TO220ISO
-QDIP
-TO232
-TO263
-TO268
-SIP
-SO
-TO3
-TO52
-TO99
-SOT223
-SOT23
-SQL
-TSOP
-ZIP
-FlatPack
-FTO220
-GSOP28
-ITO3p
-ITO220
-JLCC
-LBGA_180L
-LCC
-BQFP132
-CERQUAD
-CLCC
-CPGA
-DIP_tab
-EBGA_680L
-PSDIP
-QFP
-SBGA_192L
-SC_70_5L  # SC-70 5L
-SOJ_32L
-SOJ
-SOP_EIAJ_Type_II_14L
-SO_8
-SO_14
-TO_220AB
-LL_34  # melf diode
-LL_41  # melf diode
-SOT_89
-SOD_123  # usually diodes
-SOD_123FL  # usually diodes
-SMAF
-SMBF
-SMA
-SMB
-SMC
-TO_277
-TO_252
-TO_263
-DO_214AC
-DO_214AB
-DO_214AA
-SOD_323
-SOD_523
-SOD_723
-SOT_223
-SOT_363
-SOT_23_6
-SOP4
+# TODO(baryluk): Define these too.
+# SQP
+# SW
+# QFN  # Quad Flat No-Lead ?
+# QFP  # quad flat-pack?
+# SOP
+# SOT23
+# SOT223
+# SOT89
+# SO
+# VSO
+# SSOP
+# HTSSOP
+# TSSOP
+# HSOP
+# PMFP
+# SQFP
+# LQFP
+# HLQFP
+# HTQFP
+# TQFP
+# PGA
+# PLCC
+# PQFP
+# SOP
+# PQFP100L
+# SOT26
+# SOT363
+# SSOP_16L
+# SOT89
+# TO_252
+# SOT223
+# SOT523
+# SSOP
+# T7_TO220
+# FDIP
+# PDIP
+# PENTAWATT
+# TO2205
+# TO220ISO
+# QDIP
+# TO232
+# TO263
+# TO268
+# SIP
+# SO
+# TO3
+# TO52
+# TO99
+# SOT223
+# SOT23
+# SQL
+# TSOP
+# ZIP
+# FlatPack
+# FTO220
+# GSOP28
+# ITO3p
+# ITO220
+# JLCC
+# LBGA_180L
+# LCC
+# BQFP132
+# CERQUAD
+# CLCC
+# CPGA
+# DIP_tab
+# EBGA_680L
+# PSDIP
+# QFP
+# SBGA_192L
+# SC_70_5L  # SC-70 5L
+# SOJ_32L
+# SOJ
+# SOP_EIAJ_Type_II_14L
+# SO_8
+# SO_14
+# TO_220AB
+# LL_34  # melf diode
+# LL_41  # melf diode
+# SOT_89
+# SOD_123  # usually diodes
+# SOD_123FL  # usually diodes
+# SMAF
+# SMBF
+# SMA
+# SMB
+# SMC
+# TO_277
+# TO_252
+# TO_263
+# DO_214AC
+# DO_214AB
+# DO_214AA
+# SOD_323
+# SOD_523
+# SOD_723
+# SOT_223
+# SOT_363
+# SOT_23_6
+# SOP4
 
 # TH parts, for diodes
-R_1
-DO_41
-DO_15
-DO_27
-R_6
-DO_35
-DO_41
-TO_220AB
-TO_220AC
-ITO_220AB
-ITO_220AC
-TO_247
-TO_126
-TO_92
-TO_251
-DIP_4  # 4 lead, usually for bridge rectifiers
-SEP  # 4 lead, usually for bridge rectifiers
+# R_1
+# DO_41
+# DO_15
+# DO_27
+# R_6
+# DO_35
+# DO_41
+# TO_220AB
+# TO_220AC
+# ITO_220AB
+# ITO_220AC
+# TO_247
+# TO_126
+# TO_92
+# TO_251
+# DIP_4  # 4 lead, usually for bridge rectifiers
+# SEP  # 4 lead, usually for bridge rectifiers
 
 # Diode outlines.
 
@@ -351,5 +360,34 @@ MicroMELF = MMU = "MicroMELF"
 
 # Similar to MELF but with squared electroes for easier handling.
 QuadroMELF = "QuadroMELF"
-"SQ_MELF"
-"B_BELF"
+# "SQ_MELF"
+# "B_BELF"
+
+
+# Number of pads of packages (including exposed pads and tabs, if they are
+# a separate pad), to validate pin maps (see edag.PinMap).
+PIN_COUNTS = {
+  SOIC8: 8, SOIC8N: 8, SOIC14N: 14, SOIC16N: 16, SOP8: 8, HSOP8: 9,
+  miniSOIC_8: 8, miniSOIC_10: 10, SOJ12: 12, TSOP48: 48, TSSOP16: 16, TSSOP16_EP: 17, PSOP44: 44,
+  FBGA48: 48,
+  SOT_23: 3, SOT_23_5: 5, TSOT_23_5: 5, SOT23_6: 6, TSOT23_6: 6, SOT32_6: 6, SOT_89: 3, SOT_223: 4,
+  TO_92: 3, TO_220: 3, TO_220_short_shoulder: 3, TO_220FP: 3, TO_252: 3, DPAK_3: 3, DPAK_5: 5,
+  D2PAK: 3, D2PAK_3: 3, D2PAK_4: 4, D2PAK_5: 5, D2PAK_6: 6, D2PAK_7: 7, D2PAK_9: 9,
+  POWER_FLEX_2: 2, POWER_FLEX_3: 3, POWER_FLEX_5: 5, POWER_FLEX_7: 7, POWER_FLEX_9: 9,
+  POWER_FLEX_14: 14, POWER_FLEX_15: 15,
+  DIP4: 4, DIP6: 6, DIP8: 8, DIP14: 14, DIP16: 16, DIP18: 18, DIP20: 20, DIP24: 24, DIP28: 28,
+  DIP32: 32, DIP36: 36, DIP40: 40, DIP48: 48, DIP52: 52, DIP64: 64,
+  DIP4N: 4, DIP6N: 6, DIP8N: 8, DIP14N: 14, DIP16N: 16, DIP18N: 18, DIP20N: 20, DIP24N: 24, DIP28N: 28,
+  SPDIP8: 8, SIP7: 7, SIP9: 9, SIP24: 24, QIP_42: 42,
+  DO_7: 2, DO_14: 2, DO_15: 2, DO_16: 2, DO_26: 2, DO_29: 2, DO_34: 2, DO_35: 2, DO_41: 2,
+  MELF: 2, MiniMELF: 2, MicroMELF: 2, QuadroMELF: 2,
+  m_0201: 2, m_0402: 2, m_0603: 2, m_1005: 2, m_2012: 2, m_2520: 2, m_3216: 2, m_3225: 2,
+  m_4516: 2, m_4532: 2, m_5025: 2, m_6332: 2,
+  i_01005: 2, i_0201: 2, i_0402: 2, i_0805: 2, i_1008: 2, i_1206: 2, i_1210: 2, i_1806: 2,
+  i_1812: 2, i_2010: 2, i_2512: 2,
+}
+
+
+def pin_count(package:str):
+  """Number of pads of the package, or None if not known."""
+  return PIN_COUNTS.get(package)
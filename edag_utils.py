@@ -2,16 +2,83 @@
 
 # Executable to run built-in tests.
 
-warnings = []
+from collections import deque
+import functools
+
+# The last warnings emitted, and the number of all warnings emitted so far.
+# Bounded, as long running processes (i.e. edag_watch) can emit many.
+_MAX_WARNINGS = 1000
+warnings = deque(maxlen=_MAX_WARNINGS)
+warning_count = 0
 
 
 def warning(text):
-  global warnings
+  global warning_count
   import sys
+  warnings.append(text)
+  warning_count += 1
   print("Warning:", text, file=sys.stderr)
 
 
-def tofloat(x, suffixes=[]):
+# SI prefixes, ordered by frequency of use.
+_SI_PREFIXES = {
+  "k": 1.0e3,     # kilo
+  "m": 1.0e-3,    # milli
+  "u": 1.0e-6,    # micro
+  "µ": 1.0e-6,    # micro
+  "M": 1.0e6,     # mega
+  "n": 1.0e-9,    # nano
+  "p": 1.0e-12,   # pico
+  "G": 1.0e9,     # giga
+  "f": 1.0e-15,   # femto
+  "a": 1.0e-18,   # atto
+  "T": 1.0e12,    # tera
+}
+
+# Supported, but easy to confuse with something else.
+_DEPRECATED_PREFIXES = {
+  "a": "using atto SI prefix (a = 10^-18) could lead to mistakes. Maybe you meants A (Amperes)?",
+}
+
+# Intentionally not supported prefixes.
+_UNSUPPORTED_PREFIXES = {
+  "z": "zepto SI prefix (z = 10^-21) not supported",
+  "y": "yocto SI prefix (y = 10^-24) not supported",
+  "Y": "yotta SI prefix (Y = 10^23) not supported",
+  "Z": "zetta SI prefix (Z = 10^21) not supported",
+  "E": "exa SI prefix (E = 10^18) not supported",
+  "P": "peta SI prefix (P = 10^15) not supported",
+  "h": "hecto SI prefix (h = 10^2) not supported",
+  "d": "deci SI prefix (d = 10^-1) not supported",
+  "c": "centi SI prefix (d = 10^-2) not supported",
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse(x:str, suffixes:tuple):
+  """Returns value of x, and a tuple of (kind, text) warnings."""
+  # TODO: Add resistance formats (2R2 = 2.2 Ohm)
+  warnings = ()
+  if x[0].isspace() or x[-1].isspace():
+    warnings = (("whitespace", "Leading or trailing whitespace detected in the number / value: '{}'. Please fix.".format(x)),)
+    x = x.strip()
+  for suffix in suffixes:
+    if x.endswith(suffix):
+      x = x[:-len(suffix)]
+      break
+  last = x[-1]
+  if last.isdigit():  # No trailing suffix.
+    return float(x), warnings
+  multiplier = _SI_PREFIXES.get(last)
+  if multiplier is None:
+    assert last not in _UNSUPPORTED_PREFIXES, _UNSUPPORTED_PREFIXES.get(last)
+    assert False, "unknown suffix or format in tofloat('{}').".format(x)
+  if last in _DEPRECATED_PREFIXES:
+    warnings += (("prefix " + last, _DEPRECATED_PREFIXES[last]),)
+  return float(x[:-1]) * multiplier, warnings
+
+
+def tofloat(x, suffixes=()):
   """Convert a number or number-like string with suffix into float.
 
   tofloat("3.3k") => 3300.0
@@ -34,67 +101,61 @@ def tofloat(x, suffixes=[]):
 
   A leading and trailing spaces will produce a warning, but are supported (i.e. ignored without error).
 
+  Parsed strings are cached, so repeated literals are cheap. See parse_many, to
+  convert many values at once.
+
   TODO: Support underscores, for long values, i.e. 13_512_101, but I doub't it that useful.
 
   TODO: Warn also about spaces between units and suffixes, i.e. "1.23 mV", or "1.1m V".
   """
 
-  # TODO: Add resistance formats (2R2 = 2.2 Ohm)
   if type(x) is str:
-    if x[0].isspace() or x[-1].isspace():
-      warning("Leading or trailing whitespace detected in the number / value: '{}'. Please fix.".format(x))
-      x = x.strip()
-    for suffix in suffixes:
-      if x.endswith(suffix):
-        x = x[:-len(suffix)]
-        break
-    if x[-1].isdigit():  # No trailing suffix.
-      return float(x)
-    n = x[0:-1]
-    # ordered for speed
-    if x[-1] == "k":  # kilo
-      return float(n) * 1.0e3
-    if x[-1] == "m":  # milli
-      return float(n) * 1.0e-3
-    if x[-1] == "u" or x[-1] == "µ":  # micro
-      return float(n) * 1.0e-6
-    if x[-1] == "M":  # mega
-      return float(n) * 1.0e6
-    if x[-1] == "n":  # nano
-      return float(n) * 1.0e-9
-    if x[-1] == "p":  # pico
-      return float(n) * 1.0e-12
-    if x[-1] == "G":  # giga
-      return float(n) * 1.0e9
-    if x[-1] == "f":  # femto
-      return float(n) * 1.0e-15
-    if x[-1] == "a":  # atto
-      warning("using atto SI prefix (a = 10^-18) could lead to mistakes. Maybe you meants A (Amperes)?")
-      return float(n) * 1.0e-18
-    if x[-1] == "T":  # tera
-      return float(n) * 1.0e12
-    if x[-1] == "z":  # zepto
-      assert False, "zepto SI prefix (z = 10^-21) not supported"
-    if x[-1] == "y":  # yocto
-      assert False, "yocto SI prefix (y = 10^-24) not supported"
-    if x[-1] == "Y":  # yotta
-      assert False, "yotta SI prefix (Y = 10^23) not supported"
-    if x[-1] == "Z":  # zetta
-      assert False, "zetta SI prefix (Z = 10^21) not supported"
-    if x[-1] == "E":  # exa
-      assert False, "exa SI prefix (E = 10^18) not supported"
-    if x[-1] == "P":  # peta
-      assert False, "peta SI prefix (P = 10^15) not supported"
-    if x[-1] == "h":  # hecto
-      assert False, "hecto SI prefix (h = 10^2) not supported"
-    if x[-1] == "d":  # deci
-      assert False, "deci SI prefix (d = 10^-1) not supported"
-    if x[-1] == "c":  # centi
-      assert False, "centi SI prefix (d = 10^-2) not supported"
-    assert False, "unknown suffix or format in tofloat('{}').".format(x)
+    value, warnings = _parse(x, tuple(suffixes))
+    for _, text in warnings:
+      warning(text)
+    return value
   return float(x)
 
 
+def parse_many(values, suffixes=(), *, collect:list = None):
+  """Convert many values at once, like tofloat, into a NumPy float64 array.
+
+  values is a list (or other iterable) of numbers and strings, or a NumPy
+  array. Instead of a warning per value, one warning per kind of problem is
+  emitted for the whole batch, with a number of affected values. If collect
+  is a list, (index, warning text) pairs are appended to it instead.
+
+  parse_many(["4.7k", "10", "1.2M"], ["Ohm"]) => array([4.7e3, 10.0, 1.2e6])
+  """
+  import numpy
+  if isinstance(values, numpy.ndarray) and values.dtype.kind in "biuf":
+    return values.astype(numpy.float64)
+  suffixes = tuple(suffixes)
+  items = values.tolist() if isinstance(values, numpy.ndarray) else list(values)
+  parsed = {}  # Local memo, cheaper than _parse cache lookups.
+  result = []
+  problems = {}  # kind -> [count, first text]
+  for i, x in enumerate(items):
+    if type(x) is not str:
+      result.append(x)
+      continue
+    value_warnings = parsed.get(x)
+    if value_warnings is None:
+      value_warnings = parsed[x] = _parse(x, suffixes)
+    value, warnings = value_warnings
+    result.append(value)
+    for kind, text in warnings:
+      if collect is not None:
+        collect.append((i, text))
+      elif kind in problems:
+        problems[kind][0] += 1
+      else:
+        problems[kind] = [1, text]
+  for count, text in problems.values():
+    warning(text if count == 1 else f"{text} (and {count - 1} more values with the same problem)")
+  return numpy.array(result, dtype=numpy.float64)
+
+
 # TODO(baryluk): Add helper functions, i.e. nano(5), nano(3) * farad(), 3 * nF, 5 * kOhm, kOhm(5)
 
 # import math
@@ -156,43 +217,43 @@ class Test_tofloat(unittest.TestCase):
 # Some of them can also perform unit conversion, i.e. from F to C, or from A*h to C.
 
 def tofloat_R(x):
-  return tofloat(x, ["Ohm", "R", "Ω"])
+  return tofloat(x, ("Ohm", "R", "Ω"))
 
 
 def tofloat_V(x):
-  return tofloat(x, ["V"])
+  return tofloat(x, ("V",))
 
 
 def tofloat_I(x):
-  return tofloat(x, ["A", "C/s"])
+  return tofloat(x, ("A", "C/s"))
 
 
 def tofloat_C(x):
-  return tofloat(x, ["F"])
+  return tofloat(x, ("F",))
 
 
 def tofloat_L(x):
-  return tofloat(x, ["H"])
+  return tofloat(x, ("H",))
 
 
 def tofloat_P(x):
-  return tofloat(x, ["P"])
+  return tofloat(x, ("P",))
 
 
 def tofloat_Energy(x):
-  return tofloat(x, ["Wh"])  # Ws, J  (1 J = 1 W*s = 1 N*m).
+  return tofloat(x, ("Wh",))  # Ws, J  (1 J = 1 W*s = 1 N*m).
 
 
 def tofloat_Charge(x):
-  return tofloat(x, ["C", "As", "A*s", "A×s", "A⋅s"])  # Ah
+  return tofloat(x, ("C", "As", "A*s", "A×s", "A⋅s"))  # Ah
 
 
 def tofloat_T(x):
-  return tofloat(x, ["K"])  # C, F
+  return tofloat(x, ("K",))  # C, F
 
 
 def tofloat_Hz(x):
-  return tofloat(x, ["Hz"])
+  return tofloat(x, ("Hz",))
 
 
 # Some aliasses. These are non-canonical and can produce a deprecation warnings
@@ -276,6 +337,44 @@ def ohm_law(*, r:'Ohm'=None, u:'V'=None, i:'A'=None):
   assert False, "Missing required inputs to ohm_law"
 
 
+class Test_parse_many(unittest.TestCase):
+  def test_cached(self):
+    self.assertEqual(tofloat("4.7k"), tofloat("4.7k"))
+    self.assertGreater(_parse.cache_info().hits, 0)
+    # Errors are not cached, and raise every time.
+    for _ in range(2):
+      with self.assertRaises(Exception):
+        tofloat("3c")
+    # Warnings are repeated for cached values.
+    count = warning_count
+    tofloat(" 2k")
+    tofloat(" 2k")
+    self.assertEqual(warning_count, count + 2)
+    self.assertEqual(warnings.maxlen, _MAX_WARNINGS)
+
+  def test_batch(self):
+    try:
+      import numpy
+    except ImportError:
+      self.skipTest("numpy not installed")
+    values = parse_many(["4.7k", "10", 22, "1.2MOhm", "3.3µ"], ["Ohm"])
+    self.assertEqual(values.dtype, numpy.float64)
+    self.assertEqual(values.tolist(), [tofloat(x, ["Ohm"]) for x in ["4.7k", "10", 22, "1.2MOhm", "3.3µ"]])
+    self.assertEqual(parse_many(numpy.array(["1k", "2m"])).tolist(), [1.0e3, 2.0e-3])
+    self.assertEqual(parse_many(numpy.arange(3)).tolist(), [0.0, 1.0, 2.0])
+    # One warning for the whole batch.
+    count = warning_count
+    parse_many([" 1k", "2k ", " 3k ", "4k"])
+    self.assertEqual(warning_count, count + 1)
+    self.assertIn("and 2 more values", warnings[-1])
+    collected = []
+    parse_many(["1k", " 2k"], collect=collected)
+    self.assertEqual(warning_count, count + 1)
+    self.assertEqual([i for i, _ in collected], [1])
+    with self.assertRaises(Exception):
+      parse_many(["1k", "2kV"])
+
+
 class Test_OhmLaw(unittest.TestCase):
   def test_all(self):
     self.assertEqual(ohm_law(r="1k", u="2V"), 0.002)  # A
@@ -555,6 +654,16 @@ def smd_tofloat(x:str):
   """It should be passed as string, but integer is also ok, it will be converted to decimal string."""
   if type(x) is int:
     x = str(x)
+  # All valid codes are precomputed. Unknown codes are decoded again, to raise a helpful error.
+  value, text = _smd_codes().get(x) or _smd_decode(x)
+  if text:
+    warning(text)
+  return value
+
+
+def _smd_decode(x:str):
+  """Returns value of SMD code x, and a warning text (or None)."""
+  text = None
 
   # EIA-96 system (2 digit + 1 letter).
   if len(x) == 3 and x[0:1].isdigit() and x[2].isalpha():  # aka "11A format"
@@ -564,19 +673,19 @@ def smd_tofloat(x:str):
      # Technically 00R is 0 * 0.01, but it will end up as 0 anyway, and float, which is nice.
      # Technically EIA-96 doesn't support 00R, or other 00 things, like 00Z, 00X, etc.
      if x[2] == 'R' and value != 0:  # Allow 00R.
-       warning(f"Using R suffix in '{x}' with EIE-96 codes (2 digit + 1 leter) is not recommended "
+       text = (f"Using R suffix in '{x}' with EIE-96 codes (2 digit + 1 leter) is not recommended "
                "and deprecated. I.e. '17R' is 1.47Ω, not 17Ω. Use Y to clarify.")
      if x[2] == 'S':
-       warning(f"Using S suffix in '{x}' with EIE-96 codes (2 digit + 1 leter) is not deprecated, "
+       text = (f"Using S suffix in '{x}' with EIE-96 codes (2 digit + 1 leter) is not deprecated, "
                "use X instead.")
      if x[2] == 'H':
-       warning(f"Using H suffix in '{x}' with EIE-96 codes (2 digit + 1 leter) is not deprecated, "
+       text = (f"Using H suffix in '{x}' with EIE-96 codes (2 digit + 1 leter) is not deprecated, "
                "use B instead.")
      if value == 0 and x[2] != 'R':
-       warning(f"Using non-R suffix in '{x}' with EIE-96 codes (2 digit + 1 letter) for non-zero values, "
+       text = (f"Using non-R suffix in '{x}' with EIE-96 codes (2 digit + 1 letter) for non-zero values, "
                "is not recommended. Use '00R'.")
      multiplier = _eia_96_multipliers[x[2]]
-     return value * multiplier
+     return value * multiplier, text
 
   # if len(x) == 3 and x[0].isalpha() and x[1:3].isdigit():  # aka "A11 format"
     # 2%, 5%, 10% SMD resistors.
@@ -587,16 +696,16 @@ def smd_tofloat(x:str):
     assert x[2] != 'R'
     assert x.count('R') == 1
     x = x.replace('R', '.')
-    return float(x)
+    return float(x), text
 
   # Normal 3 digit codes.
   if len(x) == 3 and x.isdigit():
     value = int(x[0:2])
     multiplier = 10 ** int(x[2])
     if value == 0 and multiplier != 1:
-      warning(f"Using non-zero last digit in 3-digit SMD code, with 00 at the start, is not recommended, "
+      text = (f"Using non-zero last digit in 3-digit SMD code, with 00 at the start, is not recommended, "
               f"use '000' instead of '{x}'.")
-    return value * multiplier
+    return value * multiplier, text
 
   # Support 'R' in 4 digit codes.
   #
@@ -610,14 +719,14 @@ def smd_tofloat(x:str):
   if len(x) == 4 and 'R' in x:
     assert x.count('R') == 1
     if x[-1] == 'R':
-      warning(f"Avoid using 'R' at the end of 4-digit SMD codes, prefer '0'. "
+      text = (f"Avoid using 'R' at the end of 4-digit SMD codes, prefer '0'. "
               f"I.e. '123R', use '1230' instead. Found when parsing: '{x}'.")
     x = x.replace('R', '.')
     # Note, float function, will handle also things like '.123', so 'R123',
     # converted to '.123' will convert to 0.123. Which is correct.
     # Similarly 'R123' will be converted to '123.', which will convert to
     # 123.0, which is correct.
-    return float(x)
+    return float(x), text
 
   # sub-milliΩ resolution. ie. 5L12 is 5.12 mΩ.
   # We only allow this in 4-digit codes.
@@ -626,24 +735,24 @@ def smd_tofloat(x:str):
     x = x.replace('L', '.')
     # float is smart, so 'L123', will be 0.123e-3, and '789L' will be 789e-3
     # return float(x) * 1.0e-3
-    return float(x + "e-3")  # Should be slightly more accurate.
+    return float(x + "e-3"), text  # Should be slightly more accurate.
 
   # Normal 4 digit codes.
   if len(x) == 4 and x.isdigit():
     value = int(x[0:3])
     multiplier = 10 ** int(x[3])
     if value == 0 and multiplier != 1:
-      warning(f"Using non-zero last digit in 4-digit SMD code, with 00 at the start, "
+      text = (f"Using non-zero last digit in 4-digit SMD code, with 00 at the start, "
               f"is not recommended, use '0000' instead of '{x}'.")
     # TODO: Using float(str(value) + "e{x[3]}") might be more accurate,
     # as some multipliers are not exact in floating points.
-    return value * multiplier
+    return value * multiplier, text
 
   # Handle common zero formats not handled by code above.
   if x == "0":
-    return 0.0
+    return 0.0, text
   if x == "00":
-    return 0.0
+    return 0.0, text
   # 3 and 4 digit (000, 0000) should be already handled above.
 
   assert False, (f"Unknown format when parsing '{x}'. EIE-96 system (2 digits + letter), "
@@ -921,6 +1030,13 @@ class Test_ResistorColors(unittest.TestCase):
 
 
 def capacitor_code_to_float(code:str):
+  """Capacitance (in F) of a capacitor marking. Also accepts i.e. '1R5' (1.5 pF)."""
+  if type(code) is int:
+    code = str(code)
+  return _capacitor_codes().get(code) or _capacitor_decode(code)
+
+
+def _capacitor_decode(code:str):
   # Code: 1st digit (1-9), 2nd digit (0-9), multiplier (0-9).
   # 100 => 10 pF
   # 101 => 100 pF
@@ -932,35 +1048,41 @@ def capacitor_code_to_float(code:str):
   # 107 => 100 uF
   # 108 => 0.1 pF
   # 109 => 1 pF
-  pass
+  if len(code) == 3 and code[1] == 'R' and code.replace('R', '').isdigit():
+    return float(code.replace('R', '.') + "e-12")
+  assert len(code) == 3 and code.isdigit(), f"Unknown capacitor code '{code}'. 3 digits, or digit R digit expected."
+  exponent = {'8': -2, '9': -1}.get(code[2], int(code[2]))
+  return float(f"{code[0:2]}e{exponent - 12}")  # Exact, unlike value * 10 ** exponent.
+
+
+# noqa  # E241
+_inductor_multipliers = {
+  "black":       1.0,   #       1x uH
+  "brown":      10.0,   #      10x uH
+  "red":       100.0,   #     100x uH
+  "orange":   1000.0,   #    1000x uH
+  "yellow":  10000.0,   #   10000x uH
+  "green":  100000.0,   #  100000x uH
+  "blue":  1000000.0,   # 1000000x uH
+  "gold":        0.1,   #       0.1x uH
+  "silver":      0.01,  #       0.01x uH
+}
+_inductor_tolerances_pct = {
+  "black": 20,
+  "brown": 1,
+  "red": 2,
+  "orange": 3,
+  "yellow": 4,  # different than for resistor (5%) which uses same for yellow and gold.
+  "gold": 5,
+  "silver": 10,
+}
 
 
 def inductor_colors_to_float_uH(colors:list):
   # 4 colors: 1st digit, 2nd digit, multiplier, tolerance
-  # noqa  # E241
-  _multipliers = {
-    "black":       1.0,   #       1x uH
-    "brown":      10.0,   #      10x uH
-    "red":       100.0,   #     100x uH
-    "orange":   1000.0,   #    1000x uH
-    "yellow":  10000.0,   #   10000x uH
-    "green":  100000.0,   #  100000x uH
-    "blue":  1000000.0,   # 1000000x uH
-    "gold":        0.1,   #       0.1x uH
-    "silver":      0.01,  #       0.01x uH
-  }
-  _tolerances_pct = {
-    "black": 20,
-    "brown": 1,
-    "red": 2,
-    "orange": 3,
-    "yellow": 4,  # different than for resistor (5%) which uses same for yellow and gold.
-    "gold": 5,
-    "silver": 10,
-  }
   value = 10 * _resistor_colors[colors[0]] + _resistor_colors[colors[1]]
-  multiplier = _multipliers[colors[2]]
-  tolerance_pct = _tolerances_pct[colors[3]]  # lookup even if not used to make sure it is correct / exists.
+  multiplier = _inductor_multipliers[colors[2]]
+  tolerance_pct = _inductor_tolerances_pct[colors[3]]  # lookup even if not used to make sure it is correct / exists.
   return value * multiplier
 
 
@@ -970,5 +1092,261 @@ class Test_InductorColors(unittest.TestCase):
     self.assertEqual(inductor_colors_to_float_uH(["green", "orange", "yellow", "gold"]), 530.0e3)  # 530 mH, +/- 5%
 
 
+# Marking codec.
+#
+# All markings of a kind are decoded once, on first use, into a forward table
+# (code -> value). Reverse tables (value -> code) for encoding are built from
+# them, taking codes in order of preference, and skipping codes that produce
+# warnings. Values are keyed by _marking_key, to ignore floating point noise,
+# i.e. 0.976 vs 0.9760000000000001.
+
+
+def _marking_key(value):
+  return float(f"{value:.9g}")
+
+
+_DIGITS = "0123456789"
+
+
+@functools.lru_cache(maxsize=None)
+def _smd_codes():
+  """Forward table of all valid SMD codes: code -> (value, warning text or None)."""
+  digits2 = [a + b for a in _DIGITS for b in _DIGITS]
+  digits3 = [d + m for d in digits2 for m in _DIGITS]
+  codes = [code + letter for code in _eia_96_codes for letter in _eia_96_multipliers]
+  codes += digits3
+  codes += ["R" + d for d in digits2] + [d[0] + "R" + d[1] for d in digits2]
+  codes += [d + m for d in digits3 for m in _DIGITS]
+  for infix in "RL":
+    codes += [d[:i] + infix + d[i:] for d in digits3 for i in range(4)]
+  codes += ["0", "00"]
+  return {code: _smd_decode(code) for code in codes}
+
+
+@functools.lru_cache(maxsize=None)
+def _capacitor_codes():
+  """Forward table of all capacitor codes: code -> value (in F)."""
+  codes = [a + b + m for a in _DIGITS for b in _DIGITS for m in _DIGITS]
+  codes += [a + "R" + b for a in _DIGITS for b in _DIGITS]
+  return {code: _capacitor_decode(code) for code in codes}
+
+
+def _reverse(forward:dict, codes):
+  """Reverse table: value key -> the first of codes (in order of preference)."""
+  reverse = {}
+  for code in codes:
+    reverse.setdefault(_marking_key(forward[code]), code)
+  return reverse
+
+
+def _smd_preference(code:str):
+  # Plain digits, R infix, leading R, L infix, plain digits with leading zero.
+  if code.isdigit():
+    return 4 if code[0] == '0' else 0
+  if 'L' in code:
+    return 3
+  return 2 if code[0] == 'R' else 1
+
+
+def _capacitor_preference(code:str):
+  # Plain digits, R infix, 8 and 9 multipliers, leading zero.
+  if not code.isdigit():
+    return 1
+  if code[0] == '0':
+    return 4
+  return 2 if code[2] in "89" else 0
+
+
+_SMD_FORMATS = ("3digit", "4digit", "eia96")
+
+
+@functools.lru_cache(maxsize=None)
+def _smd_reverse(format:str):
+  """Reverse table of SMD codes of the format: value key -> code."""
+  forward = {code: value for code, (value, text) in _smd_codes().items() if text is None}
+  if format == "eia96":
+    # Letters are already in order of preference, i.e. Y before R.
+    return _reverse(forward, [code for code in forward if len(code) == 3 and code[2].isalpha() and code[0:2] != "00"])
+  length = 3 if format == "3digit" else 4
+  codes = [code for code in forward if len(code) == length and (length == 4 or not code[2].isalpha())]
+  reverse = _reverse(forward, sorted(codes, key=_smd_preference))
+  reverse[0.0] = "0" * length
+  return reverse
+
+
+@functools.lru_cache(maxsize=None)
+def _capacitor_reverse():
+  forward = _capacitor_codes()
+  return _reverse(forward, sorted(forward, key=_capacitor_preference))
+
+
+def _reverse_colors(table:dict, avoid=()):
+  """Reverse table of color bands: value -> color, preferring colors not in avoid."""
+  reverse = {}
+  for color, value in sorted(table.items(), key=lambda item: item[0] in avoid):
+    reverse.setdefault(value, color)
+  return reverse
+
+
+_resistor_tolerance_colors = _reverse_colors(_resistor_tolerances_pct, avoid=("yellow", "white"))
+_resistor_temp_coef_colors = _reverse_colors(_resistor_temp_coef, avoid=("white",))
+_inductor_tolerance_colors = _reverse_colors(_inductor_tolerances_pct)
+
+
+@functools.lru_cache(maxsize=None)
+def _digit_colors(digits:int, inductor:bool = False):
+  """Reverse table of significant digits and multiplier bands: value key -> colors."""
+  names = list(_resistor_colors)
+  multipliers = _inductor_multipliers if inductor else _resistor_multipliers
+  reverse = {0.0: ("black",) * (digits + 1)}
+  for multiplier_color, multiplier in multipliers.items():
+    for number in range(10 ** (digits - 1), 10 ** digits):  # No leading zeros.
+      colors = tuple(names[int(d)] for d in str(number)) + (multiplier_color,)
+      reverse.setdefault(_marking_key(number * multiplier), colors)
+  return reverse
+
+
+def smd_code(value:'Ω', format:str = "3digit"):
+  """SMD resistor marking of the value. Inverse of smd_tofloat.
+
+  format is "3digit" (i.e. "472", "4R7"), "4digit" (i.e. "4701", "4R70", "5L12")
+  or "eia96" (i.e. "01C"). Returns None, if the value can't be marked exactly
+  in the format.
+  """
+  assert format in _SMD_FORMATS, f"Unknown SMD code format '{format}'. Supported: {_SMD_FORMATS}"
+  return _smd_reverse(format).get(_marking_key(value))
+
+
+def capacitor_code(value:'F'):
+  """Capacitor marking of the value, i.e. '104' for 100 nF. Or None."""
+  return _capacitor_reverse().get(_marking_key(value))
+
+
+def resistor_float_to_colors(r:'Ω', bands:int = 4, tolerance_pct:float = 5, temp_coef:'ppm/K' = 250):
+  """Color bands of a resistor. Inverse of resistor_colors_to_float.
+
+  3 and 4 bands encode 2 significant digits, 5 and 6 bands encode 3. Returns
+  None, if the value can't be encoded exactly.
+  """
+  assert 3 <= bands <= 6, f"Only 3, 4, 5 and 6 color band codes supported, got {bands}"
+  colors = _digit_colors(2 if bands <= 4 else 3).get(_marking_key(r))
+  if colors is None:
+    return None
+  if bands >= 4:
+    colors += (_resistor_tolerance_colors[tolerance_pct],)
+  if bands == 6:
+    colors += (_resistor_temp_coef_colors[temp_coef],)
+  return list(colors)
+
+
+def inductor_float_to_colors_uH(value:'uH', tolerance_pct:float = 20):
+  """4 color bands of an inductor. Inverse of inductor_colors_to_float_uH. Or None."""
+  colors = _digit_colors(2, inductor=True).get(_marking_key(value))
+  if colors is None:
+    return None
+  return list(colors) + [_inductor_tolerance_colors[tolerance_pct]]
+
+
+def _resistor_colors_to_ohms(colors:list):
+  return resistor_colors_to_float(colors).r
+
+
+_MARKING_DECODERS = {
+  "smd": smd_tofloat,
+  "capacitor": capacitor_code_to_float,
+  "resistor_colors": _resistor_colors_to_ohms,
+  "inductor_colors_uH": inductor_colors_to_float_uH,
+}
+
+_MARKING_ENCODERS = {
+  "smd": smd_code,
+  "capacitor": capacitor_code,
+  "resistor_colors": resistor_float_to_colors,
+  "inductor_colors_uH": inductor_float_to_colors_uH,
+}
+
+
+def decode_markings(markings, kind:str = "smd"):
+  """Decode many markings (i.e. a BOM column) at once. Returns a list of values.
+
+  kind is one of "smd", "capacitor", "resistor_colors" (values in Ω) or
+  "inductor_colors_uH". Color markings are lists of colors. Repeated markings
+  are decoded (and warned about) once.
+  """
+  decode = _MARKING_DECODERS[kind]
+  decoded = {}
+  values = []
+  for marking in markings:
+    key = tuple(marking) if type(marking) is list else marking
+    value = decoded.get(key)
+    if value is None:
+      value = decoded[key] = decode(marking)
+    values.append(value)
+  return values
+
+
+def encode_markings(values, kind:str = "smd", **kwargs):
+  """Encode many values at once. Returns a list of markings (None if not encodable).
+
+  kind is as for decode_markings. kwargs are passed to the encoder, i.e.
+  format="4digit" for "smd", or bands=5 for "resistor_colors".
+  """
+  encode = _MARKING_ENCODERS[kind]
+  return [encode(value, **kwargs) for value in values]
+
+
+class Test_MarkingCodec(unittest.TestCase):
+  def test_smd(self):
+    self.assertEqual(smd_code(4.7e3), "472")
+    self.assertEqual(smd_code(4.7), "4R7")
+    self.assertEqual(smd_code(0.47), "R47")
+    self.assertEqual(smd_code(0.0), "000")
+    self.assertEqual(smd_code(4.75e3), None)
+    self.assertEqual(smd_code(4.75e3, "4digit"), "4751")
+    self.assertEqual(smd_code(47.5, "4digit"), "47R5")
+    self.assertEqual(smd_code(5.12e-3, "4digit"), "5L12")
+    self.assertEqual(smd_code(1.0, "eia96"), "01Y")
+    self.assertEqual(smd_code(49.9, "eia96"), "68X")
+    self.assertEqual(smd_code(1.47, "eia96"), "17Y")
+    # All encodings decode back, without warnings.
+    count = warning_count
+    for format in _SMD_FORMATS:
+      for key, code in _smd_reverse(format).items():
+        self.assertEqual(_marking_key(smd_tofloat(code)), key)
+    self.assertEqual(warning_count, count)
+
+  def test_capacitor(self):
+    self.assertEqual(capacitor_code_to_float("104"), 100.0e-9)
+    self.assertEqual(capacitor_code_to_float("472"), 4.7e-9)
+    self.assertEqual(capacitor_code_to_float("109"), 1.0e-12)
+    self.assertEqual(capacitor_code_to_float("1R5"), 1.5e-12)
+    self.assertEqual(capacitor_code_to_float(106), 10.0e-6)
+    with self.assertRaises(Exception):
+      capacitor_code_to_float("10")
+    self.assertEqual(capacitor_code(100.0e-9), "104")
+    self.assertEqual(capacitor_code(1.0e-12), "1R0")
+    self.assertEqual(capacitor_code(0.47e-12), "478")
+    self.assertEqual(capacitor_code(4.75e-9), None)
+
+  def test_colors(self):
+    self.assertEqual(resistor_float_to_colors(4.7e3), ["yellow", "violet", "red", "gold"])
+    self.assertEqual(resistor_float_to_colors(0.48, 3), ["yellow", "gray", "silver"])
+    self.assertEqual(resistor_float_to_colors(105e3, 5, tolerance_pct=0.05), ["brown", "black", "green", "orange", "gray"])
+    self.assertEqual(resistor_float_to_colors(43.2e6, 6, tolerance_pct=0.25, temp_coef=5),
+                     ["yellow", "orange", "red", "green", "blue", "violet"])
+    self.assertEqual(resistor_float_to_colors(4.75e3), None)
+    for r in (0.0, 1.0, 10.0, 56.0, 0.1, 4.7e3, 910e3, 2.2e6):
+      self.assertAlmostEqual(resistor_colors_to_float(resistor_float_to_colors(r)).r, r)
+    self.assertEqual(inductor_float_to_colors_uH(600, tolerance_pct=5), ["blue", "black", "brown", "gold"])
+    self.assertEqual(inductor_colors_to_float_uH(inductor_float_to_colors_uH(530.0e3)), 530.0e3)
+
+  def test_batch(self):
+    self.assertEqual(decode_markings(["472", "4R7", "472", "01C"]), [4700, 4.7, 4700, 10.0e3])
+    self.assertEqual(decode_markings([["brown", "black", "red"]], "resistor_colors"), [1000.0])
+    self.assertEqual(encode_markings([4.7e3, 4.75e3], format="4digit"), ["4701", "4751"])
+    self.assertEqual(encode_markings([1.0e3], "resistor_colors", bands=5, tolerance_pct=1),
+                     [["brown", "black", "black", "brown", "brown"]])
+
+
 if __name__ == '__main__':
   unittest.main(verbosity=0)
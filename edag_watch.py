@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+"""Watch mode. Captures a design again, every time its sources change.
+
+  ./edag_watch.py myboard.py                  # Writes myboard.net
+  ./edag_watch.py myboard.py -o board.net --interval 0.1 -- --variant=b
+
+The design script is run in this interpreter (as __main__, with the given
+arguments), and its process() call writes the netlist atomically into the
+output file, so pcbnew never reads a partial one. Then the script, and all
+modules it loaded from its directory and from the edag library directory
+(i.e. parts), are polled for changes.
+
+On a change, only the changed modules are reloaded, together with modules
+that import them (found in their sources), or use anything from them, and
+the script is run again. Every other
+module stays imported. cached_sub templates of builders from modules that
+were not reloaded are kept between runs, so unchanged subschematics are
+stamped, not captured again. A change of the edag library itself restarts
+the interpreter.
+
+A failed run (i.e. an exception, or a failed design assertion) is reported,
+and the previous output is kept.
+"""
+
+import argparse
+import ast
+import importlib
+import os
+import runpy
+import sys
+import time
+import traceback
+import types
+
+import edag
+
+_LIBRARY_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _owner(value):
+  """Name of the module value comes from, if any."""
+  if isinstance(value, types.ModuleType):
+    return value.__name__
+  try:
+    return getattr(value, "__module__", None)
+  except Exception:
+    return None
+
+
+def _imports(module) -> set:
+  """Names of modules imported by the source of module (anywhere in it), and of
+  names imported from them, which might be submodules."""
+  try:
+    with open(module.__file__, "rb") as f:
+      tree = ast.parse(f.read(), module.__file__)
+  except (AttributeError, TypeError, OSError, SyntaxError, ValueError):
+    return set()
+  names = set()
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Import):
+      names.update(alias.name for alias in node.names)
+    elif isinstance(node, ast.ImportFrom):
+      base = node.module or ""
+      if node.level:
+        package = (getattr(module, "__package__", None) or "").split(".")
+        package = ".".join(package[:len(package) - node.level + 1])
+        base = f"{package}.{base}" if base and package else base or package
+      names.add(base)
+      names.update(f"{base}.{alias.name}" for alias in node.names)
+  return names
+
+
+def _reload(names:list, modules:dict) -> set:
+  """Reload modules (name -> module, in import order), and modules using them.
+
+  Returns names of reloaded modules.
+  """
+  reloaded = set(names)
+  imports = {name: _imports(module) for name, module in modules.items()}
+  grew = True
+  while grew:
+    grew = False
+    for name, module in modules.items():
+      if name in reloaded:
+        continue
+      # Imported plain values (i.e. floats) don't know their module.
+      if not imports[name].isdisjoint(reloaded) or any(_owner(value) in reloaded for value in vars(module).values()):
+        reloaded.add(name)
+        grew = True
+  for name, module in modules.items():
+    if name not in reloaded:
+      continue
+    # Drop stale objects, i.e. cached by lazy imports. Module level imports
+    # bind them again.
+    for key, value in list(vars(module).items()):
+      if not key.startswith("__") and not isinstance(value, types.ModuleType) and _owner(value) in reloaded:
+        del vars(module)[key]
+    importlib.reload(module)
+  return reloaded
+
+
+class Watcher(object):
+  """Runs a design script, and runs it again when its sources change. See module documentation."""
+  def __init__(self, script:str, *, output:str = None, args=()):
+    self.script = os.path.abspath(script)
+    self.output = output if output else os.path.splitext(script)[0] + ".net"
+    self.args = list(args)
+    self.roots = tuple(os.path.join(directory, "") for directory in {os.path.dirname(self.script), _LIBRARY_DIR})
+    # Like when running the script directly. Also needed to reload its modules.
+    if os.path.dirname(self.script) not in sys.path:
+      sys.path.insert(0, os.path.dirname(self.script))
+    self.signatures = {}
+    # cached_sub templates of the last successful run.
+    self.templates = {}
+
+  def modules(self) -> dict:
+    """Loaded modules from watched directories, as file name -> module name, in import order."""
+    modules = {}
+    for name, module in list(sys.modules.items()):
+      filename = getattr(module, "__file__", None)
+      if filename and filename.endswith(".py") and name != "__main__":
+        filename = os.path.abspath(filename)
+        if filename.startswith(self.roots):
+          modules[filename] = name
+    return modules
+
+  def _signatures(self) -> dict:
+    signatures = {}
+    for filename in [self.script] + list(self.modules()):
+      try:
+        st = os.stat(filename)
+      except FileNotFoundError:
+        continue
+      signatures[filename] = (st.st_mtime_ns, st.st_size)
+    return signatures
+
+  def run(self) -> bool:
+    """Run the design script once. Returns True on success."""
+    before = self._signatures()
+    start = time.perf_counter()
+    saved = sys.argv, edag.process_output
+    sys.argv = [self.script] + self.args
+    edag.process_output = self.output
+    try:
+      with edag.NewGlobalScope() as schematic:
+        schematic.templates.update(self.templates)
+        runpy.run_path(self.script, run_name="__main__")
+    except (Exception, SystemExit):
+      traceback.print_exc()
+      print("edag_watch: failed, previous output kept", file=sys.stderr)
+      ok = False
+    else:
+      self.templates = dict(schematic.templates)
+      print(f"edag_watch: {self.output}: {len(schematic.registered_components)} components, "
+            f"{time.perf_counter() - start:.3f}s", file=sys.stderr)
+      ok = True
+    finally:
+      sys.argv, edag.process_output = saved
+    # Modules loaded by the run are watched too. Changes made during the run
+    # are noticed by the next poll.
+    self.signatures = self._signatures()
+    self.signatures.update(before)
+    return ok
+
+  def changed(self) -> list:
+    """File names of watched files changed since the last run."""
+    current = self._signatures()
+    return [filename for filename in set(current) | set(self.signatures)
+            if current.get(filename) != self.signatures.get(filename)]
+
+  def poll(self) -> bool:
+    """Reload changed modules and run the script again, if anything changed. Returns True if it ran."""
+    changed = self.changed()
+    if not changed:
+      return False
+    if any(os.path.dirname(f) == _LIBRARY_DIR and os.path.basename(f).startswith("edag") for f in changed):
+      print("edag_watch: edag library changed, restarting", file=sys.stderr)
+      sys.stdout.flush()
+      sys.stderr.flush()
+      os.execv(sys.executable, sys.orig_argv)
+    modules = self.modules()
+    names = [modules[f] for f in changed if f in modules]
+    loaded = {name: sys.modules[name] for name in modules.values()}
+    try:
+      reloaded = _reload(names, loaded)
+    except Exception:
+      traceback.print_exc()
+      print("edag_watch: reload failed, previous output kept", file=sys.stderr)
+      self.signatures = self._signatures()
+      return True
+    self.templates = {key: template for key, template in self.templates.items()
+                      if getattr(key[0], "__module__", None) not in reloaded | {"__main__", None}}
+    self.run()
+    return True
+
+  def loop(self, interval:float = 0.2):
+    """Run, and poll for changes every interval seconds, forever."""
+    self.run()
+    while True:
+      time.sleep(interval)
+      self.poll()
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Capture a design again, when its sources change.")
+  parser.add_argument("script", help="design script, calling edag.process()")
+  parser.add_argument("args", nargs="*", help="arguments of the design script (after --)")
+  parser.add_argument("-o", "--output", help="netlist file (default: script name with .net)")
+  parser.add_argument("--interval", type=float, default=0.2, help="polling interval in seconds")
+  args = parser.parse_args(argv)
+  try:
+    Watcher(args.script, output=args.output, args=args.args).loop(args.interval)
+  except KeyboardInterrupt:
+    return 0
+
+
+import unittest
+
+
+_TEST_DESIGN = """\
+import edag
+import {helper}
+
+edag.process(lambda: edag.cached_sub({helper}.channel, edag.net("VIN")))
+"""
+
+_TEST_HELPER = """\
+import edag
+
+@edag.Scope()
+def channel(vin):
+  edag.make_component("load", "R", [vin, edag.GND()], [], {value}, prefix="R")
+"""
+
+
+class Test_watch(unittest.TestCase):
+  def write(self, filename, text):
+    # Bump mtime explicitly, as it might have too coarse resolution.
+    mtime = os.stat(filename).st_mtime_ns + 10**9 if os.path.exists(filename) else None
+    with open(filename, "w") as f:
+      f.write(text)
+    if mtime:
+      os.utime(filename, ns=(mtime, mtime))
+
+  def test_poll(self):
+    import contextlib
+    import io
+    import tempfile
+    helper = "_edag_watch_test_helper"
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stderr(io.StringIO()) as log:
+      script = os.path.join(tmp, "board.py")
+      self.write(script, _TEST_DESIGN.format(helper=helper))
+      self.write(os.path.join(tmp, helper + ".py"), _TEST_HELPER.format(value="10.0"))
+      watcher = Watcher(script)
+      try:
+        self.assertTrue(watcher.run())
+        output = os.path.join(tmp, "board.net")
+        with open(output) as f:
+          self.assertIn('(value "10.0")', f.read())
+        self.assertTrue(os.path.exists(os.path.join(tmp, "board.edag_ids.json")))
+        self.assertEqual(len(watcher.templates), 1)
+        self.assertFalse(watcher.poll())
+
+        self.write(os.path.join(tmp, helper + ".py"), _TEST_HELPER.format(value="22.0"))
+        self.assertTrue(watcher.poll())
+        with open(output) as f:
+          self.assertIn('(value "22.0")', f.read())
+        self.assertFalse(watcher.poll())
+
+        # Only the script changed, so the template of channel is reused.
+        template = next(iter(watcher.templates.values()))
+        self.write(script, _TEST_DESIGN.format(helper=helper) + "# Comment.\n")
+        self.assertTrue(watcher.poll())
+        self.assertIs(next(iter(watcher.templates.values())), template)
+
+        # Broken module. The output stays.
+        self.write(os.path.join(tmp, helper + ".py"), "oops(")
+        self.assertTrue(watcher.poll())
+        with open(output) as f:
+          self.assertIn('(value "22.0")', f.read())
+        self.assertIn("reload failed", log.getvalue())
+      finally:
+        sys.modules.pop(helper, None)
+        sys.path.remove(tmp)
+
+  def test_imported_constant(self):
+    import contextlib
+    import io
+    import tempfile
+    helper, constants = "_edag_watch_test_helper2", "_edag_watch_test_constants"
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stderr(io.StringIO()):
+      script = os.path.join(tmp, "board.py")
+      self.write(script, _TEST_DESIGN.format(helper=helper))
+      self.write(os.path.join(tmp, helper + ".py"),
+                 f"from {constants} import VALUE\n" + _TEST_HELPER.format(value="VALUE"))
+      self.write(os.path.join(tmp, constants + ".py"), "VALUE = 10.0\n")
+      watcher = Watcher(script)
+      try:
+        self.assertTrue(watcher.run())
+        self.write(os.path.join(tmp, constants + ".py"), "VALUE = 22.0\n")
+        self.assertTrue(watcher.poll())
+        with open(os.path.join(tmp, "board.net")) as f:
+          self.assertIn('(value "22.0")', f.read())
+      finally:
+        sys.modules.pop(helper, None)
+        sys.modules.pop(constants, None)
+        sys.path.remove(tmp)
+
+  def test_imports(self):
+    module = types.ModuleType("pkg.sub.mod")
+    module.__package__ = "pkg.sub"
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+      module.__file__ = os.path.join(tmp, "mod.py")
+      with open(module.__file__, "w") as f:
+        f.write("import a.b\nfrom c import D\nfrom . import e\nfrom ..f import G\ndef h():\n  import i\n")
+      self.assertEqual(_imports(module), {"a.b", "c", "c.D", "pkg.sub", "pkg.sub.e", "pkg.f", "pkg.f.G", "i"})
+
+  def test_reload_dependents(self):
+    a = types.ModuleType("_edag_watch_a")
+    b = types.ModuleType("_edag_watch_b")
+    c = types.ModuleType("_edag_watch_c")
+    b.f = lambda: None
+    b.f.__module__ = a.__name__
+    c.g = b
+    reloaded = set()
+    original = importlib.reload
+    importlib.reload = lambda module: reloaded.add(module.__name__)
+    try:
+      self.assertEqual(_reload([a.__name__], {m.__name__: m for m in (a, b, c)}),
+                       {a.__name__, b.__name__, c.__name__})
+    finally:
+      importlib.reload = original
+    self.assertEqual(reloaded, {a.__name__, b.__name__, c.__name__})
+    self.assertFalse(hasattr(b, "f"))
+
+
+if __name__ == '__main__':
+  sys.exit(main())
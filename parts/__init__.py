@@ -0,0 +1,23 @@
+"""Part libraries.
+
+Parts modules are imported only when one of their names is used, i.e.
+`from parts import lm7805` imports parts.edag_linear, but no other parts
+module. See _manifest.py.
+"""
+
+import importlib
+
+from parts._manifest import MANIFEST
+
+
+def __getattr__(name:str):
+  module = MANIFEST.get(name)
+  if module is None:
+    raise AttributeError(f"module 'parts' has no attribute '{name}'")
+  value = getattr(importlib.import_module(f"parts.{module}"), name)
+  globals()[name] = value
+  return value
+
+
+def __dir__():
+  return sorted(set(globals()) | set(MANIFEST))
@@ -0,0 +1,24 @@
+# Generated by edag_catalog.write_manifest(). Do not edit.
+#
+# Public names of parts modules -> module defining them, for lazy imports.
+
+MANIFEST = {
+  'regulator_class': 'edag_linear',
+  'lm7805': 'edag_linear',
+  'lm7806': 'edag_linear',
+  'lm7808': 'edag_linear',
+  'lm7809': 'edag_linear',
+  'lm7810': 'edag_linear',
+  'lm7812': 'edag_linear',
+  'lm7815': 'edag_linear',
+  'lm7818': 'edag_linear',
+  'lm7824': 'edag_linear',
+  'bl1117_12': 'edag_linear',
+  'bl1117_15': 'edag_linear',
+  'bl1117_18': 'edag_linear',
+  'bl1117_25': 'edag_linear',
+  'bl1117_33': 'edag_linear',
+  'bl1117_50': 'edag_linear',
+  'microusb_b_connector': 'edag_usb',
+  'input_protection': 'edag_usb',
+}
@@ -131,3 +131,78 @@ bl1117_12 = regulator_class("bl1117-12", 12)
 "LT1962 series"  # 300mA, Low Noise, LDO voltage regulator, micropower. 30uA I_Q. 20uV_{RMS} noise.
 "LT1963"  # 1.5A, Low Noise, LDO voltage regulator. Fast transient Response. 40uV_{RMS} noise. SOT-223.
 "LT1764"  # 3A, Low Noise, LDO voltage regulator. Fast transient response. 40uV_{RMS} noise. 340mV dropout.
+
+
+# Structured entries, indexed by edag_catalog. Only literals are allowed here,
+# as the index is built without importing this module. Values in SI units,
+# accuracy in %. packages maps package -> pin map (or None if not known), with
+# pins named like the keyword arguments of the factory.
+CATALOG = [
+  {"name": "LM7805", "kind": "linear", "factory": "lm7805", "voltage": 5.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+  {"name": "LM7806", "kind": "linear", "factory": "lm7806", "voltage": 6.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+  {"name": "LM7808", "kind": "linear", "factory": "lm7808", "voltage": 8.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+  {"name": "LM7809", "kind": "linear", "factory": "lm7809", "voltage": 9.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+  {"name": "LM7810", "kind": "linear", "factory": "lm7810", "voltage": 10.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+  {"name": "LM7812", "kind": "linear", "factory": "lm7812", "voltage": 12.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+  {"name": "LM7815", "kind": "linear", "factory": "lm7815", "voltage": 15.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+  {"name": "LM7818", "kind": "linear", "factory": "lm7818", "voltage": 18.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+  {"name": "LM7824", "kind": "linear", "factory": "lm7824", "voltage": 24.0, "current": 1.5, "dropout": 2.0, "accuracy": 4,
+   "packages": {"TO-220": {"input": 1, "gnd": 2, "output": 3}}},
+
+  {"name": "BL1117-15", "kind": "ldo", "manufacturer": "Shanghai Belling", "factory": "bl1117_15", "voltage": 1.5,
+   "current": 1.0, "dropout": 1.3, "accuracy": 2, "quiescent_current": 2.0e-3, "input_voltage_max": 15.0,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "BL1117-18", "kind": "ldo", "manufacturer": "Shanghai Belling", "factory": "bl1117_18", "voltage": 1.8,
+   "current": 1.0, "dropout": 1.3, "accuracy": 2, "quiescent_current": 2.0e-3, "input_voltage_max": 15.0,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "BL1117-25", "kind": "ldo", "manufacturer": "Shanghai Belling", "factory": "bl1117_25", "voltage": 2.5,
+   "current": 1.0, "dropout": 1.3, "accuracy": 2, "quiescent_current": 2.0e-3, "input_voltage_max": 15.0,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "BL1117-33", "kind": "ldo", "manufacturer": "Shanghai Belling", "factory": "bl1117_33", "voltage": 3.3,
+   "current": 1.0, "dropout": 1.3, "accuracy": 2, "quiescent_current": 2.0e-3, "input_voltage_max": 15.0,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "BL1117-50", "kind": "ldo", "manufacturer": "Shanghai Belling", "factory": "bl1117_50", "voltage": 5.0,
+   "current": 1.0, "dropout": 1.3, "accuracy": 2, "quiescent_current": 2.0e-3, "input_voltage_max": 15.0,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  # bl1117_12 is the 12V one (the 1.2V variant is shadowed above).
+  {"name": "BL1117-12", "kind": "ldo", "manufacturer": "Shanghai Belling", "factory": "bl1117_12", "voltage": 12.0,
+   "current": 1.0, "dropout": 1.3, "accuracy": 2, "quiescent_current": 2.0e-3, "input_voltage_max": 20.0,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+
+  {"name": "AMS1117-1.5", "kind": "ldo", "manufacturer": "Advanced Monolithic Systems", "voltage": 1.5,
+   "current": 1.0, "dropout": 1.0, "accuracy": 1.5,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "AMS1117-1.8", "kind": "ldo", "manufacturer": "Advanced Monolithic Systems", "voltage": 1.8,
+   "current": 1.0, "dropout": 1.0, "accuracy": 1.5,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "AMS1117-2.5", "kind": "ldo", "manufacturer": "Advanced Monolithic Systems", "voltage": 2.5,
+   "current": 1.0, "dropout": 1.0, "accuracy": 1.5,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "AMS1117-2.85", "kind": "ldo", "manufacturer": "Advanced Monolithic Systems", "voltage": 2.85,
+   "current": 1.0, "dropout": 1.0, "accuracy": 1.5,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "AMS1117-3.3", "kind": "ldo", "manufacturer": "Advanced Monolithic Systems", "voltage": 3.3,
+   "current": 1.0, "dropout": 1.0, "accuracy": 1.5,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "AMS1117-5.0", "kind": "ldo", "manufacturer": "Advanced Monolithic Systems", "voltage": 5.0,
+   "current": 1.0, "dropout": 1.0, "accuracy": 1.5,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}, "TO-252": {"gnd": 1, "output": 2, "input": 3}}},
+
+  {"name": "LM1117-3.3", "kind": "ldo", "manufacturer": "Texas Instruments", "voltage": 3.3,
+   "current": 0.8, "dropout": 1.2, "accuracy": 1,
+   "packages": {"SOT-223": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "XC6206P332MR", "kind": "ldo", "manufacturer": "Torex", "voltage": 3.3,
+   "current": 0.2, "dropout": 0.25, "accuracy": 2,
+   "packages": {"SOT-23": {"gnd": 1, "output": 2, "input": 3}}},
+  {"name": "LT1761-5", "kind": "ldo", "manufacturer": "Linear Technology", "voltage": 5.0,
+   "current": 0.1, "dropout": 0.3, "noise_rms": 20.0e-6, "quiescent_current": 20.0e-6,
+   "packages": {"TSOT-23-5": {"input": 1, "gnd": 2, "shdn": 3, "byp": 4, "output": 5}}},
+]
@@ -84,3 +84,46 @@
 "LT1389"  # Nanopower shunt reference. 800nA operating current.
 "LT1460"  # Micropower reference. SOT-23. 2.5V, 5V, 10V.
 "LT1634"  # Micropower shunt reference. 0.05%, 10ppm/°C, MSOP.
+
+
+# Structured entries, indexed by edag_catalog (see parts/edag_linear.py).
+# Drift in ppm/K, noise_pp is 0.1Hz - 10Hz peak to peak.
+CATALOG = [
+  {"name": "TL431", "kind": "shunt_reference", "manufacturer": "Texas Instruments", "voltage": 2.495, "accuracy": 0.5,
+   "packages": {"TO-92": {"ref": 1, "anode": 2, "cathode": 3}, "SOT-23": None, "SOIC-8": None}},
+  {"name": "TL432", "kind": "shunt_reference", "manufacturer": "Texas Instruments", "voltage": 2.495, "accuracy": 0.5,
+   "packages": {"SOT-23": None}},
+  {"name": "LM4040-2.5", "kind": "shunt_reference", "manufacturer": "Texas Instruments", "voltage": 2.5,
+   "accuracy": 0.1, "drift": 100,
+   "packages": {"SOT-23": {"cathode": 1, "anode": 2}}},
+  {"name": "MAX6009", "kind": "shunt_reference", "manufacturer": "Maxim Integrated", "voltage": 3.0,
+   "accuracy": 0.2, "drift": 30,
+   "packages": {"SOT-23": None, "SOIC-8": None}},
+  {"name": "LT1021-5", "kind": "reference", "manufacturer": "Linear Technology", "voltage": 5.0,
+   "drift": 5, "noise_pp": 5.0e-6,
+   "packages": {"SOIC-8": {"input": 2, "gnd": 4, "trim": 5, "output": 6}}},
+  {"name": "LT1021-7", "kind": "reference", "manufacturer": "Linear Technology", "voltage": 7.0,
+   "drift": 5, "noise_pp": 7.0e-6,
+   "packages": {"SOIC-8": {"input": 2, "gnd": 4, "output": 6}}},
+  {"name": "LT1021-10", "kind": "reference", "manufacturer": "Linear Technology", "voltage": 10.0,
+   "drift": 5, "noise_pp": 10.0e-6,
+   "packages": {"SOIC-8": {"input": 2, "gnd": 4, "trim": 5, "output": 6}}},
+  {"name": "ADR420", "kind": "reference", "manufacturer": "Analog Devices", "voltage": 2.048,
+   "drift": 1, "accuracy": 0.04, "noise_pp": 1.75e-6,
+   "packages": {"SOIC-8": {"input": 2, "gnd": 4, "trim": 5, "output": 6}, "MSOP-8": None}},
+  {"name": "ADR421", "kind": "reference", "manufacturer": "Analog Devices", "voltage": 2.5,
+   "drift": 1, "accuracy": 0.04, "noise_pp": 1.75e-6,
+   "packages": {"SOIC-8": {"input": 2, "gnd": 4, "trim": 5, "output": 6}, "MSOP-8": None}},
+  {"name": "ADR423", "kind": "reference", "manufacturer": "Analog Devices", "voltage": 3.0,
+   "drift": 1, "accuracy": 0.04, "noise_pp": 2.0e-6,
+   "packages": {"SOIC-8": {"input": 2, "gnd": 4, "trim": 5, "output": 6}, "MSOP-8": None}},
+  {"name": "ADR425", "kind": "reference", "manufacturer": "Analog Devices", "voltage": 5.0,
+   "drift": 1, "accuracy": 0.04, "noise_pp": 3.4e-6,
+   "packages": {"SOIC-8": {"input": 2, "gnd": 4, "trim": 5, "output": 6}, "MSOP-8": None}},
+  {"name": "LTC6655-2.5", "kind": "reference", "manufacturer": "Linear Technology", "voltage": 2.5,
+   "drift": 2, "accuracy": 0.025, "noise_pp": 0.65e-6,
+   "packages": {"MSOP-8": None}},
+  {"name": "LTZ1000", "kind": "reference", "manufacturer": "Linear Technology", "voltage": 7.2,
+   "drift": 0.05,
+   "packages": {"TO-5-8": None}},
+]